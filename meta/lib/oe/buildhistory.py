@@ -0,0 +1,300 @@
+#
+# Helpers for writing and committing buildhistory reports
+#
+
+import os
+import stat
+import hashlib
+import subprocess
+
+# Cut-down variants of depends.dot (for readability), each dropping the
+# lines containing any of its strings from the one before it
+depends_variants = [
+    ("depends-nokernel.dot", ["kernel_image", "kernel-2", "kernel-3"]),
+    ("depends-nokernel-nolibc.dot", ["libc6", "libgcc"]),
+    ("depends-nokernel-nolibc-noupdate.dot", ["update-"]),
+    ("depends-nokernel-nolibc-noupdate-nomodules.dot", ["kernel-module"]),
+]
+
+def write_atomic(fn, lines):
+    """Write lines, each followed by a newline, to fn via a temporary file"""
+    tmpfn = fn + ".tmp"
+    with open(tmpfn, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+    os.rename(tmpfn, fn)
+
+def depends_graph(pkgs):
+    """
+    Return the lines of the dot graph of the dependencies in pkgs, a dict
+    as returned by image_list_installed_packages() with each package's
+    "deps" list holding names optionally suffixed with " [REC]".
+    """
+    edges = set()
+    for pkg in pkgs:
+        for dep in pkgs[pkg]["deps"]:
+            if dep.endswith(" [REC]"):
+                edges.add('"%s" -> "%s" [style=dotted];' % (pkg, dep[:-6]))
+            else:
+                edges.add('"%s" -> "%s";' % (pkg, dep))
+    return ["digraph depends {", "    node [shape=plaintext]"] + sorted(edges) + ["}"]
+
+def installed_sizes(pkgs, sizes):
+    """
+    Return the lines of the installed package size report, largest first,
+    given sizes mapping package names to their size in bytes. Packages with
+    no known size are left out.
+    """
+    report = []
+    for pkg in pkgs:
+        if pkg in sizes:
+            report.append(((sizes[pkg] + 1024 // 2) // 1024, pkg))
+    report.sort(reverse=True)
+    return ["%d\tKiB %s" % entry for entry in report]
+
+def write_installed(outdir, pkgs, sizes, variants=True):
+    """
+    Write the installed package lists, installed-package-sizes.txt and
+    depends.dot for the packages in pkgs to outdir, plus the cut-down
+    depends graphs if variants is set.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    names = sorted(pkgs)
+    write_atomic(os.path.join(outdir, "installed-package-names.txt"), names)
+    write_atomic(os.path.join(outdir, "installed-packages.txt"),
+                 [os.path.basename(pkgs[pkg]["filename"]) for pkg in names])
+    write_atomic(os.path.join(outdir, "installed-package-sizes.txt"), installed_sizes(pkgs, sizes))
+
+    graph = depends_graph(pkgs)
+    write_atomic(os.path.join(outdir, "depends.dot"), graph)
+    if variants:
+        for fn, excludes in depends_variants:
+            graph = [line for line in graph if not any(e in line for e in excludes)]
+            write_atomic(os.path.join(outdir, fn), graph)
+
+class GitError(Exception):
+    pass
+
+def record_change(journal, path):
+    """
+    Note in journal that files under path were written or removed, so
+    commit_changes() checks that part of the tree. Each call appends one
+    short line so tasks running in parallel can share the journal.
+    """
+    dirname = os.path.dirname(journal)
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Created by a parallel task
+            pass
+    with open(journal, "a") as f:
+        f.write(os.path.abspath(path) + "\n")
+
+def _git(repodir, args, data=None):
+    proc = subprocess.Popen(["git"] + args, cwd=repodir, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = proc.communicate(data)
+    if proc.returncode:
+        raise GitError("git %s failed: %s" % (" ".join(args[:2]), errors.strip()))
+    return output
+
+def _head_files(repodir, paths):
+    """Return {path: (mode, sha)} for the files in HEAD under paths (everything if paths is None)"""
+    files = {}
+    if paths is None:
+        chunks = [[]]
+    else:
+        paths = sorted(paths)
+        chunks = [paths[i:i + 500] for i in range(0, len(paths), 500)]
+    for chunk in chunks:
+        if paths is not None and not chunk:
+            continue
+        output = _git(repodir, ["ls-tree", "-r", "-z", "--full-tree", "HEAD", "--"] + chunk)
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            info, path = entry.split("\t", 1)
+            mode, objtype, sha = info.split()
+            if objtype == "blob":
+                files[path] = (mode, sha)
+    return files
+
+def _blob_sha(data):
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def _read_entry(path):
+    """Return the git mode and content of the file or symlink at path"""
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode):
+        return "120000", os.readlink(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    if st.st_mode & stat.S_IXUSR:
+        return "100755", data
+    return "100644", data
+
+def _worktree_files(repodir, paths, exclude):
+    """Return {path: (mode, sha)} for the files on disk under paths (everything if paths is None)"""
+    files = {}
+    repodir = os.path.abspath(repodir)
+    for top in (["."] if paths is None else paths):
+        toppath = os.path.normpath(os.path.join(repodir, top))
+        if os.path.islink(toppath) or os.path.isfile(toppath):
+            candidates = [toppath]
+        else:
+            candidates = []
+            for root, dirs, filenames in os.walk(toppath):
+                if root == repodir and ".git" in dirs:
+                    dirs.remove(".git")
+                candidates.extend(os.path.join(root, fn) for fn in filenames)
+                # os.walk lists symlinks to directories as directories
+                candidates.extend(os.path.join(root, dn) for dn in dirs if os.path.islink(os.path.join(root, dn)))
+        for fullpath in candidates:
+            rel = os.path.relpath(fullpath, repodir)
+            if rel in exclude:
+                continue
+            mode, data = _read_entry(fullpath)
+            files[rel] = (mode, _blob_sha(data))
+    return files
+
+def _journal_paths(repodir, journal):
+    """
+    Return the paths relative to repodir recorded in journal with those
+    inside another one dropped, or None if the whole tree needs checking
+    """
+    try:
+        with open(journal, "r") as f:
+            lines = f.read().split("\n")
+    except IOError:
+        # Nothing has been journalled yet
+        return None
+    paths = set()
+    for line in lines:
+        if not line:
+            continue
+        rel = os.path.relpath(line, repodir)
+        if rel == ".":
+            return None
+        if not rel.startswith(".." + os.sep):
+            paths.add(rel)
+    result = []
+    for rel in sorted(paths):
+        if not result or not rel.startswith(result[-1] + os.sep):
+            result.append(rel)
+    return result
+
+def _quote(path):
+    if path.startswith('"') or "\n" in path or "\\" in path:
+        return '"%s"' % path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return path
+
+def _data(content):
+    return b"data %d\n" % len(content) + content + b"\n"
+
+def _ignore(repodir, path):
+    """Make sure git ignores path without adding a .gitignore to the history"""
+    excludefile = os.path.join(repodir, ".git", "info", "exclude")
+    pattern = "/" + path
+    content = ""
+    try:
+        with open(excludefile, "r") as f:
+            content = f.read()
+    except IOError:
+        if not os.path.exists(os.path.dirname(excludefile)):
+            os.makedirs(os.path.dirname(excludefile))
+    if pattern in content.split("\n"):
+        return
+    with open(excludefile, "a") as f:
+        if content and not content.endswith("\n"):
+            f.write("\n")
+        f.write(pattern + "\n")
+
+def commit_changes(repodir, journal, message, author, metafile="metadata-revs"):
+    """
+    Commit the changes to the files in the paths recorded in journal (the
+    whole tree when there is no journal) and to metafile, one commit per
+    top level directory containing changes with metafile going into the
+    first, or a single empty commit (still containing metafile) if nothing
+    else changed. message is a function returning the commit message for
+    a top level directory name, or "No changes"; author an
+    "Name <email>" string.
+
+    The commits are written with git fast-import rather than through the
+    index and the index is then updated for the changed paths alone, so
+    the rest of the working tree is never scanned. Returns the number of
+    commits written.
+    """
+    try:
+        head = _git(repodir, ["rev-parse", "-q", "--verify", "HEAD"]).strip()
+    except GitError:
+        head = None
+    ref = _git(repodir, ["symbolic-ref", "-q", "HEAD"]).strip()
+    ident = _git(repodir, ["var", "GIT_COMMITTER_IDENT"]).strip()
+    timestamp = ident.rsplit(" ", 2)[1:]
+
+    paths = _journal_paths(repodir, journal) if head else None
+    exclude = set([metafile])
+    if os.path.abspath(journal).startswith(os.path.abspath(repodir) + os.sep):
+        exclude.add(os.path.relpath(journal, repodir))
+        _ignore(repodir, os.path.relpath(journal, repodir))
+    changes = {}
+    if paths is None or paths:
+        old = _head_files(repodir, paths) if head else {}
+        new = _worktree_files(repodir, paths, exclude)
+        for path in set(old) | set(new):
+            if path not in exclude and old.get(path) != new.get(path):
+                changes.setdefault(path.split(os.sep, 1)[0], []).append(path)
+
+    metachanged = False
+    if os.path.exists(os.path.join(repodir, metafile)):
+        metamode, metadata = _read_entry(os.path.join(repodir, metafile))
+        oldmeta = _head_files(repodir, [metafile]).get(metafile) if head else None
+        metachanged = oldmeta != (metamode, _blob_sha(metadata))
+
+    sections = sorted(changes) or [None]
+    proc = subprocess.Popen(["git", "fast-import", "--quiet"], cwd=repodir,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for section in sections:
+            proc.stdin.write(b"commit %s\n" % ref)
+            proc.stdin.write(b"author %s %s\n" % (author, " ".join(timestamp)))
+            proc.stdin.write(b"committer %s\n" % ident)
+            msg = "\n".join(line.rstrip() for line in message(section or "No changes").strip().split("\n")) + "\n"
+            proc.stdin.write(_data(msg))
+            if head and section == sections[0]:
+                proc.stdin.write(b"from %s\n" % head)
+            entries = sorted(changes.get(section, []))
+            if metachanged and section == sections[0]:
+                entries.append(metafile)
+            for path in entries:
+                fullpath = os.path.join(repodir, path)
+                if os.path.lexists(fullpath):
+                    mode, data = _read_entry(fullpath)
+                    proc.stdin.write(b"M %s inline %s\n" % (mode, _quote(path)))
+                    proc.stdin.write(_data(data))
+                else:
+                    proc.stdin.write(b"D %s\n" % _quote(path))
+            proc.stdin.write(b"\n")
+    except IOError:
+        # fast-import exited early, the error is reported below
+        pass
+    output, errors = proc.communicate()
+    if proc.returncode:
+        raise GitError("git fast-import failed: %s" % errors.strip())
+
+    # Bring the index in line with the new commits
+    updated = [path for section in changes for path in changes[section]]
+    if metachanged:
+        updated.append(metafile)
+    if updated:
+        _git(repodir, ["update-index", "--add", "--remove", "-z", "--stdin"], "\0".join(updated) + "\0")
+    if changes:
+        _git(repodir, ["gc", "--auto", "--quiet"])
+
+    # Everything journalled is now committed
+    if os.path.exists(os.path.dirname(journal)):
+        open(journal, "w").close()
+    return len(sections)
@@ -51,6 +51,19 @@ class ChangeRecord:
     def __str__(self):
         return self._str_internal(True)
 
+    def to_dict(self, outer=True):
+        """Return the change as a dict of plain values, e.g. for JSON output"""
+        chgdict = {'path': self.path,
+                   'field': self.fieldname,
+                   'oldvalue': self.oldvalue,
+                   'newvalue': self.newvalue,
+                   'monitored': bool(self.monitored)}
+        if self.filechanges:
+            chgdict['filechanges'] = [fc.to_dict() for fc in self.filechanges]
+        if outer:
+            chgdict['related'] = [chg.to_dict(False) for chg in self.related]
+        return chgdict
+
     def _str_internal(self, outer):
         if outer:
             if '/image-files/' in self.path:
@@ -154,6 +167,12 @@ class FileChange:
         self.oldvalue = oldvalue
         self.newvalue = newvalue
 
+    def to_dict(self):
+        return {'path': self.path,
+                'changetype': self.changetype,
+                'oldvalue': self.oldvalue,
+                'newvalue': self.newvalue}
+
     def _ftype_str(self, ftype):
         if ftype == '-':
             return 'file'
@@ -189,10 +208,25 @@ class FileChange:
             return '%s changed (unknown)' % self.path
 
 
+def blob_lines(blob, blocksize=65536):
+    """Yield the lines of a git blob, reading it a block at a time"""
+    stream = blob.data_stream
+    pending = ''
+    while True:
+        data = stream.read(blocksize)
+        if not data:
+            break
+        lines = (pending + data).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
 def blob_to_dict(blob):
-    alines = blob.data_stream.read().splitlines()
     adict = {}
-    for line in alines:
+    for line in blob_lines(blob):
         splitv = [i.strip() for i in line.split('=',1)]
         if len(splitv) > 1:
             adict[splitv[0]] = splitv[1]
@@ -258,8 +292,10 @@ def compare_file_lists(alines, blines):
 
 
 def compare_lists(alines, blines):
-    removed = list(set(alines) - set(blines))
-    added = list(set(blines) - set(alines))
+    aset = set(alines)
+    bset = set(blines)
+    removed = list(aset - bset)
+    added = list(bset - aset)
 
     filechanges = []
     for pkg in removed:
@@ -384,17 +420,13 @@ def process_changes(repopath, revision1, revision2='HEAD', report_all=False, rep
             filename = os.path.basename(d.a_blob.path)
             if filename in img_monitor_files:
                 if filename == 'files-in-image.txt':
-                    alines = d.a_blob.data_stream.read().splitlines()
-                    blines = d.b_blob.data_stream.read().splitlines()
-                    filechanges = compare_file_lists(alines,blines)
+                    filechanges = compare_file_lists(blob_lines(d.a_blob), blob_lines(d.b_blob))
                     if filechanges:
                         chg = ChangeRecord(path, filename, None, None, True)
                         chg.filechanges = filechanges
                         changes.append(chg)
                 elif filename == 'installed-package-names.txt':
-                    alines = d.a_blob.data_stream.read().splitlines()
-                    blines = d.b_blob.data_stream.read().splitlines()
-                    filechanges = compare_lists(alines,blines)
+                    filechanges = compare_lists(blob_lines(d.a_blob), blob_lines(d.b_blob))
                     if filechanges:
                         chg = ChangeRecord(path, filename, None, None, True)
                         chg.filechanges = filechanges
@@ -410,24 +442,20 @@ def process_changes(repopath, revision1, revision2='HEAD', report_all=False, rep
 
     # Look for added preinst/postinst/prerm/postrm
     # (without reporting newly added recipes)
-    addedpkgs = []
+    addedpkgs = set()
     addedchanges = []
     for d in diff.iter_change_type('A'):
         path = os.path.dirname(d.b_blob.path)
         if path.startswith('packages/'):
             filename = os.path.basename(d.b_blob.path)
             if filename == 'latest':
-                addedpkgs.append(path)
+                addedpkgs.add(path)
             elif filename.startswith('latest.'):
                 chg = ChangeRecord(path, filename[7:], '', d.b_blob.data_stream.read(), True)
                 addedchanges.append(chg)
     for chg in addedchanges:
-        found = False
-        for pkg in addedpkgs:
-            if chg.path.startswith(pkg):
-                found = True
-                break
-        if not found:
+        # Equivalent to checking chg.path.startswith() for every added package
+        if not any(chg.path[:i] in addedpkgs for i in range(1, len(chg.path) + 1)):
             changes.append(chg)
 
     # Look for cleared preinst/postinst/prerm/postrm
@@ -439,16 +467,22 @@ def process_changes(repopath, revision1, revision2='HEAD', report_all=False, rep
                 chg = ChangeRecord(path, filename[7:], d.a_blob.data_stream.read(), '', True)
                 changes.append(chg)
 
-    # Link related changes
+    # Link related changes, only looking at the changes to the same path
+    # (or its dirname, in the case of fields from recipe info files)
+    bypath = {}
+    for idx, chg in enumerate(changes):
+        bypath.setdefault(chg.path, []).append((idx, chg))
     for chg in changes:
         if chg.monitored:
-            for chg2 in changes:
-                # (Check dirname in the case of fields from recipe info files)
-                if chg.path == chg2.path or os.path.dirname(chg.path) == chg2.path:
-                    if chg2.fieldname in related_fields.get(chg.fieldname, []):
-                        chg.related.append(chg2)
-                    elif chg.path == chg2.path and chg.path.startswith('packages/') and chg2.fieldname in ['PE', 'PV', 'PR']:
-                        chg.related.append(chg2)
+            candidates = bypath[chg.path]
+            dirname = os.path.dirname(chg.path)
+            if dirname != chg.path and dirname in bypath:
+                candidates = sorted(candidates + bypath[dirname])
+            for _, chg2 in candidates:
+                if chg2.fieldname in related_fields.get(chg.fieldname, []):
+                    chg.related.append(chg2)
+                elif chg.path == chg2.path and chg.path.startswith('packages/') and chg2.fieldname in ['PE', 'PV', 'PR']:
+                    chg.related.append(chg2)
 
     if report_all:
         return changes
@@ -3,8 +3,16 @@
 # repeated stat calls. Its assumed the files will not change from under us
 # so we can cache stat calls.
 #
+# Directory listings read by walk() are kept along with the type of each
+# entry and the mtime of the directory, and are reused for as long as the
+# mtime doesn't change, which takes one stat per directory rather than one
+# per entry. The listings can be saved to a file and seeded into the
+# CachedPath of a later task walking the same trees.
+#
 
 import os
+import time
+import json
 import errno
 import stat as statmod
 
@@ -13,6 +21,12 @@ class CachedPath(object):
         self.statcache = {}
         self.lstatcache = {}
         self.normpathcache = {}
+        # path -> file type bits from a directory listing (lstat() based)
+        self.typecache = {}
+        # directory -> (mtime, [(name, file type bits)])
+        self.listcache = {}
+        # directories changed too recently for their listing to be kept
+        self.recentdirs = set()
         return
 
     def updatecache(self, x):
@@ -21,6 +35,8 @@ class CachedPath(object):
             del self.statcache[x]
         if x in self.lstatcache:
             del self.lstatcache[x]
+        if x in self.typecache:
+            del self.typecache[x]
 
     def normpath(self, path):
         if path in self.normpathcache:
@@ -67,45 +83,54 @@ class CachedPath(object):
             self.statcache[path] = False
             return False
 
+    # File type bits of a path, 0 if it doesn't exist, from a directory
+    # listing where possible
+    def _lmode(self, path):
+        path = self.normpath(path)
+        if path not in self.lstatcache and path in self.typecache:
+            return self.typecache[path]
+        st = self.calllstat(path)
+        if not st:
+            return 0
+        return statmod.S_IFMT(st.st_mode)
+
+    def _mode(self, path):
+        path = self.normpath(path)
+        if path not in self.statcache and path in self.typecache:
+            mode = self.typecache[path]
+            if not statmod.S_ISLNK(mode):
+                return mode
+        st = self.callstat(path)
+        if not st:
+            return 0
+        return statmod.S_IFMT(st.st_mode)
+
     # This follows symbolic links, so both islink() and isdir() can be true
     # for the same path ono systems that support symlinks
     def isfile(self, path):
         """Test whether a path is a regular file"""
-        st = self.callstat(path)
-        if not st:
-            return False
-        return statmod.S_ISREG(st.st_mode)
+        return statmod.S_ISREG(self._mode(path))
 
     # Is a path a directory?
     # This follows symbolic links, so both islink() and isdir()
     # can be true for the same path on systems that support symlinks
     def isdir(self, s):
         """Return true if the pathname refers to an existing directory."""
-        st = self.callstat(s)
-        if not st:
-            return False
-        return statmod.S_ISDIR(st.st_mode)
+        return statmod.S_ISDIR(self._mode(s))
 
     def islink(self, path):
         """Test whether a path is a symbolic link"""
-        st = self.calllstat(path)
-        if not st:
-            return False
-        return statmod.S_ISLNK(st.st_mode)
+        return statmod.S_ISLNK(self._lmode(path))
 
     # Does a path exist?
     # This is false for dangling symbolic links on systems that support them.
     def exists(self, path):
         """Test whether a path exists.  Returns False for broken symbolic links"""
-        if self.callstat(path):
-            return True
-        return False
+        return self._mode(path) != 0
 
     def lexists(self, path):
         """Test whether a path exists.  Returns True for broken symbolic links"""
-        if self.calllstat(path):
-            return True
-        return False
+        return self._lmode(path) != 0
 
     def stat(self, path):
         return self.callstat(path)
@@ -122,7 +147,7 @@ class CachedPath(object):
         # minor reason when (say) a thousand readable directories are still
         # left to visit.  That logic is copied here.
         try:
-            names = os.listdir(top)
+            names = self.listdir(top)
         except os.error as err:
             if onerror is not None:
                 onerror(err)
@@ -145,6 +170,101 @@ class CachedPath(object):
         if not topdown:
             yield top, dirs, nondirs
 
+    def _readdir(self, top):
+        entries = []
+        if hasattr(os, "scandir"):
+            # The type comes from the directory entry, without a stat
+            for entry in os.scandir(top):
+                if entry.is_symlink():
+                    mode = statmod.S_IFLNK
+                elif entry.is_dir(follow_symlinks=False):
+                    mode = statmod.S_IFDIR
+                elif entry.is_file(follow_symlinks=False):
+                    mode = statmod.S_IFREG
+                else:
+                    mode = statmod.S_IFMT(entry.stat(follow_symlinks=False).st_mode)
+                entries.append((entry.name, mode))
+        else:
+            for name in os.listdir(top):
+                st = self.calllstat(os.path.join(top, name))
+                if st:
+                    entries.append((name, statmod.S_IFMT(st.st_mode)))
+        return entries
+
+    def listdir(self, top):
+        """Return the names in directory top, reusing the previous listing if top is unchanged"""
+        top = self.normpath(top)
+        st = os.stat(top)
+        cached = self.listcache.get(top)
+        if cached is None or cached[0] != st.st_mtime:
+            entries = self._readdir(top)
+            # A change in the same clock tick as the listing wouldn't
+            # change the mtime, so only recently changed directories
+            # are listed again every time
+            if time.time() - st.st_mtime >= 1:
+                self.listcache[top] = (st.st_mtime, entries)
+                self.recentdirs.discard(top)
+            else:
+                self.listcache.pop(top, None)
+                self.recentdirs.add(top)
+            cached = (st.st_mtime, entries)
+        for name, mode in cached[1]:
+            self.typecache[os.path.join(top, name)] = mode
+        return [name for name, mode in cached[1]]
+
+    def save(self, fn, roots):
+        """
+        Write the directory listings under the directories in roots to fn.
+        Directories which were too recently changed to be cached when walked
+        are listed again, so this should be called once the trees are done.
+        """
+        roots = [self.normpath(root) for root in roots]
+        def under_roots(top):
+            return any(top == root or top.startswith(root + os.sep) for root in roots)
+
+        listings = {}
+        for top, cached in self.listcache.items():
+            if under_roots(top):
+                listings[top] = [cached[0], cached[1]]
+        for top in self.recentdirs:
+            if not under_roots(top):
+                continue
+            try:
+                mtime = os.stat(top).st_mtime
+                entries = self._readdir(top)
+                if os.stat(top).st_mtime != mtime:
+                    continue
+            except OSError:
+                continue
+            listings[top] = [mtime, entries]
+        tmpfn = "%s.%s" % (fn, os.getpid())
+        with open(tmpfn, "w") as f:
+            json.dump(listings, f)
+        os.rename(tmpfn, fn)
+
+    def seed(self, fn):
+        """
+        Add the directory listings saved in fn by save(), possibly by another
+        task, to the cache. Listings of directories which changed since are
+        left out. Returns the number of listings added.
+        """
+        try:
+            with open(fn, "r") as f:
+                listings = json.load(f)
+        except (IOError, OSError, ValueError):
+            return 0
+        count = 0
+        for top in listings:
+            mtime, entries = listings[top]
+            try:
+                st = os.stat(top)
+            except OSError:
+                continue
+            if st.st_mtime == mtime:
+                self.listcache[str(top)] = (mtime, [(str(name), mode) for name, mode in entries])
+                count += 1
+        return count
+
     ## realpath() related functions
     def __is_path_below(self, file, root):
         return (file + os.path.sep).startswith(root)
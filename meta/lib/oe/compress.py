@@ -0,0 +1,376 @@
+#
+# Pluggable stream compressors used when writing build artefacts
+#
+# Compressors are registered by name with a writer and a reader factory.
+# Writers take a file object to write the compressed stream to and
+# return a file-like object accepting uncompressed data; closing it
+# flushes the stream but leaves the underlying file object open. The magic
+# bytes a format starts with let readers be picked by detect_compressor()
+# whatever the stream was written with.
+#
+
+import bz2
+import collections
+import gzip
+import hashlib
+import struct
+import zlib
+
+compressors = {}
+magics = []
+
+def register_compressor(name, writer, reader, magic=None):
+    compressors[name] = (writer, reader)
+    if magic:
+        magics.append((magic, name))
+
+def _lookup(name):
+    try:
+        return compressors[name]
+    except KeyError:
+        raise ValueError("Unknown compressor '%s', expected one of %s" % (name, ", ".join(sorted(compressors))))
+
+def compress_writer(name, fileobj, level=None, threads=None):
+    return _lookup(name)[0](fileobj, level=level, threads=threads)
+
+def decompress_reader(name, fileobj):
+    return _lookup(name)[1](fileobj)
+
+def detect_compressor(fileobj):
+    """
+    Return the name of the compressor whose magic bytes the seekable
+    fileobj starts with at its current position, or None, leaving the
+    position unchanged
+    """
+    pos = fileobj.tell()
+    head = fileobj.read(max(len(magic) for magic, name in magics))
+    fileobj.seek(pos)
+    for magic, name in magics:
+        if head.startswith(magic):
+            return name
+    return None
+
+def gzip_member(data, level=6):
+    """
+    Compress data into a complete, self-contained gzip member. A
+    concatenation of members is itself a valid gzip stream, which is what
+    allows blocks to be compressed independently.
+    """
+    compobj = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compobj.compress(data) + compobj.flush()
+    # Magic, deflate, no flags, no mtime, no extra flags, Unix
+    header = struct.pack("<BBBBLBB", 0x1f, 0x8b, 8, 0, 0, 0, 3)
+    trailer = struct.pack("<LL", zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return header + body + trailer
+
+class ParallelBlockFile(object):
+    """
+    File-like writer which splits its input into fixed size blocks and
+    compresses them separately with compress_block(data, level) in a pool
+    of threads (zlib and bz2 release the GIL while compressing), for
+    formats where a concatenation of compressed blocks is a valid stream.
+    Output order is preserved and at most a couple of blocks per thread are
+    held in memory.
+    """
+    def __init__(self, fileobj, compress_block, level=6, threads=None, blocksize=1024 * 1024):
+        self.compress_block = compress_block
+        if not threads:
+            import multiprocessing
+            threads = multiprocessing.cpu_count()
+        self.fileobj = fileobj
+        self.level = level
+        self.blocksize = blocksize
+        self.maxpending = threads * 2
+        self.pending = collections.deque()
+        self.buf = []
+        self.buflen = 0
+        self.members = 0
+        # A block of zeros, which sparse disk images are mostly made of,
+        # and its compressed form
+        self.zeroblock = b"\0" * blocksize
+        self.zeros = None
+        self.pool = None
+        if threads > 1:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(threads)
+
+    def _submit(self, block):
+        self.members += 1
+        if block == self.zeroblock:
+            if self.zeros is None:
+                self.zeros = self.compress_block(block, self.level)
+            self.pending.append(self.zeros)
+        elif not self.pool:
+            self.pending.append(self.compress_block(block, self.level))
+        else:
+            self.pending.append(self.pool.apply_async(self.compress_block, (block, self.level)))
+        while len(self.pending) > self.maxpending:
+            self._write_pending()
+
+    def _write_pending(self):
+        result = self.pending.popleft()
+        if not isinstance(result, bytes):
+            result = result.get()
+        self.fileobj.write(result)
+
+    def write(self, data):
+        self.buf.append(data)
+        self.buflen += len(data)
+        if self.buflen < self.blocksize:
+            return
+        data = b"".join(self.buf)
+        end = len(data) - len(data) % self.blocksize
+        for offset in range(0, end, self.blocksize):
+            self._submit(data[offset:offset + self.blocksize])
+        self.buf = [data[end:]]
+        self.buflen = len(data) - end
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buflen or not self.members:
+            self._submit(b"".join(self.buf))
+        self.buf = []
+        self.buflen = 0
+        while self.pending:
+            self._write_pending()
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None and self.pool:
+            self.pool.terminate()
+            self.pool = None
+            self.pending.clear()
+            return
+        self.close()
+
+class ParallelGzipFile(ParallelBlockFile):
+    """Parallel gzip writer, each block being a separate gzip member"""
+    def __init__(self, fileobj, level=None, threads=None, blocksize=1024 * 1024):
+        if level is None:
+            level = 6
+        ParallelBlockFile.__init__(self, fileobj, gzip_member, level, threads, blocksize)
+
+register_compressor("gzip", ParallelGzipFile,
+                    lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode="rb"),
+                    magic=b"\x1f\x8b")
+
+class ParallelBzip2File(ParallelBlockFile):
+    """Parallel bzip2 writer, each block being a separate bzip2 stream"""
+    def __init__(self, fileobj, level=None, threads=None, blocksize=1024 * 1024):
+        if level is None:
+            level = 9
+        ParallelBlockFile.__init__(self, fileobj, bz2.compress, level, threads, blocksize)
+
+class MultiStreamBzip2Reader(object):
+    """
+    File-like reader of bzip2 data made of several concatenated streams,
+    which bz2.BZ2File doesn't read past the first of in Python 2
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = bz2.BZ2Decompressor()
+        self.buf = b""
+        self.eof = False
+
+    def _decompress(self, data):
+        while data:
+            try:
+                self.buf += self.decompressor.decompress(data)
+            except EOFError:
+                # The previous stream ended exactly where data starts
+                self.decompressor = bz2.BZ2Decompressor()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = bz2.BZ2Decompressor()
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buf) < size):
+            data = self.fileobj.read(1024 * 1024)
+            if not data:
+                self.eof = True
+            self._decompress(data)
+        if size < 0:
+            data, self.buf = self.buf, b""
+        else:
+            data, self.buf = self.buf[:size], self.buf[size:]
+        return data
+
+    def close(self):
+        pass
+
+register_compressor("bzip2", ParallelBzip2File, MultiStreamBzip2Reader, magic=b"BZh")
+
+class _CommandSink(object):
+    """
+    Pipe a stream through a shell command into dest, or into the file
+    object out, hashing the command's output as it is written. Each sink
+    has its own queue and threads so a slow command doesn't hold up the
+    others.
+    """
+    def __init__(self, dest, cmd, hashnames, queuesize=8, out=None):
+        import subprocess
+        import threading
+        from Queue import Queue
+
+        self.dest = dest or "output"
+        self.cmd = cmd
+        self.hashes = [hashlib.new(name) for name in hashnames]
+        self.closeout = out is None
+        if out is None:
+            out = open(dest, "wb")
+        self.out = out
+        self.proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, close_fds=True)
+        self.queue = Queue(queuesize)
+        self.error = None
+        self.threads = [threading.Thread(target=self._feed), threading.Thread(target=self._drain)]
+        for thread in self.threads:
+            thread.start()
+
+    def _feed(self):
+        try:
+            while True:
+                block = self.queue.get()
+                if block is None:
+                    return
+                if self.error is None:
+                    try:
+                        self.proc.stdin.write(block)
+                    except IOError as e:
+                        # Keep consuming so the reader isn't blocked
+                        self.error = e
+        finally:
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass
+
+    def _drain(self):
+        while True:
+            data = self.proc.stdout.read(1024 * 1024)
+            if not data:
+                return
+            self.out.write(data)
+            for h in self.hashes:
+                h.update(data)
+
+    def write(self, data):
+        self.queue.put(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.closeout:
+            self.out.close()
+        if self.proc.wait():
+            raise RuntimeError("'%s' writing %s failed with exit code %d" % (self.cmd, self.dest, self.proc.returncode))
+        if self.error:
+            raise RuntimeError("'%s' writing %s failed: %s" % (self.cmd, self.dest, self.error))
+
+    def abort(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.closeout:
+            self.out.close()
+        self.proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            self.abort()
+            return
+        self.close()
+
+def _xz_writer(fileobj, level=None, threads=None):
+    if not threads:
+        import multiprocessing
+        threads = multiprocessing.cpu_count()
+    # xz versions without multithreading accept and ignore -T
+    cmd = "xz -c -T %d" % threads
+    if level is not None:
+        cmd += " -%d" % level
+    return _CommandSink(None, cmd, (), out=fileobj)
+
+def _xz_reader(fileobj):
+    import subprocess
+    return subprocess.Popen(["xz", "-dc"], stdin=fileobj, stdout=subprocess.PIPE,
+                            close_fds=True).stdout
+
+register_compressor("xz", _xz_writer, _xz_reader, magic=b"\xfd7zXZ\x00")
+
+class HashingFile(object):
+    """File-like writer passing data on to fileobj while hashing it"""
+    def __init__(self, fileobj, hashnames):
+        self.fileobj = fileobj
+        self.hashes = [hashlib.new(name) for name in hashnames]
+
+    def write(self, data):
+        self.fileobj.write(data)
+        for h in self.hashes:
+            h.update(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+def write_checksums(path, hashnames, hashes):
+    """Write <path>.<name>sum files in the format of the md5sum family of tools"""
+    import os
+
+    for name, h in zip(hashnames, hashes):
+        with open("%s.%ssum" % (path, name), "w") as f:
+            f.write("%s  %s\n" % (h.hexdigest(), os.path.basename(path)))
+
+def fanout(src, outputs, hashnames=(), hashsource=False, blocksize=1024 * 1024):
+    """
+    Read src once and stream it through every (dest, command) pair in
+    outputs in parallel, each command compressing stdin to stdout. The
+    hashes in hashnames (e.g. "md5", "sha256") of each output, and of src
+    if hashsource is set, are computed in the same pass and written next
+    to the files as <file>.<name>sum.
+    """
+    sinks = []
+    pending = []
+    try:
+        for dest, cmd in outputs:
+            sinks.append(_CommandSink(dest, cmd, hashnames))
+            pending.append(sinks[-1])
+        srchashes = [hashlib.new(name) for name in hashnames if hashsource]
+        with open(src, "rb") as f:
+            while True:
+                block = f.read(blocksize)
+                if not block:
+                    break
+                for h in srchashes:
+                    h.update(block)
+                for sink in sinks:
+                    sink.write(block)
+        while pending:
+            pending[0].close()
+            pending.pop(0)
+    except:
+        for sink in pending:
+            sink.abort()
+        raise
+
+    if hashsource:
+        write_checksums(src, hashnames, srchashes)
+    for sink in sinks:
+        write_checksums(sink.dest, hashnames, sink.hashes)
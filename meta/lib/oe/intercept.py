@@ -0,0 +1,158 @@
+#
+# Scheduling of postinstall intercept scripts
+#
+# Intercepts may declare, in comment lines like the ##PKGS: line added by
+# postinst_intercept, the paths inside the rootfs they write and read and
+# the intercepts they have to run after:
+#
+#   ##WRITES: ${fontconfigcachedir}
+#   ##READS: ${libdir}/gdk-pixbuf-2.0
+#   ##AFTER: update_pixbuf_cache
+#
+# Variables are expanded from the assignments postinst_intercept puts at
+# the top of the script. Two intercepts conflict when one writes a path
+# which is, contains or is inside a path the other reads or writes, and
+# conflicting intercepts run one at a time in a fixed order. An intercept
+# declaring no paths conflicts with every other one. An ##AFTER: name also
+# covers the multilib copies (name-<mlprefix>) of that intercept.
+#
+
+import os
+import re
+import threading
+
+class InterceptError(Exception):
+    pass
+
+class Intercept(object):
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.reads = []
+        self.writes = []
+        self.after = []
+        self.pkgs = None
+
+        with open(path, "r") as f:
+            content = f.read()
+
+        variables = {}
+        for line in content.split("\n"):
+            m = re.match(r"^([A-Za-z_][A-Za-z0-9_]*)=(.*)$", line)
+            if m is not None:
+                variables[m.group(1)] = m.group(2).strip().strip("'\"")
+
+        def expand(value):
+            def lookup(m):
+                return variables.get(m.group(1) or m.group(2), m.group(0))
+            return re.sub(r"\$\{(\w+)\}|\$(\w+)", lookup, value)
+
+        for line in content.split("\n"):
+            m = re.match(r"^##(PKGS|READS|WRITES|AFTER):(.*)", line)
+            if m is None:
+                continue
+            key, value = m.group(1), m.group(2).strip()
+            if key == "PKGS":
+                self.pkgs = value
+            elif key == "AFTER":
+                self.after.extend(value.split())
+            else:
+                paths = [self._normalise(expand(p)) for p in value.split()]
+                (self.reads, self.writes)[key == "WRITES"].extend(paths)
+
+    @staticmethod
+    def _normalise(path):
+        if "$" in path:
+            # Unknown variable, could be anywhere
+            return "/"
+        return os.path.normpath("/" + path.lstrip("/"))
+
+    def conflicts(self, other):
+        if not (self.writes or self.reads) or not (other.writes or other.reads):
+            return True
+        for write, used in [(w, p) for w in self.writes for p in other.reads + other.writes] + \
+                           [(w, p) for w in other.writes for p in self.reads]:
+            if _overlap(write, used):
+                return True
+        return False
+
+def _overlap(a, b):
+    if a == b or a == "/" or b == "/":
+        return True
+    return b.startswith(a + "/") or a.startswith(b + "/")
+
+def schedule(intercepts):
+    """
+    Return intercepts in the order they are to be started in, each paired
+    with the set of names of the intercepts it has to wait for. Ties are
+    broken by name so the order is stable between builds.
+    """
+    byname = dict((i.name, i) for i in intercepts)
+    before = dict((name, set()) for name in byname)
+    for i in intercepts:
+        for after in i.after:
+            for name in byname:
+                if name != i.name and (name == after or name.startswith(after + "-")):
+                    before[i.name].add(name)
+
+    order = []
+    pending = sorted(byname)
+    while pending:
+        ready = [name for name in pending if not before[name] - set(order)]
+        if not ready:
+            raise InterceptError("Intercepts %s have cyclic ##AFTER: dependencies" % ", ".join(pending))
+        order.append(ready[0])
+        pending.remove(ready[0])
+
+    result = []
+    for index, name in enumerate(order):
+        waits = set(before[name])
+        for earlier in order[:index]:
+            if byname[name].conflicts(byname[earlier]):
+                waits.add(earlier)
+        result.append((byname[name], waits))
+    return result
+
+def run(intercepts, execute, threads):
+    """
+    Call execute(intercept) for every intercept, running up to threads of
+    them at a time while respecting schedule(). Returns a list of
+    (intercept, result) pairs in the scheduled order.
+    """
+    from Queue import Queue
+
+    order = schedule(intercepts)
+    finished = Queue()
+    results = {}
+
+    def worker(intercept):
+        try:
+            finished.put((intercept.name, execute(intercept), None))
+        except Exception as e:
+            finished.put((intercept.name, None, e))
+
+    waiting = list(order)
+    running = 0
+    error = None
+    while waiting or running:
+        for entry in list(waiting):
+            if running >= max(threads, 1) or error is not None:
+                break
+            intercept, waits = entry
+            if waits <= set(results):
+                waiting.remove(entry)
+                thread = threading.Thread(target=worker, args=(intercept,))
+                thread.daemon = True
+                thread.start()
+                running += 1
+        if not running:
+            break
+        name, result, exc = finished.get()
+        running -= 1
+        results[name] = result
+        if exc is not None and error is None:
+            error = exc
+
+    if error is not None:
+        raise error
+    return [(intercept, results[intercept.name]) for intercept, waits in order]
@@ -0,0 +1,126 @@
+#
+# Single pass checking of rootfs logs for warning and error messages
+#
+# The warning and error patterns are combined into one regular expression
+# which is searched for through the whole log (mmapped when checking a
+# file), so only the few lines it matches are looked at individually.
+# Output can also be fed in as it is produced, which lets package manager
+# runs be stopped as soon as an error shows up rather than once they end.
+#
+
+import os
+import re
+import mmap
+
+# Lines matching this (and not containing "NOTE:") are warnings
+WARN_REGEX = '^(warn|Warn|NOTE: warn|NOTE: Warn|WARNING:)'
+
+# Number of lines, starting at the last error, making up the error message
+ERROR_CONTEXT = 5
+
+class LogCheckError(Exception):
+    pass
+
+class LogChecker(object):
+    """
+    Scan output for lines matching error_regex, except those matching one
+    of the expected_errors regexes, and for lines matching warn_regex
+    (None to not look for warnings). Lines mentioning log_check itself are
+    ignored. The (keyword, line) pairs found end up in the warnings and
+    errors lists; an error together with the lines following it is
+    reported by raising LogCheckError.
+    """
+    def __init__(self, error_regex, expected_errors=(), warn_regex=WARN_REGEX):
+        self.error_re = re.compile(error_regex)
+        self.expected_re = None
+        if expected_errors:
+            self.expected_re = re.compile("|".join("(?:%s)" % e for e in expected_errors))
+        self.warn_re = None
+        patterns = [error_regex]
+        if warn_regex:
+            self.warn_re = re.compile(warn_regex)
+            patterns.append(warn_regex)
+        self.candidate_re = re.compile("|".join("(?:%s)" % p for p in patterns), re.M)
+
+        self.warnings = []
+        self.errors = []
+        self.context = []
+        self.remaining = 0
+        self.failure = None
+        self.pending = ""
+
+    def _check_line(self, line):
+        if 'log_check' in line:
+            return
+
+        if self.warn_re and 'NOTE:' not in line:
+            m = self.warn_re.search(line)
+            if m:
+                self.warnings.append((m.group(), line))
+
+        if self.failure is not None:
+            return
+        if self.expected_re and self.expected_re.search(line):
+            return
+
+        m = self.error_re.search(line)
+        if m:
+            self.errors.append((m.group(), line))
+            self.remaining = ERROR_CONTEXT
+        if self.remaining:
+            self.context.append(line)
+            self.remaining -= 1
+            if not self.remaining:
+                self.failure = "\n" + "\n".join(self.context)
+
+    def _scan(self, buf, pos, end):
+        """Check the complete lines in buf between pos and end"""
+        while pos < end:
+            if self.remaining:
+                # Every line following an error is part of the message
+                linestart = pos
+            else:
+                m = self.candidate_re.search(buf, pos, end)
+                if not m:
+                    return
+                linestart = max(buf.rfind("\n", pos, m.start()) + 1, pos)
+            lineend = buf.find("\n", linestart, end)
+            if lineend < 0:
+                lineend = end
+            self._check_line(buf[linestart:lineend])
+            pos = lineend + 1
+
+    def feed(self, data):
+        """Check the next part of the output, raising LogCheckError on errors"""
+        buf = self.pending + data
+        end = buf.rfind("\n") + 1
+        self._scan(buf, 0, end)
+        self.pending = buf[end:]
+        self._raise()
+
+    def finish(self):
+        """Check what remains of the output after the last feed()"""
+        if self.pending:
+            self._check_line(self.pending)
+            self.pending = ""
+        if self.remaining and self.failure is None:
+            self.failure = "\n" + "\n".join(self.context)
+        self._raise()
+
+    def check_file(self, path):
+        """Check the whole of the file at path, reporting errors at the end"""
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    end = buf.rfind("\n") + 1
+                    self._scan(buf, 0, end)
+                    self.pending = buf[end:size]
+                finally:
+                    buf.close()
+        self.finish()
+
+    def _raise(self):
+        if self.failure is not None:
+            raise LogCheckError(self.failure)
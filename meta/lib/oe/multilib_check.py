@@ -0,0 +1,92 @@
+#
+# Detection of conflicting files between multilib rootfs trees
+#
+# Files installed at the same path in more than one tree are compared by
+# size first and, only when the sizes match, by a SHA-256 of their
+# contents computed in a pool of threads. Each file is read at most once
+# per comparison round however many trees share its path.
+#
+
+import os
+import hashlib
+
+def _digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+def _differing(pairs, threads):
+    """Return the entries of pairs whose two files have different contents"""
+    differ = []
+    same_size = []
+    for entry in pairs:
+        f1, f2 = entry[2], entry[4]
+        if os.path.getsize(f1) != os.path.getsize(f2):
+            differ.append(entry)
+        else:
+            same_size.append(entry)
+
+    paths = sorted(set(p for entry in same_size for p in (entry[2], entry[4])))
+    if threads is None:
+        import multiprocessing
+        threads = multiprocessing.cpu_count()
+    if threads > 1 and len(paths) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(threads, len(paths)))
+        try:
+            digests = dict(zip(paths, pool.map(_digest, paths)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        digests = dict((p, _digest(p)) for p in paths)
+
+    for entry in same_size:
+        if digests[entry[2]] != digests[entry[4]]:
+            differ.append(entry)
+    return sorted(differ)
+
+def find_conflicts(dirs, allowed=None, normalise=None, threads=None):
+    """
+    Return a sorted list of (path, file1, file2) tuples for the files
+    installed at the same path in more than one of the trees in dirs
+    whose contents differ, each file being compared with the one from the
+    previous tree which has it. Paths matched by allowed, a compiled
+    regex, may differ. Broken symlinks aren't compared.
+
+    If normalise is given, it is called once for each tree other than the
+    first containing one of the differing files (to prelink it, say) and
+    those files are then compared again.
+    """
+    files = {}
+    for root in dirs:
+        for dirpath, subdirs, filenames in os.walk(root):
+            for fn in filenames:
+                item = os.path.join(dirpath, fn)
+                key = os.path.join("/", os.path.relpath(item, root))
+                files.setdefault(key, []).append((root, item))
+
+    pairs = []
+    for key in files:
+        items = files[key]
+        if len(items) < 2 or (allowed is not None and allowed.match(key)):
+            continue
+        for (root1, f1), (root2, f2) in zip(items, items[1:]):
+            if os.path.exists(f1) and os.path.exists(f2):
+                pairs.append((key, root1, f1, root2, f2))
+
+    differ = _differing(pairs, threads)
+    if differ and normalise is not None:
+        roots = set()
+        for key, root1, f1, root2, f2 in differ:
+            roots.update(r for r in (root1, root2) if r != dirs[0])
+        for root in sorted(roots):
+            normalise(root)
+        differ = _differing(differ, threads)
+
+    return [(key, f1, f2) for key, root1, f1, root2, f2 in differ]
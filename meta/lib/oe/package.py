@@ -44,6 +44,130 @@ def runstrip(arg):
     return
 
 
+def splitdebuginfo(file, debugfile, debugsrcdir, sourcefile, objcopy, debugedit, workparentdir):
+    # Function to split a single file into two components, one is the stripped
+    # target system binary, the other contains any debugging information. The
+    # two files are linked to reference each other.
+    #
+    # sourcefile is also generated containing a list of debugsources
+
+    import stat
+    import oe.utils
+
+    # We ignore kernel modules, we don't generate debug info files.
+    if file.find("/lib/modules/") != -1 and file.endswith(".ko"):
+        return 1
+
+    newmode = None
+    if not os.access(file, os.W_OK) or os.access(file, os.R_OK):
+        origmode = os.stat(file)[stat.ST_MODE]
+        newmode = origmode | stat.S_IWRITE | stat.S_IREAD
+        os.chmod(file, newmode)
+
+    # We need to extract the debug src information here...
+    if debugsrcdir:
+        cmd = "'%s' -b '%s' -d '%s' -i -l '%s' '%s'" % (debugedit, workparentdir, debugsrcdir, sourcefile, file)
+        (retval, output) = oe.utils.getstatusoutput(cmd)
+        if retval:
+            bb.fatal("debugedit failed with exit code %s (cmd was %s)%s" % (retval, cmd, ":\n%s" % output if output else ""))
+
+    bb.utils.mkdirhier(os.path.dirname(debugfile))
+
+    cmd = "'%s' --only-keep-debug '%s' '%s'" % (objcopy, file, debugfile)
+    (retval, output) = oe.utils.getstatusoutput(cmd)
+    if retval:
+        bb.fatal("objcopy failed with exit code %s (cmd was %s)%s" % (retval, cmd, ":\n%s" % output if output else ""))
+
+    # Set the debuglink to have the view of the file path on the target
+    cmd = "'%s' --add-gnu-debuglink='%s' '%s'" % (objcopy, debugfile, file)
+    (retval, output) = oe.utils.getstatusoutput(cmd)
+    if retval:
+        bb.fatal("objcopy failed with exit code %s (cmd was %s)%s" % (retval, cmd, ":\n%s" % output if output else ""))
+
+    if newmode:
+        os.chmod(file, origmode)
+
+    return 0
+
+def splitstripfile(arg):
+    # Split and then strip a single file as one unit of work, called from
+    # split_and_strip_files through multiprocess_exec. split holds the
+    # arguments to splitdebuginfo() and strip the strip command, either may
+    # be None to skip that step.
+    (file, elftype, strip, split) = arg
+
+    if split:
+        splitdebuginfo(*split)
+    if strip:
+        runstrip((file, elftype, strip))
+
+# Classification bits returned by is_elf():
+# 0 - not elf
+# 1 - ELF
+# 2 - stripped
+# 4 - executable
+# 8 - shared library
+# 16 - kernel module
+def is_elf(path):
+    # Classify a single file by parsing its ELF and section headers,
+    # returns (path, type) so that it can be used with multiprocess_exec
+    import oe.qa
+
+    elftype = 0
+    elf = oe.qa.ELFFile(path)
+    try:
+        elf.open()
+    except oe.qa.NotELFFileError:
+        return (path, elftype)
+
+    try:
+        elftype |= 1
+        etype = elf.elfType()
+        if etype == oe.qa.ELFFile.ET_EXEC:
+            elftype |= 4
+        elif etype == oe.qa.ELFFile.ET_DYN:
+            elftype |= 8
+        if elf.isStripped():
+            elftype |= 2
+        if elf.isKernelModule():
+            elftype |= 16
+    except oe.qa.NotELFFileError as e:
+        bb.debug(1, "is_elf: %s" % e)
+    finally:
+        elf.close()
+
+    return (path, elftype)
+
+# is_elf() results for the lifetime of the task, keyed by
+# (st_dev, st_ino, st_mtime, st_size)
+elf_type_cache = {}
+
+def elf_types(paths):
+    # Classify paths with is_elf(), in parallel for anything not already
+    # cached. Returns a dict mapping each path to its type.
+    import oe.utils
+
+    types = {}
+    keys = {}
+    todo = {}
+    for path in paths:
+        try:
+            s = os.stat(path)
+        except OSError:
+            types[path] = 0
+            continue
+        key = (s.st_dev, s.st_ino, s.st_mtime, s.st_size)
+        keys[path] = key
+        if key not in elf_type_cache and key not in todo:
+            todo[key] = path
+
+    for (path, elftype) in oe.utils.multiprocess_exec(sorted(todo.values()), is_elf):
+        elf_type_cache[keys[path]] = elftype
+
+    for path in keys:
+        types[path] = elf_type_cache[keys[path]]
+    return types
+
 def file_translate(file):
     ft = file.replace("@", "@at@")
     ft = ft.replace(" ", "@space@")
@@ -0,0 +1,343 @@
+#
+# Native, incremental indexing of ipk and deb package feeds
+#
+# Each feed directory gets a Packages file (and Packages.gz) listing the
+# control fields of its packages plus their filename, size and checksums.
+# A stamps file records, for every package file, the size and mtime it had
+# when it was read and the name, architecture and version from its control
+# file, so a later run only opens the package files which were added or
+# changed and copies the other entries from the old Packages. Stamps files
+# are kept in a directory of their own rather than in the feed, which is
+# published as it is.
+#
+
+import os
+import re
+import hashlib
+import tarfile
+
+class PackageIndexError(Exception):
+    pass
+
+def _order(c):
+    if c.isdigit():
+        return 0
+    if c.isalpha():
+        return ord(c)
+    if c == "~":
+        return -1
+    if c:
+        return ord(c) + 256
+    return 0
+
+def _verrevcmp(a, b):
+    i = j = 0
+    while i < len(a) or j < len(b):
+        first_diff = 0
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _order(a[i:i + 1])
+            bc = _order(b[j:j + 1])
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+        while a[i:i + 1] == "0":
+            i += 1
+        while b[j:j + 1] == "0":
+            j += 1
+        while a[i:i + 1].isdigit() and b[j:j + 1].isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if a[i:i + 1].isdigit():
+            return 1
+        if b[j:j + 1].isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+def version_compare(a, b):
+    """Compare two [epoch:]version[-revision] strings the way dpkg and opkg do"""
+    def split(v):
+        epoch = 0
+        if ":" in v:
+            e, v = v.split(":", 1)
+            try:
+                epoch = int(e)
+            except ValueError:
+                pass
+        if "-" in v:
+            v, rev = v.rsplit("-", 1)
+        else:
+            rev = ""
+        return epoch, v, rev
+
+    ea, va, ra = split(a)
+    eb, vb, rb = split(b)
+    if ea != eb:
+        return ea - eb
+    return _verrevcmp(va, vb) or _verrevcmp(ra, rb)
+
+def _ar_members(f):
+    while True:
+        header = f.read(60)
+        if len(header) < 60:
+            return
+        name = header[:16].rstrip().rstrip("/")
+        try:
+            size = int(header[48:58])
+        except ValueError:
+            raise PackageIndexError("Corrupt ar member header in %s" % f.name)
+        yield name, f.read(size)
+        if size % 2:
+            f.read(1)
+
+def _control_from_tar(name, data):
+    import io
+
+    if name.endswith(".xz"):
+        # tarfile can't read xz here
+        import subprocess
+        proc = subprocess.Popen(["xz", "-dc"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        data = proc.communicate(data)[0]
+        if proc.returncode:
+            raise PackageIndexError("Unable to decompress %s" % name)
+    tar = tarfile.open(fileobj=io.BytesIO(data), mode="r:*")
+    for member in tar:
+        if os.path.normpath(member.name) == "control" and member.isfile():
+            return tar.extractfile(member).read()
+    raise PackageIndexError("%s has no control file" % name)
+
+def read_control(path):
+    """Return the text of the control file of the ipk or deb at path"""
+    with open(path, "rb") as f:
+        if f.read(8) == "!<arch>\n":
+            for name, data in _ar_members(f):
+                if name.startswith("control.tar"):
+                    return _control_from_tar(name, data)
+        else:
+            # Old style ipks are a tarball of tarballs
+            f.seek(0)
+            try:
+                outer = tarfile.open(fileobj=f, mode="r:*")
+                for member in outer:
+                    name = os.path.normpath(member.name)
+                    if name.startswith("control.tar"):
+                        return _control_from_tar(name, outer.extractfile(member).read())
+            except tarfile.TarError as e:
+                raise PackageIndexError("%s is not a package: %s" % (path, e))
+    raise PackageIndexError("%s has no control archive" % path)
+
+def control_fields(control):
+    """Return a dict of the single line fields in a control file"""
+    fields = {}
+    for line in control.split("\n"):
+        m = re.match(r"([^\s:]+):\s*(.*)$", line)
+        if m:
+            fields[m.group(1)] = m.group(2).strip()
+    return fields
+
+def package_stanza(control, extra):
+    """
+    Return the Packages entry for a control file, with the (field, value)
+    pairs in extra added before the Description as dpkg tools do.
+    """
+    lines = [l for l in control.rstrip("\n").split("\n") if l.strip()]
+    extra = ["%s: %s" % field for field in extra]
+    for i, line in enumerate(lines):
+        if line.startswith("Description:"):
+            return "\n".join(lines[:i] + extra + lines[i:]) + "\n"
+    return "\n".join(lines + extra) + "\n"
+
+def _read_stanzas(fn):
+    stanzas = {}
+    try:
+        with open(fn, "r") as f:
+            content = f.read()
+    except IOError:
+        return stanzas
+    for stanza in content.split("\n\n"):
+        m = re.search(r"^Filename:\s*(.*)$", stanza, re.M)
+        if m:
+            stanzas[m.group(1).strip()] = stanza.strip("\n") + "\n"
+    return stanzas
+
+def _read_stamps(fn):
+    stamps = {}
+    try:
+        with open(fn, "r") as f:
+            for line in f:
+                fields = line.rstrip("\n").split(" ", 5)
+                if len(fields) == 6:
+                    stamps[fields[5]] = (int(fields[0]), int(fields[1]), fields[2], fields[3], fields[4])
+    except (IOError, ValueError):
+        return {}
+    return stamps
+
+def stamps_file(stampsdir, feeddir, name):
+    """Return the path of the stamps file called name for feeddir in stampsdir"""
+    feeddir = os.path.abspath(feeddir)
+    key = hashlib.md5(feeddir.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(stampsdir, "%s-%s.%s" % (os.path.basename(feeddir), key, name))
+
+def _write_atomic(fn, data):
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    tmpfn = fn + ".tmp"
+    with open(tmpfn, "w") as f:
+        f.write(data)
+    os.rename(tmpfn, fn)
+
+def _file_checksums(path, hashnames):
+    hashes = [hashlib.new(name) for name in hashnames]
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            for h in hashes:
+                h.update(data)
+    return [h.hexdigest() for h in hashes]
+
+class FeedIndex(object):
+    """
+    Packages index of one ipk or deb feed directory. pkgtype selects the
+    conventions of opkg-make-index ("ipk": the highest version of each
+    package, MD5Sum only) or apt-ftparchive ("deb": every package file,
+    MD5sum/SHA1/SHA256 and filenames relative to "."). The stamps of the
+    feed are kept in stampsdir.
+    """
+    def __init__(self, feeddir, pkgtype, stampsdir):
+        if pkgtype not in ("ipk", "deb"):
+            raise ValueError("Unsupported package type %s" % pkgtype)
+        self.feeddir = feeddir
+        self.pkgtype = pkgtype
+        self.packagesfile = os.path.join(feeddir, "Packages")
+        self.stampsfile = stamps_file(stampsdir, feeddir, "Packages.stamps")
+        self.reread = 0
+
+    def _filename(self, fn):
+        if self.pkgtype == "deb":
+            return "./" + fn
+        return fn
+
+    def _read_package(self, fn):
+        path = os.path.join(self.feeddir, fn)
+        control = read_control(path)
+        size = os.path.getsize(path)
+        if self.pkgtype == "deb":
+            md5, sha1, sha256 = _file_checksums(path, ["md5", "sha1", "sha256"])
+            extra = [("Filename", self._filename(fn)), ("Size", size),
+                     ("MD5sum", md5), ("SHA1", sha1), ("SHA256", sha256)]
+        else:
+            md5, = _file_checksums(path, ["md5"])
+            extra = [("Filename", self._filename(fn)), ("Size", size), ("MD5Sum", md5)]
+        self.reread += 1
+        return control_fields(control), package_stanza(control, extra)
+
+    def update(self):
+        """
+        Bring Packages, Packages.gz and the stamps up to date with the
+        package files in the directory. Returns the number of package files
+        which had to be read.
+        """
+        suffix = "." + self.pkgtype
+        # Stamps used to be written into the feed itself
+        oldstampsfile = os.path.join(self.feeddir, "Packages.stamps")
+        if os.path.exists(oldstampsfile):
+            os.remove(oldstampsfile)
+        oldstamps = _read_stamps(self.stampsfile)
+        oldstanzas = _read_stanzas(self.packagesfile)
+
+        entries = {}
+        stanzas = {}
+        for fn in sorted(os.listdir(self.feeddir)):
+            if not fn.endswith(suffix):
+                continue
+            st = os.stat(os.path.join(self.feeddir, fn))
+            if not os.path.isfile(os.path.join(self.feeddir, fn)):
+                continue
+            stamp = oldstamps.get(fn)
+            if stamp and stamp[:2] == (int(st.st_mtime), st.st_size):
+                entries[fn] = stamp
+                if self._filename(fn) in oldstanzas:
+                    stanzas[fn] = oldstanzas[self._filename(fn)]
+                continue
+            fields, stanzas[fn] = self._read_package(fn)
+            entries[fn] = (int(st.st_mtime), st.st_size, fields.get("Package", ""),
+                           fields.get("Architecture", ""), fields.get("Version", ""))
+
+        selected = sorted(entries)
+        if self.pkgtype == "ipk":
+            # Only index the highest version of each package
+            best = {}
+            for fn in selected:
+                key = entries[fn][2:4]
+                if key not in best or version_compare(entries[fn][4], entries[best[key]][4]) > 0:
+                    best[key] = fn
+            selected = sorted(best.values())
+
+        output = []
+        for fn in selected:
+            if fn not in stanzas:
+                # Known but not in the old index, e.g. a newer version was removed
+                stanzas[fn] = self._read_package(fn)[1]
+            output.append(stanzas[fn])
+
+        packages = "\n".join(output)
+        _write_atomic(self.packagesfile, packages)
+        self._write_gz(packages)
+        _write_atomic(self.stampsfile, "".join("%d %d %s %s %s %s\n" % (entries[fn] + (fn,)) for fn in sorted(entries)))
+        return self.reread
+
+    def _write_gz(self, data):
+        import gzip
+
+        tmpfn = self.packagesfile + ".gz.tmp"
+        # A fixed mtime keeps the output reproducible
+        with open(tmpfn, "wb") as f:
+            gz = gzip.GzipFile(filename="Packages", mode="wb", fileobj=f, mtime=0)
+            gz.write(data)
+            gz.close()
+        os.rename(tmpfn, self.packagesfile + ".gz")
+
+    def write_release(self, label):
+        """Write a Release file for a deb feed, as "apt-ftparchive release" does"""
+        import email.utils
+
+        release = ["Label: %s" % label,
+                   "Date: %s" % email.utils.formatdate(usegmt=True)]
+        files = ["Packages", "Packages.gz"]
+        for field, hashname in (("MD5Sum", "md5"), ("SHA1", "sha1"), ("SHA256", "sha256")):
+            release.append("%s:" % field)
+            for fn in files:
+                path = os.path.join(self.feeddir, fn)
+                release.append(" %s %16d %s" % (_file_checksums(path, [hashname])[0], os.path.getsize(path), fn))
+        _write_atomic(os.path.join(self.feeddir, "Release"), "\n".join(release) + "\n")
+
+def index_feed(args):
+    """
+    Update the index of the feed directory in args, a (feeddir, pkgtype,
+    release label or None, stamps directory) tuple. Returns an error message
+    on failure, for use with oe.utils.multiprocess_exec.
+    """
+    feeddir, pkgtype, label, stampsdir = args
+    try:
+        index = FeedIndex(feeddir, pkgtype, stampsdir)
+        index.update()
+        if label is not None:
+            index.write_release(label)
+    except (PackageIndexError, EnvironmentError) as e:
+        return "Unable to index %s: %s" % (feeddir, e)
+    return None
+
+def directory_stamps(feeddir, suffix):
+    """Return a string summarising the size and mtime of the package files in feeddir"""
+    stamps = []
+    for fn in sorted(os.listdir(feeddir)):
+        if fn.endswith(suffix):
+            st = os.stat(os.path.join(feeddir, fn))
+            stamps.append("%d %d %s\n" % (st.st_mtime, st.st_size, fn))
+    return "".join(stamps)
@@ -8,6 +8,8 @@ import re
 import bb
 import tempfile
 import oe.utils
+import oe.logcheck
+import oe.package_index
 import string
 from oe.gpg_sign import get_signer
 
@@ -34,6 +36,9 @@ class Indexer(object):
     def __init__(self, d, deploy_dir):
         self.d = d
         self.deploy_dir = deploy_dir
+        # Where the indexers record the state of the feeds they indexed,
+        # outside of the published feed directories
+        self.stamps_dir = self.d.expand("${TMPDIR}/package-index-stamps")
 
     @abstractmethod
     def write_index(self):
@@ -115,6 +120,7 @@ class RpmIndexer(Indexer):
             signer = None
         index_cmds = []
         repomd_files = []
+        stamps = {}
         rpm_dirs_found = False
         for arch in archs:
             dbpath = os.path.join(self.d.getVar('WORKDIR', True), 'rpmdb', arch)
@@ -124,11 +130,26 @@ class RpmIndexer(Indexer):
             if not os.path.isdir(arch_dir):
                 continue
 
+            rpm_dirs_found = True
+
+            repomd = os.path.join(arch_dir, 'repodata', 'repomd.xml')
+            # Skip directories whose packages haven't changed since they
+            # were last indexed
+            stampfile = oe.package_index.stamps_file(self.stamps_dir, arch_dir, 'repodata.stamps')
+            stamps[stampfile] = oe.package_index.directory_stamps(arch_dir, '.rpm')
+            if os.path.exists(os.path.join(arch_dir, 'repodata.stamps')):
+                os.remove(os.path.join(arch_dir, 'repodata.stamps'))
+            if os.path.exists(repomd) and os.path.exists(stampfile):
+                with open(stampfile) as f:
+                    if f.read() == stamps[stampfile]:
+                        del stamps[stampfile]
+                        if signer and not os.path.exists(repomd + '.asc'):
+                            repomd_files.append(repomd)
+                        continue
+
             index_cmds.append("%s --dbpath %s --update -q %s" % \
                              (rpm_createrepo, dbpath, arch_dir))
-            repomd_files.append(os.path.join(arch_dir, 'repodata', 'repomd.xml'))
-
-            rpm_dirs_found = True
+            repomd_files.append(repomd)
 
         if not rpm_dirs_found:
             bb.note("There are no packages in %s" % self.deploy_dir)
@@ -138,6 +159,10 @@ class RpmIndexer(Indexer):
         result = oe.utils.multiprocess_exec(index_cmds, create_index)
         if result:
             bb.fatal('%s' % ('\n'.join(result)))
+        bb.utils.mkdirhier(self.stamps_dir)
+        for stampfile in stamps:
+            with open(stampfile, 'w') as f:
+                f.write(stamps[stampfile])
         # Sign repomd
         if signer:
             for repomd in repomd_files:
@@ -152,12 +177,10 @@ class OpkgIndexer(Indexer):
                      "SDK_PACKAGE_ARCHS",
                      "MULTILIB_ARCHS"]
 
-        opkg_index_cmd = bb.utils.which(os.getenv('PATH'), "opkg-make-index")
-
         if not os.path.exists(os.path.join(self.deploy_dir, "Packages")):
             open(os.path.join(self.deploy_dir, "Packages"), "w").close()
 
-        index_cmds = []
+        feeds = []
         for arch_var in arch_vars:
             archs = self.d.getVar(arch_var, True)
             if archs is None:
@@ -165,22 +188,19 @@ class OpkgIndexer(Indexer):
 
             for arch in archs.split():
                 pkgs_dir = os.path.join(self.deploy_dir, arch)
-                pkgs_file = os.path.join(pkgs_dir, "Packages")
 
                 if not os.path.isdir(pkgs_dir):
                     continue
 
-                if not os.path.exists(pkgs_file):
-                    open(pkgs_file, "w").close()
-
-                index_cmds.append('%s -r %s -p %s -m %s' %
-                                  (opkg_index_cmd, pkgs_file, pkgs_file, pkgs_dir))
+                feed = (pkgs_dir, "ipk", None, self.stamps_dir)
+                if feed not in feeds:
+                    feeds.append(feed)
 
-        if len(index_cmds) == 0:
+        if len(feeds) == 0:
             bb.note("There are no packages in %s!" % self.deploy_dir)
             return
 
-        result = oe.utils.multiprocess_exec(index_cmds, create_index)
+        result = oe.utils.multiprocess_exec(feeds, oe.package_index.index_feed)
         if result:
             bb.fatal('%s' % ('\n'.join(result)))
         if self.d.getVar('PACKAGE_FEED_SIGN', True) == '1':
@@ -189,35 +209,7 @@ class OpkgIndexer(Indexer):
 
 
 class DpkgIndexer(Indexer):
-    def _create_configs(self):
-        bb.utils.mkdirhier(self.apt_conf_dir)
-        bb.utils.mkdirhier(os.path.join(self.apt_conf_dir, "lists", "partial"))
-        bb.utils.mkdirhier(os.path.join(self.apt_conf_dir, "apt.conf.d"))
-        bb.utils.mkdirhier(os.path.join(self.apt_conf_dir, "preferences.d"))
-
-        with open(os.path.join(self.apt_conf_dir, "preferences"),
-                "w") as prefs_file:
-            pass
-        with open(os.path.join(self.apt_conf_dir, "sources.list"),
-                "w+") as sources_file:
-            pass
-
-        with open(self.apt_conf_file, "w") as apt_conf:
-            with open(os.path.join(self.d.expand("${STAGING_ETCDIR_NATIVE}"),
-                "apt", "apt.conf.sample")) as apt_conf_sample:
-                for line in apt_conf_sample.read().split("\n"):
-                    line = re.sub("#ROOTFS#", "/dev/null", line)
-                    line = re.sub("#APTCONF#", self.apt_conf_dir, line)
-                    apt_conf.write(line + "\n")
-
     def write_index(self):
-        self.apt_conf_dir = os.path.join(self.d.expand("${APTCONF_TARGET}"),
-                "apt-ftparchive")
-        self.apt_conf_file = os.path.join(self.apt_conf_dir, "apt.conf")
-        self._create_configs()
-
-        os.environ['APT_CONFIG'] = self.apt_conf_file
-
         pkg_archs = self.d.getVar('PACKAGE_ARCHS', True)
         if pkg_archs is not None:
             arch_list = pkg_archs.split()
@@ -230,34 +222,19 @@ class DpkgIndexer(Indexer):
         all_mlb_pkg_arch_list = (self.d.getVar('ALL_MULTILIB_PACKAGE_ARCHS', True) or "").split()
         arch_list.extend(arch for arch in all_mlb_pkg_arch_list if arch not in arch_list)
 
-        apt_ftparchive = bb.utils.which(os.getenv('PATH'), "apt-ftparchive")
-        gzip = bb.utils.which(os.getenv('PATH'), "gzip")
-
-        index_cmds = []
-        deb_dirs_found = False
+        feeds = []
         for arch in arch_list:
             arch_dir = os.path.join(self.deploy_dir, arch)
             if not os.path.isdir(arch_dir):
                 continue
 
-            cmd = "cd %s; PSEUDO_UNLOAD=1 %s packages . > Packages;" % (arch_dir, apt_ftparchive)
-
-            cmd += "%s -fc Packages > Packages.gz;" % gzip
-
-            with open(os.path.join(arch_dir, "Release"), "w+") as release:
-                release.write("Label: %s\n" % arch)
+            feeds.append((arch_dir, "deb", arch, self.stamps_dir))
 
-            cmd += "PSEUDO_UNLOAD=1 %s release . >> Release" % apt_ftparchive
-            
-            index_cmds.append(cmd)
-
-            deb_dirs_found = True
-
-        if not deb_dirs_found:
+        if not feeds:
             bb.note("There are no packages in %s" % self.deploy_dir)
             return
 
-        result = oe.utils.multiprocess_exec(index_cmds, create_index)
+        result = oe.utils.multiprocess_exec(feeds, oe.package_index.index_feed)
         if result:
             bb.fatal('%s' % ('\n'.join(result)))
         if self.d.getVar('PACKAGE_FEED_SIGN', True) == '1':
@@ -500,6 +477,38 @@ class PackageManager(object):
         self.feed_uris = self.d.getVar('PACKAGE_FEED_URIS', True) or ""
         self.feed_base_paths = self.d.getVar('PACKAGE_FEED_BASE_PATHS', True) or ""
         self.feed_archs = self.d.getVar('PACKAGE_FEED_ARCHS', True)
+        # Function returning a new oe.logcheck.LogChecker, if set
+        self.log_checker = None
+
+    """
+    Run cmd, a list, like subprocess.check_output() with stderr included in
+    the output. If there is a log checker its output is checked as it is
+    produced and the command is stopped as soon as it shows an error.
+    """
+    def _check_output(self, cmd):
+        if self.log_checker is None:
+            return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+        checker = self.log_checker()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = []
+        try:
+            while True:
+                data = os.read(proc.stdout.fileno(), 65536)
+                if not data:
+                    break
+                output.append(data)
+                checker.feed(data)
+            checker.finish()
+        except oe.logcheck.LogCheckError as e:
+            proc.kill()
+            proc.wait()
+            bb.note("".join(output))
+            bb.fatal("Stopped '%s' as its output shows errors:%s" % (' '.join(cmd), e))
+
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, ' '.join(cmd), "".join(output))
+        return "".join(output)
 
     """
     Update the package manager package database.
@@ -551,15 +560,6 @@ class PackageManager(object):
     installation
     """
     def install_complementary(self, globs=None):
-        # we need to write the list of installed packages to a file because the
-        # oe-pkgdata-util reads it from a file
-        installed_pkgs_file = os.path.join(self.d.getVar('WORKDIR', True),
-                                           "installed_pkgs.txt")
-        with open(installed_pkgs_file, "w+") as installed_pkgs:
-            pkgs = self.list_installed()
-            output = oe.utils.format_pkg_list(pkgs, "arch")
-            installed_pkgs.write(output)
-
         if globs is None:
             globs = self.d.getVar('IMAGE_INSTALL_COMPLEMENTARY', True)
             split_linguas = set()
@@ -576,22 +576,20 @@ class PackageManager(object):
         if globs is None:
             return
 
-        cmd = [bb.utils.which(os.getenv('PATH'), "oe-pkgdata-util"),
-               "-p", self.d.getVar('PKGDATA_DIR', True), "glob", installed_pkgs_file,
-               globs]
-        exclude = self.d.getVar('PACKAGE_EXCLUDE_COMPLEMENTARY', True)
-        if exclude:
-            cmd.extend(['-x', exclude])
+        import oe.packagedata
+
+        bb.note("Installing complementary packages ...")
+        index = oe.packagedata.PkgdataIndex(self.d.getVar('PKGDATA_DIR', True))
         try:
-            bb.note("Installing complementary packages ...")
-            bb.note('Running %s' % cmd)
-            complementary_pkgs = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            bb.fatal("Could not compute complementary packages list. Command "
-                     "'%s' returned %d:\n%s" %
-                     (' '.join(cmd), e.returncode, e.output))
-        self.install(complementary_pkgs.split(), attempt_only=True)
-        os.remove(installed_pkgs_file)
+            complementary_pkgs = oe.packagedata.complementary_packages(index,
+                                    self.list_installed().keys(), globs.split(),
+                                    self.d.getVar('PACKAGE_EXCLUDE_COMPLEMENTARY', True))
+        except Exception as e:
+            bb.fatal("Could not compute complementary packages list: %s" % e)
+        finally:
+            index.close()
+        bb.note("Complementary packages for '%s': %s" % (globs, " ".join(sorted(complementary_pkgs))))
+        self.install(sorted(complementary_pkgs), attempt_only=True)
 
     def deploy_dir_lock(self):
         if self.deploy_dir is None:
@@ -1188,7 +1186,10 @@ class RpmPM(PackageManager):
             cmd = "%s %s install --attempt -y %s" % \
                   (self.smart_cmd, self.smart_opt, ' '.join(pkgs))
         try:
-            output = subprocess.check_output(cmd.split(), stderr=subprocess.STDOUT)
+            if attempt_only:
+                output = subprocess.check_output(cmd.split(), stderr=subprocess.STDOUT)
+            else:
+                output = self._check_output(cmd.split())
             bb.note(output)
         except subprocess.CalledProcessError as e:
             bb.fatal("Unable to install packages. Command '%s' "
@@ -1251,7 +1252,7 @@ class RpmPM(PackageManager):
                         self.saved_rpmlib,
                         symlinks=True)
 
-    def recovery_packaging_data(self):
+    def recover_packaging_data(self):
         # Move the rpmlib back
         if os.path.exists(self.saved_rpmlib):
             if os.path.exists(self.image_rpmlib):
@@ -1573,12 +1574,7 @@ class OpkgPM(PackageManager):
 
         self.deploy_dir_unlock()
 
-    def install(self, pkgs, attempt_only=False):
-        if not pkgs:
-            return
-
-        cmd = "%s %s install %s" % (self.opkg_cmd, self.opkg_args, ' '.join(pkgs))
-
+    def _setup_scriptlet_env(self):
         os.environ['D'] = self.target_rootfs
         os.environ['OFFLINE_ROOT'] = self.target_rootfs
         os.environ['IPKG_OFFLINE_ROOT'] = self.target_rootfs
@@ -1587,10 +1583,21 @@ class OpkgPM(PackageManager):
                                                    "intercept_scripts")
         os.environ['NATIVE_ROOT'] = self.d.getVar('STAGING_DIR_NATIVE', True)
 
+    def install(self, pkgs, attempt_only=False):
+        if not pkgs:
+            return
+
+        cmd = "%s %s install %s" % (self.opkg_cmd, self.opkg_args, ' '.join(pkgs))
+
+        self._setup_scriptlet_env()
+
         try:
             bb.note("Installing the following packages: %s" % ' '.join(pkgs))
             bb.note(cmd)
-            output = subprocess.check_output(cmd.split(), stderr=subprocess.STDOUT)
+            if attempt_only:
+                output = subprocess.check_output(cmd.split(), stderr=subprocess.STDOUT)
+            else:
+                output = self._check_output(cmd.split())
             bb.note(output)
         except subprocess.CalledProcessError as e:
             (bb.fatal, bb.note)[attempt_only]("Unable to install packages. "
@@ -1613,6 +1620,19 @@ class OpkgPM(PackageManager):
             bb.fatal("Unable to remove packages. Command '%s' "
                      "returned %d:\n%s" % (e.cmd, e.returncode, e.output))
 
+    def upgrade(self):
+        cmd = "%s %s upgrade" % (self.opkg_cmd, self.opkg_args)
+
+        self._setup_scriptlet_env()
+
+        try:
+            bb.note(cmd)
+            output = self._check_output(cmd.split())
+            bb.note(output)
+        except subprocess.CalledProcessError as e:
+            bb.fatal("Unable to upgrade packages. Command '%s' "
+                     "returned %d:\n%s" % (cmd, e.returncode, e.output))
+
     def write_index(self):
         self.deploy_dir_lock()
 
@@ -1744,6 +1764,9 @@ class DpkgPM(PackageManager):
 
         self.apt_args = d.getVar("APT_ARGS", True)
 
+        self.dpkg_dir = os.path.join(self.target_rootfs, "var/lib/dpkg")
+        self.saved_dpkg_dir = self.d.expand('${T}/saved/dpkg')
+
         self.all_arch_list = archs.split()
         all_mlb_pkg_arch_list = (self.d.getVar('ALL_MULTILIB_PACKAGE_ARCHS', True) or "").split()
         self.all_arch_list.extend(arch for arch in all_mlb_pkg_arch_list if arch not in self.all_arch_list)
@@ -1770,21 +1793,49 @@ class DpkgPM(PackageManager):
                     if type(packages).__name__ != "list":
                         raise TypeError("'packages' should be a list object")
 
-                    status = sf.read()
-                    for pkg in packages:
-                        status = re.sub(r"Package: %s\n((?:[^\n]+\n)*?)Status: (.*)(?:unpacked|installed)" % pkg,
-                                        r"Package: %s\n\1Status: \2%s" % (pkg, status_tag),
-                                        status)
+                    # One pass over the status file whatever the number of
+                    # packages
+                    packages = set(packages)
+                    def mark(m):
+                        if m.group(1) not in packages:
+                            return m.group(0)
+                        return "Package: %s\n%sStatus: %s%s" % (m.group(1), m.group(2), m.group(3), status_tag)
 
-                    tmp_sf.write(status)
+                    tmp_sf.write(re.sub(r"Package: (.*?)\n((?:[^\n]+\n)*?)Status: (.*)(?:unpacked|installed)",
+                                        mark, sf.read()))
 
         os.rename(status_file + ".tmp", status_file)
 
     """
-    Run the pre/post installs for package "package_name". If package_name is
-    None, then run all pre/post install scriptlets.
+    Return a dict mapping each package in /var/lib/dpkg/status to a
+    (version, state) tuple, state being the last word of its Status field.
+    """
+    def package_states(self):
+        status_file = self.target_rootfs + "/var/lib/dpkg/status"
+        states = {}
+
+        if not os.path.exists(status_file):
+            return states
+
+        with open(status_file, "r") as status:
+            for stanza in status.read().split("\n\n"):
+                fields = {}
+                for line in stanza.split("\n"):
+                    if ":" in line and not line.startswith(" "):
+                        key, value = line.split(":", 1)
+                        fields[key] = value.strip()
+                if "Package" in fields:
+                    states[fields["Package"]] = (fields.get("Version"),
+                                                 (fields.get("Status") or "").split(" ")[-1])
+
+        return states
+
+    """
+    Run the pre/post installs for package "package_name", or for those in
+    the list "packages". If both are None, then run all pre/post install
+    scriptlets.
     """
-    def run_pre_post_installs(self, package_name=None):
+    def run_pre_post_installs(self, package_name=None, packages=None):
         info_dir = self.target_rootfs + "/var/lib/dpkg/info"
         suffixes = [(".preinst", "Preinstall"), (".postinst", "Postinstall")]
         status_file = self.target_rootfs + "/var/lib/dpkg/status"
@@ -1799,6 +1850,10 @@ class DpkgPM(PackageManager):
         if package_name is not None and not package_name in installed_pkgs:
             return
 
+        if packages is not None:
+            packages = set(packages)
+            installed_pkgs = [pkg for pkg in installed_pkgs if pkg in packages]
+
         os.environ['D'] = self.target_rootfs
         os.environ['OFFLINE_ROOT'] = self.target_rootfs
         os.environ['IPKG_OFFLINE_ROOT'] = self.target_rootfs
@@ -1857,6 +1912,24 @@ class DpkgPM(PackageManager):
                                               "Command '%s' returned %d:\n%s" %
                                               (cmd, e.returncode, e.output))
 
+        self._rename_dpkg_new()
+
+    def upgrade(self):
+        os.environ['APT_CONFIG'] = self.apt_conf_file
+
+        cmd = "%s %s upgrade --force-yes --allow-unauthenticated" % \
+              (self.apt_get_cmd, self.apt_args)
+
+        try:
+            bb.note(cmd)
+            subprocess.check_output(cmd.split(), stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            bb.fatal("Unable to upgrade packages. Command '%s' "
+                     "returned %d:\n%s" % (cmd, e.returncode, e.output))
+
+        self._rename_dpkg_new()
+
+    def _rename_dpkg_new(self):
         # rename *.dpkg-new files/dirs
         for root, dirs, files in os.walk(self.target_rootfs):
             for dir in dirs:
@@ -2024,6 +2097,60 @@ class DpkgPM(PackageManager):
     def list_installed(self):
         return DpkgPkgsList(self.d, self.target_rootfs).list_pkgs()
 
+    '''
+    Return the names of the packages apt would install for pkgs into an
+    empty rootfs, without installing anything. Failing to resolve
+    attempt_only packages isn't fatal and they are left out.
+    '''
+    def dump_install_solution(self, pkgs, attempt_only=False):
+        if len(pkgs) == 0:
+            return []
+
+        os.environ['APT_CONFIG'] = self.apt_conf_file
+
+        empty_status = self.d.expand('${T}/apt-empty-status')
+        open(empty_status, 'w+').close()
+
+        cmd = "%s %s -s -o Dir::State::status=%s install %s" % \
+              (self.apt_get_cmd, self.apt_args, empty_status, ' '.join(pkgs))
+
+        try:
+            output = subprocess.check_output(cmd.split(), stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            (bb.fatal, bb.note)[attempt_only]("Unable to dump install packages. "
+                                              "Command '%s' returned %d:\n%s" %
+                                              (cmd, e.returncode, e.output))
+            return []
+        finally:
+            bb.utils.remove(empty_status)
+
+        solution = []
+        for line in output.split('\n'):
+            m = re.match("^Inst ([^ :]+)", line)
+            if m is not None:
+                solution.append(m.group(1))
+
+        return solution
+
+    def backup_packaging_data(self):
+        # Save the dpkg status for incremental deb image generation
+        if os.path.exists(self.saved_dpkg_dir):
+            bb.utils.remove(self.saved_dpkg_dir, True)
+        shutil.copytree(self.dpkg_dir,
+                        self.saved_dpkg_dir,
+                        symlinks=True)
+
+    def recover_packaging_data(self):
+        # Move the dpkg status back
+        if os.path.exists(self.saved_dpkg_dir):
+            if os.path.exists(self.dpkg_dir):
+                bb.utils.remove(self.dpkg_dir, True)
+
+            bb.note('Recover packaging data')
+            shutil.copytree(self.saved_dpkg_dir,
+                            self.dpkg_dir,
+                            symlinks=True)
+
 
 def generate_index_files(d):
     classes = d.getVar('PACKAGE_CLASSES', True).replace("package_", "").split()
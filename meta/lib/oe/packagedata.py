@@ -1,4 +1,5 @@
 import codecs
+import os
 
 def packaged(pkg, d):
     return os.access(get_subpkgedata_fn(pkg, d) + '.packaged', os.R_OK)
@@ -53,29 +54,299 @@ def read_subpkgdata_dict(pkg, d):
         ret[newvar] = subd[var]
     return ret
 
-def _pkgmap(d):
-    """Return a dictionary mapping package to recipe name."""
+class PkgdataIndex(object):
+    """
+    Index of the pkgdata in a PKGDATA_DIR, answering the common queries
+    (package to recipe, runtime renaming, packaged state and which package
+    ships a path) without reading the pkgdata files.
 
-    pkgdatadir = d.getVar("PKGDATA_DIR", True)
+    The index is an SQLite database kept in PKGDATA_DIR. Recipe pkgdata is
+    installed and removed by sstate as a unit, so each recipe's entries are
+    keyed on the stat() of its ${PKGDATA_DIR}/${PN} file and of the runtime
+    files of its packages: opening the index re-reads the recipes whose
+    files were added, changed or removed since the last use and nothing
+    else. As the runtime files are checked too, an index refreshed while
+    sstate was still installing a recipe's pkgdata is corrected by the next
+    refresh. If the database can't be written it is built in memory instead.
+    """
+    dbname = "pkgdata-index.sqlite3"
+    # Bump when the tables change so existing indexes are rebuilt
+    version = 3
 
-    pkgmap = {}
-    try:
-        files = os.listdir(pkgdatadir)
-    except OSError:
-        bb.warn("No files in %s?" % pkgdatadir)
-        files = []
+    def __init__(self, pkgdatadir):
+        import sqlite3
 
-    for pn in filter(lambda f: not os.path.isdir(os.path.join(pkgdatadir, f)), files):
+        self.pkgdatadir = pkgdatadir
         try:
-            pkgdata = read_pkgdatafile(os.path.join(pkgdatadir, pn))
+            self.conn = self._connect(os.path.join(pkgdatadir, self.dbname))
+            self.refresh()
+        except sqlite3.Error:
+            self.conn = self._connect(":memory:")
+            self.refresh()
+
+    def _connect(self, dbfile):
+        import sqlite3
+
+        conn = sqlite3.connect(dbfile, timeout=60, isolation_level=None)
+        conn.text_factory = str
+        if conn.execute("PRAGMA user_version").fetchone()[0] != self.version:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.version:
+                for table in ("recipes", "packages", "files"):
+                    conn.execute("DROP TABLE IF EXISTS %s" % table)
+                conn.execute("PRAGMA user_version = %d" % self.version)
+            conn.execute("COMMIT")
+        conn.execute("CREATE TABLE IF NOT EXISTS recipes (recipe TEXT PRIMARY KEY, signature TEXT, packages TEXT, runtime TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS packages (pkg TEXT PRIMARY KEY, recipe TEXT, pn TEXT, renamed TEXT, packaged INTEGER, filesinfo INTEGER, size INTEGER)")
+        conn.execute("CREATE INDEX IF NOT EXISTS packages_recipe ON packages (recipe)")
+        conn.execute("CREATE INDEX IF NOT EXISTS packages_renamed ON packages (renamed)")
+        conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT, pkg TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+        conn.execute("CREATE INDEX IF NOT EXISTS files_pkg ON files (pkg)")
+        return conn
+
+    def _signatures(self):
+        signatures = {}
+        try:
+            files = os.listdir(self.pkgdatadir)
         except OSError:
+            return signatures
+        for fn in files:
+            if fn.startswith(self.dbname):
+                continue
+            try:
+                st = os.stat(os.path.join(self.pkgdatadir, fn))
+            except OSError:
+                continue
+            if not os.path.isdir(os.path.join(self.pkgdatadir, fn)):
+                signatures[fn] = "%d %d %d %d" % (st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+        return signatures
+
+    def _runtime_signature(self, packages):
+        import hashlib
+
+        signature = hashlib.md5()
+        for pkg in packages:
+            fn = os.path.join(self.pkgdatadir, "runtime", pkg)
+            try:
+                st = os.stat(fn)
+                signature.update("%s %d %d %d %d" % (pkg, st.st_ino, st.st_size, st.st_mtime, st.st_ctime))
+            except OSError:
+                signature.update("%s -" % pkg)
+            if os.path.exists(fn + ".packaged"):
+                signature.update(" packaged")
+            signature.update("\n")
+        return signature.hexdigest()
+
+    def refresh(self):
+        """Bring the index up to date with the pkgdata on disk"""
+        signatures = self._signatures()
+        c = self.conn.cursor()
+        # Take the write lock before comparing so concurrent users don't
+        # index the same recipes twice
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            current = set()
+            for recipe, signature, packages, runtime in c.execute("SELECT recipe, signature, packages, runtime FROM recipes").fetchall():
+                if signatures.get(recipe) == signature and \
+                        self._runtime_signature(packages.split()) == runtime:
+                    current.add(recipe)
+                else:
+                    self._remove(c, recipe)
+            for recipe in signatures:
+                if recipe not in current:
+                    self._add(c, recipe, signatures[recipe])
+            c.execute("COMMIT")
+        except:
+            c.execute("ROLLBACK")
+            raise
+
+    def _remove(self, c, recipe):
+        c.execute("DELETE FROM files WHERE pkg IN (SELECT pkg FROM packages WHERE recipe = ?)", (recipe,))
+        c.execute("DELETE FROM packages WHERE recipe = ?", (recipe,))
+        c.execute("DELETE FROM recipes WHERE recipe = ?", (recipe,))
+
+    def _add(self, c, recipe, signature):
+        import json
+
+        packages = read_pkgdatafile(os.path.join(self.pkgdatadir, recipe)).get("PACKAGES", "").split()
+        # Taken before the runtime files are read so that a change made
+        # while reading them shows at the next refresh
+        runtime = self._runtime_signature(packages)
+        c.execute("INSERT INTO recipes VALUES (?, ?, ?, ?)", (recipe, signature, " ".join(packages), runtime))
+        for pkg in packages:
+            fn = os.path.join(self.pkgdatadir, "runtime", pkg)
+            if not os.path.exists(fn):
+                continue
+            pkgdata = read_pkgdatafile(fn)
+            packaged = os.path.exists(fn + ".packaged")
+            files = pkgdata.get("FILES_INFO")
+            # A package name is only ever produced by one recipe
+            c.execute("DELETE FROM files WHERE pkg = ?", (pkg,))
+            try:
+                size = int(pkgdata.get("PKGSIZE_%s" % pkg))
+            except (TypeError, ValueError):
+                size = None
+            c.execute("INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (pkg, recipe, pkgdata.get("PN", ""), pkgdata.get("PKG_%s" % pkg, ""), packaged, files is not None, size))
+            if files:
+                c.executemany("INSERT INTO files VALUES (?, ?)", ((path, pkg) for path in json.loads(files)))
+
+    def recipes(self):
+        """Return a dict mapping each recipe to the list of its PACKAGES"""
+        return dict((recipe, packages.split()) for recipe, packages in
+                    self.conn.execute("SELECT recipe, packages FROM recipes"))
+
+    def pkgmap(self):
+        """Return a dictionary mapping package to recipe name"""
+        pkgmap = {}
+        for recipe, packages in self.recipes().items():
+            for pkg in packages:
+                pkgmap[pkg] = recipe
+        return pkgmap
+
+    def package_map(self):
+        """Return a dict mapping every recipe-space package to (pn, renamed, packaged)"""
+        return dict((pkg, (pn, renamed, bool(packaged))) for pkg, pn, renamed, packaged in
+                    self.conn.execute("SELECT pkg, pn, renamed, packaged FROM packages"))
+
+    def package(self, pkg):
+        """
+        Return (pn, renamed, packaged) for a recipe-space package name,
+        None if there is no pkgdata for the package
+        """
+        row = self.conn.execute("SELECT pn, renamed, packaged FROM packages WHERE pkg = ?", (pkg,)).fetchone()
+        if row:
+            return (row[0], row[1], bool(row[2]))
+        return None
+
+    def packages(self):
+        """Return all the recipe-space package names with pkgdata, sorted"""
+        return [row[0] for row in self.conn.execute("SELECT pkg FROM packages ORDER BY pkg")]
+
+    def reverse(self, runtimepkg):
+        """
+        Return the recipe-space package name for a runtime package name,
+        None if no packaged package is known by that name
+        """
+        row = self.conn.execute("SELECT pkg FROM packages WHERE renamed = ? AND packaged ORDER BY pkg", (runtimepkg,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def runtime_packages(self):
+        """Return the runtime names of all the packaged packages, sorted"""
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT renamed FROM packages WHERE packaged AND renamed != '' ORDER BY renamed")]
+
+    def runtime_sizes(self):
+        """Return a dict mapping the runtime names of the packaged packages to their PKGSIZE in bytes"""
+        sizes = {}
+        # Where several packages share a runtime name reverse() picks the first
+        for renamed, size in self.conn.execute("SELECT renamed, size FROM packages WHERE packaged AND size IS NOT NULL ORDER BY pkg DESC"):
+            sizes[renamed] = size
+        return sizes
+
+    def files(self, pkg):
+        """Return the sorted paths in a package, None if it has no FILES_INFO"""
+        row = self.conn.execute("SELECT filesinfo FROM packages WHERE pkg = ?", (pkg,)).fetchone()
+        if not row or not row[0]:
+            return None
+        return [row[0] for row in self.conn.execute("SELECT path FROM files WHERE pkg = ? ORDER BY path", (pkg,))]
+
+    def find_path(self, pattern):
+        """Return sorted (pkg, path) pairs for the paths matching the glob pattern"""
+        import fnmatch
+        import re
+
+        prefix = re.split(r"[*?[]", pattern, 1)[0]
+        if prefix == pattern:
+            rows = self.conn.execute("SELECT pkg, path FROM files WHERE path = ?", (pattern,))
+        elif prefix:
+            rows = self.conn.execute("SELECT pkg, path FROM files WHERE path >= ? AND path < ?", (prefix, prefix + "\xff"))
+        else:
+            rows = self.conn.execute("SELECT pkg, path FROM files")
+        return sorted((pkg, path) for pkg, path in rows if fnmatch.fnmatchcase(path, pattern))
+
+    def close(self):
+        self.conn.close()
+
+def complementary_packages(index, installed, globs, exclude=None):
+    """
+    Return the set of runtime package names complementing the installed
+    runtime packages according to globs (e.g. "*-dev" maps libz1 to
+    libz-dev), as "oe-pkgdata-util glob" does. exclude is an optional
+    regular expression matching installed packages to leave alone.
+
+    The pkgdata maps are read from index once and the globs compiled into
+    a single expression, so the whole installed set is resolved in one pass.
+    """
+    import fnmatch
+    import re
+
+    skipval = "-locale-|^locale-base-|-dev$|-doc$|-dbg$|-staticdev$|^kernel-module-"
+    if exclude:
+        skipval += "|" + exclude
+    skipregex = re.compile(skipval)
+    globregex = re.compile("|".join(fnmatch.translate(g) for g in globs))
+
+    packages = index.package_map()
+    reverse = {}
+    for pkg in sorted(packages, reverse=True):
+        pn, renamed, packaged = packages[pkg]
+        if packaged and renamed:
+            reverse[renamed] = pkg
+
+    def mapped(pkg):
+        # The runtime name of a recipe-space package, if it was packaged
+        fwd = packages.get(pkg)
+        if fwd and fwd[2]:
+            return fwd[1]
+        return None
+
+    skipped = set()
+    found = set()
+    for pkg in installed:
+        # Skip packages for which there is no point applying globs, or
+        # which already match them (e.g. a -dev package is installed)
+        if skipregex.search(pkg) or globregex.match(pkg):
+            skipped.add(pkg)
             continue
 
-        packages = pkgdata.get("PACKAGES") or ""
-        for pkg in packages.split():
-            pkgmap[pkg] = pn
+        origpkg = reverse.get(pkg)
+        for g in globs:
+            # First just try substitution (i.e. packagename -> packagename-dev)
+            newpkg = reverse.get(g.replace("*", pkg))
+            if newpkg:
+                mappedpkg = mapped(newpkg)
+            elif origpkg:
+                # Map after undoing the package renaming, failing that
+                # substitute the PN and map in the other direction
+                newpkg = g.replace("*", origpkg)
+                if newpkg not in packages:
+                    newpkg = g.replace("*", packages[origpkg][0])
+                mappedpkg = mapped(newpkg)
+            else:
+                # Package doesn't even exist...
+                break
+            if mappedpkg:
+                found.add(mappedpkg)
+
+    return found - skipped
+
+def _pkgmap(d):
+    """Return a dictionary mapping package to recipe name."""
 
-    return pkgmap
+    pkgdatadir = d.getVar("PKGDATA_DIR", True)
+
+    if not os.path.isdir(pkgdatadir):
+        bb.warn("No files in %s?" % pkgdatadir)
+        return {}
+
+    index = PkgdataIndex(pkgdatadir)
+    try:
+        return index.pkgmap()
+    finally:
+        index.close()
 
 def pkgmap(d):
     """Return a dictionary mapping package to recipe name.
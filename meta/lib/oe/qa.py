@@ -1,6 +1,12 @@
+import os
+
 class NotELFFileError(Exception):
     pass
 
+# ELFFile.dynamic() results for the lifetime of the task, keyed by
+# (st_dev, st_ino, st_mtime, st_size) of the file
+dynamic_cache = {}
+
 class ELFFile:
     EI_NIDENT = 16
 
@@ -23,6 +29,39 @@ class ELFFile:
     ELFDATA2LSB  = 1
     ELFDATA2MSB  = 2
 
+    # possible values for e_type
+    ET_NONE      = 0
+    ET_REL       = 1
+    ET_EXEC      = 2
+    ET_DYN       = 3
+    ET_CORE      = 4
+
+    # sh_type values we care about
+    SHT_SYMTAB   = 2
+
+    # p_type values we care about
+    PT_LOAD      = 1
+    PT_DYNAMIC   = 2
+
+    # d_tag values we care about
+    DT_NULL      = 0
+    DT_NEEDED    = 1
+    DT_HASH      = 4
+    DT_STRTAB    = 5
+    DT_SYMTAB    = 6
+    DT_STRSZ     = 10
+    DT_SONAME    = 14
+    DT_RPATH     = 15
+    DT_TEXTREL   = 22
+    DT_RUNPATH   = 29
+    DT_GNU_HASH  = 0x6ffffef5
+
+    # d_tag values whose d_val is an offset into the dynamic string table
+    DT_STRING_TAGS = (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH)
+
+    # e_machine values we care about
+    EM_MIPS      = 8
+
     def my_assert(self, expectation, result):
         if not expectation == result:
             #print "'%x','%x' %s" % (ord(expectation), ord(result), self.name)
@@ -32,12 +71,17 @@ class ELFFile:
         self.name = name
         self.bits = bits
         self.objdump_output = {}
+        self.file = None
+        self.header = None
+        self.sections = None
+        self.dynamic_entries = None
+        self.dynamic_errors = []
 
     def open(self):
         if not os.path.isfile(self.name):
             raise NotELFFileError("%s is not a normal file" % self.name)
 
-        self.file = file(self.name, "r")
+        self.file = file(self.name, "rb")
         self.data = self.file.read(ELFFile.EI_NIDENT+4)
 
         self.my_assert(len(self.data), ELFFile.EI_NIDENT+4)
@@ -71,6 +115,11 @@ class ELFFile:
         else:
             raise NotELFFileError("Unknown self.sex")
 
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
     def osAbi(self):
         return ord(self.data[ELFFile.EI_OSABI])
 
@@ -95,6 +144,219 @@ class ELFFile:
         (a,) = struct.unpack(self.sex+"H", self.data[18:20])
         return a
 
+    def readHeader(self):
+        """
+        Read the remainder of the ELF header, returning a tuple of
+        (e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+        e_ehsize, e_phentsize, e_phnum, e_shentsize, e_shnum, e_shstrndx)
+        """
+        import struct
+
+        if self.header is None:
+            if self.bits == 32:
+                fmt = self.sex + "HHIIIIIHHHHHH"
+            else:
+                fmt = self.sex + "HHIQQQIHHHHHH"
+            self.file.seek(ELFFile.EI_NIDENT)
+            data = self.file.read(struct.calcsize(fmt))
+            if len(data) != struct.calcsize(fmt):
+                raise NotELFFileError("%s has a truncated ELF header" % self.name)
+            self.header = struct.unpack(fmt, data)
+        return self.header
+
+    def elfType(self):
+        return self.readHeader()[0]
+
+    def readSections(self):
+        """
+        Return the section headers as a list of (name, sh_type, sh_offset,
+        sh_size) tuples, read directly from the file
+        """
+        import struct
+
+        if self.sections is not None:
+            return self.sections
+
+        (shoff, shentsize, shnum, shstrndx) = [self.readHeader()[i] for i in (5, 10, 11, 12)]
+        if self.bits == 32:
+            fmt = self.sex + "IIIIIIIIII"
+        else:
+            fmt = self.sex + "IIQQQQIIQQ"
+        size = struct.calcsize(fmt)
+
+        self.sections = []
+        if not shoff or shentsize < size:
+            return self.sections
+
+        def readentry(i):
+            self.file.seek(shoff + i * shentsize)
+            data = self.file.read(size)
+            if len(data) != size:
+                raise NotELFFileError("%s has truncated section headers" % self.name)
+            # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, ...
+            return struct.unpack(fmt, data)
+
+        # Section counts and string table indices which don't fit in the
+        # ELF header are stored in the first section header
+        if shnum == 0 or shstrndx == 0xffff:
+            first = readentry(0)
+            if shnum == 0:
+                shnum = first[5]
+            if shstrndx == 0xffff:
+                shstrndx = first[6]
+
+        entries = [readentry(i) for i in range(shnum)]
+        strtab = ""
+        if shstrndx < len(entries):
+            self.file.seek(entries[shstrndx][4])
+            strtab = self.file.read(entries[shstrndx][5])
+
+        for entry in entries:
+            nameoff = entry[0]
+            name = ""
+            if nameoff < len(strtab):
+                end = strtab.find("\0", nameoff)
+                name = strtab[nameoff:end if end != -1 else len(strtab)]
+            self.sections.append((name, entry[1], entry[4], entry[5]))
+        return self.sections
+
+    def isStripped(self):
+        # What file(1) reports as "stripped": no symbol table
+        for (name, shtype, offset, size) in self.readSections():
+            if shtype == ELFFile.SHT_SYMTAB:
+                return False
+        return True
+
+    def isKernelModule(self):
+        if self.elfType() != ELFFile.ET_REL:
+            return False
+        for (name, shtype, offset, size) in self.readSections():
+            if name == ".modinfo":
+                return True
+        return False
+
+    def readProgramHeaders(self, data):
+        """
+        Return the program headers in data (a mapping of the whole file) as
+        a list of (p_type, p_offset, p_vaddr, p_filesz) tuples
+        """
+        import struct
+
+        (phoff, phentsize, phnum) = [self.readHeader()[i] for i in (4, 8, 9)]
+        if self.bits == 32:
+            fmt = self.sex + "IIIIIIII"
+            fields = (0, 1, 2, 4)
+        else:
+            fmt = self.sex + "IIQQQQQQ"
+            fields = (0, 2, 3, 5)
+        size = struct.calcsize(fmt)
+
+        headers = []
+        if not phoff or phentsize < size:
+            return headers
+        if phoff + phnum * phentsize > len(data):
+            raise NotELFFileError("%s has truncated program headers" % self.name)
+        for i in range(phnum):
+            entry = struct.unpack_from(fmt, data, phoff + i * phentsize)
+            headers.append(tuple(entry[f] for f in fields))
+        return headers
+
+    def dynamic(self):
+        """
+        Return the entries of the dynamic section as a list of (d_tag, d_val)
+        tuples, in file order. Values of the string tags (DT_NEEDED,
+        DT_SONAME, DT_RPATH and DT_RUNPATH) are resolved to strings. Files
+        without a dynamic section return an empty list.
+
+        The file is parsed through mmap and the result cached for the task
+        by inode, mtime and size, so the shlibs code and each QA test can
+        ask for it without re-reading the file.
+        """
+        import mmap
+        import struct
+
+        if self.dynamic_entries is not None:
+            return self.dynamic_entries
+
+        st = os.fstat(self.file.fileno())
+        key = (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+        if key in dynamic_cache:
+            self.dynamic_entries = dynamic_cache[key]
+            return self.dynamic_entries
+
+        data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.dynamic_entries = self._readDynamic(data)
+        except (NotELFFileError, struct.error) as e:
+            # Treat it like objdump failing, as if there were no entries
+            bb.note("Unable to read dynamic section: %s" % e)
+            self.dynamic_entries = []
+        finally:
+            data.close()
+        for e in self.dynamic_errors:
+            bb.note("Skipping dynamic section entry: %s" % e)
+
+        dynamic_cache[key] = self.dynamic_entries
+        return self.dynamic_entries
+
+    def _readDynamic(self, data):
+        import struct
+
+        entries = []
+        phdrs = self.readProgramHeaders(data)
+        for (ptype, offset, vaddr, filesz) in phdrs:
+            if ptype != ELFFile.PT_DYNAMIC:
+                continue
+            if offset + filesz > len(data):
+                raise NotELFFileError("%s has a truncated dynamic section" % self.name)
+            fmt = self.sex + ("iI" if self.bits == 32 else "qQ")
+            size = struct.calcsize(fmt)
+            for off in range(offset, offset + filesz - size + 1, size):
+                (tag, val) = struct.unpack_from(fmt, data, off)
+                if tag == ELFFile.DT_NULL:
+                    break
+                entries.append((tag, val))
+            break
+
+        # The string table is located by address, find where that is
+        # loaded from in the file
+        strtab = None
+        strsz = 0
+        for (tag, val) in entries:
+            if tag == ELFFile.DT_STRTAB:
+                for (ptype, offset, vaddr, filesz) in phdrs:
+                    if ptype == ELFFile.PT_LOAD and vaddr <= val < vaddr + filesz:
+                        strtab = val - vaddr + offset
+            elif tag == ELFFile.DT_STRSZ:
+                strsz = val
+
+        def getstr(val):
+            if strtab is None or val >= strsz or strtab + val >= len(data):
+                return None
+            end = data.find(b"\0", strtab + val, strtab + strsz)
+            if end == -1:
+                end = strtab + strsz
+            return data[strtab + val:end]
+
+        # An entry with a bad string offset is left out on its own, so the
+        # other entries (DT_TEXTREL, DT_GNU_HASH, ...) are still seen
+        result = []
+        for (tag, val) in entries:
+            if tag in ELFFile.DT_STRING_TAGS:
+                string = getstr(val)
+                if string is None:
+                    self.dynamic_errors.append("%s has an invalid string offset %d for tag %d" % (self.name, val, tag))
+                    continue
+                val = string
+            result.append((tag, val))
+        return result
+
+    def dynamicValues(self, tag):
+        return [val for (t, val) in self.dynamic() if t == tag]
+
+    def hasDynamicTag(self, tag):
+        return bool(self.dynamicValues(tag))
+
     def run_objdump(self, cmd, d):
         import bb.process
         import sys
@@ -115,3 +377,143 @@ class ELFFile:
         except Exception as e:
             bb.note("%s %s %s failed: %s" % (objdump, cmd, self.name, e))
             return ""
+
+class ContentScanner(object):
+    """
+    Search files for a set of named regular expressions in a single pass
+    over an mmap of each file. The result for the most recently scanned
+    path is kept, so any number of QA checks can ask about the same file
+    while it is read only once. filters optionally maps pattern names to a
+    function of the path deciding whether that pattern is searched for in
+    the file, for patterns which only apply to some kinds of files.
+    """
+    def __init__(self, patterns, filters=None):
+        self.patterns = patterns
+        self.filters = filters or {}
+        self.regexes = {}
+        self.path = None
+        self.found = None
+
+    def _regex(self, names):
+        import re
+
+        if names not in self.regexes:
+            self.regexes[names] = re.compile("|".join("(?P<%s>%s)" % (name, self.patterns[name]) for name in names))
+        return self.regexes[names]
+
+    def search(self, data, names=None):
+        """
+        Return the set of names of the patterns (those in names if given)
+        matching somewhere in data
+        """
+        found = set()
+        remaining = set(self.patterns if names is None else names)
+        pos = 0
+        while remaining:
+            # Alternation only reports the first branch matching at a
+            # position, so drop each name once found and search again
+            # from where it matched
+            m = self._regex(tuple(sorted(remaining))).search(data, pos)
+            if not m:
+                break
+            found.add(m.lastgroup)
+            remaining.discard(m.lastgroup)
+            pos = m.start()
+        return found
+
+    def scan(self, path):
+        import mmap
+
+        if path == self.path:
+            return self.found
+        found = set()
+        names = None
+        if os.path.isfile(path) and not os.path.islink(path):
+            names = [name for name in self.patterns
+                     if name not in self.filters or self.filters[name](path)]
+        if names:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        found = self.search(data, names)
+                    finally:
+                        data.close()
+        self.path = path
+        self.found = found
+        return found
+
+# (checks, d) for the package walk workers, inherited through fork
+_walk_state = None
+
+def _walk_shard(shard):
+    package, paths = shard
+    checks, d, record = _walk_state
+    warnfuncs, errorfuncs = checks[package]
+    if record:
+        collect = record(d)
+    warnings = {}
+    errors = {}
+    for path in paths:
+        elf = ELFFile(path)
+        try:
+            elf.open()
+        except (IOError, NotELFFileError):
+            # IOError can happen if the packaging control files disappear,
+            elf = None
+        for func in warnfuncs:
+            func(path, package, d, elf, warnings)
+        for func in errorfuncs:
+            func(path, package, d, elf, errors)
+        if elf:
+            elf.close()
+    effects = []
+    if record:
+        effects = collect()
+    return (package, warnings, errors, effects)
+
+def _merge_messages(messages, new):
+    for section in new:
+        if section not in messages:
+            messages[section] = new[section]
+        else:
+            messages[section] = messages[section] + "\n" + new[section]
+
+def walk_packages(pkgfiles, checks, d, record=None, shardsize=64):
+    """
+    Run the per-file QA checks over the files of each package in a pool of
+    processes. checks maps each package to a (warnfuncs, errorfuncs) pair;
+    pkgfiles maps each package to its list of files. The files are split
+    into shards which are checked independently and the messages merged
+    back in the original file order, so the result is the same as a serial
+    walk. Returns a dict mapping each package to its (warnings, errors)
+    message dicts and the list of effects described below.
+
+    Checks run in forked workers, so whatever they do to d is lost. To
+    keep track of it, record is called with d in the worker before each
+    shard is checked and returns a function which, called afterwards,
+    returns a list of what the checks did (in a picklable form) for the
+    caller to replay. These lists are concatenated per package in file
+    order.
+    """
+    import oe.utils
+    global _walk_state
+
+    shards = []
+    for package in checks:
+        paths = pkgfiles.get(package, [])
+        for i in range(0, len(paths), shardsize):
+            shards.append((package, paths[i:i + shardsize]))
+
+    _walk_state = (checks, d, record)
+    try:
+        results = oe.utils.multiprocess_exec(shards, _walk_shard)
+    finally:
+        _walk_state = None
+
+    messages = dict((package, ({}, {}, [])) for package in checks)
+    for package, warnings, errors, effects in results:
+        _merge_messages(messages[package][0], warnings)
+        _merge_messages(messages[package][1], errors)
+        messages[package][2].extend(effects)
+    return messages
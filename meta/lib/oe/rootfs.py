@@ -3,7 +3,9 @@ from oe.utils import execute_pre_post_process
 from oe.package_manager import *
 from oe.manifest import *
 import oe.path
-import filecmp
+import oe.intercept
+import oe.logcheck
+import oe.multilib_check
 import shutil
 import os
 import subprocess
@@ -21,6 +23,9 @@ class Rootfs(object):
         self.pm = None
         self.image_rootfs = self.d.getVar('IMAGE_ROOTFS', True)
         self.deploy_dir_image = self.d.getVar('DEPLOY_DIR_IMAGE', True)
+        self.inc_image_gen = False
+        self.inc_reuse_rootfs = False
+        self.inc_config_file = self.d.expand('${T}/saved/incremental_config')
 
         self.install_order = Manifest.INSTALL_ORDER
 
@@ -40,51 +45,29 @@ class Rootfs(object):
     def _log_check(self):
         pass
 
-    def _log_check_warn(self):
-        r = re.compile('^(warn|Warn|NOTE: warn|NOTE: Warn|WARNING:)')
-        log_path = self.d.expand("${T}/log.do_rootfs")
-        with open(log_path, 'r') as log:
-            for line in log:
-                if 'log_check' in line or 'NOTE:' in line:
-                    continue
-
-                m = r.search(line)
-                if m:
-                    bb.warn('[log_check] %s: found a warning message in the logfile (keyword \'%s\'):\n[log_check] %s'
-				    % (self.d.getVar('PN', True), m.group(), line))
-
-    def _log_check_error(self):
-        r = re.compile(self.log_check_regex)
-        log_path = self.d.expand("${T}/log.do_rootfs")
-        with open(log_path, 'r') as log:
-            found_error = 0
-            message = "\n"
-            for line in log:
-                if 'log_check' in line:
-                    continue
-
-                if hasattr(self, 'log_check_expected_errors_regexes'):
-                    m = None
-                    for ee in self.log_check_expected_errors_regexes:
-                        m = re.search(ee, line)
-                        if m:
-                            break
-                    if m:
-                        continue
-
-                m = r.search(line)
-                if m:
-                    found_error = 1
-                    bb.warn('[log_check] In line: [%s]' % line)
-                    bb.warn('[log_check] %s: found an error message in the logfile (keyword \'%s\'):\n[log_check] %s'
-				    % (self.d.getVar('PN', True), m.group(), line))
-
-                if found_error >= 1 and found_error <= 5:
-                    message += line + '\n'
-                    found_error += 1
-
-                if found_error == 6:
-                    bb.fatal(message)
+    def _log_checker(self, warnings=True):
+        return oe.logcheck.LogChecker(self.log_check_regex,
+                                      getattr(self, 'log_check_expected_errors_regexes', []),
+                                      (None, oe.logcheck.WARN_REGEX)[warnings])
+
+    def _log_check_common(self):
+        checker = self._log_checker()
+        failure = None
+        try:
+            checker.check_file(self.d.expand("${T}/log.do_rootfs"))
+        except oe.logcheck.LogCheckError as e:
+            failure = str(e)
+
+        pn = self.d.getVar('PN', True)
+        for keyword, line in checker.warnings:
+            bb.warn('[log_check] %s: found a warning message in the logfile (keyword \'%s\'):\n[log_check] %s'
+                    % (pn, keyword, line))
+        for keyword, line in checker.errors:
+            bb.warn('[log_check] In line: [%s]' % line)
+            bb.warn('[log_check] %s: found an error message in the logfile (keyword \'%s\'):\n[log_check] %s'
+                    % (pn, keyword, line))
+        if failure is not None:
+            bb.fatal(failure)
 
     def _insert_feed_uris(self):
         if bb.utils.contains("IMAGE_FEATURES", "package-management",
@@ -104,6 +87,97 @@ class Rootfs(object):
     def _cleanup(self):
         pass
 
+    '''
+    With incremental image generation the rootfs of the previous build is
+    kept and only the difference between its install solution and the new
+    one is removed, then the remaining packages are upgraded in place.
+    Anything which changes how the solution is computed or where packages
+    come from is part of the configuration below, and a change to it (or a
+    previous build which didn't complete) means starting from scratch.
+    '''
+    def _incremental_config(self):
+        config_vars = ['BAD_RECOMMENDATIONS', 'NO_RECOMMENDATIONS',
+                       'PACKAGE_EXCLUDE', 'PACKAGE_ARCHS', 'MULTILIB_VARIANTS',
+                       'ALL_MULTILIB_PACKAGE_ARCHS', 'PACKAGE_FEED_URIS',
+                       'PACKAGE_FEED_BASE_PATHS', 'PACKAGE_FEED_ARCHS',
+                       'BUILD_IMAGES_FROM_FEEDS', 'IMAGE_ROOTFS']
+        config_vars += self._depends_list()
+        return ''.join('%s=%s\n' % (var, (self.d.getVar(var, True) or '').strip())
+                       for var in config_vars)
+
+    '''
+    Decide whether the previous rootfs can be reused, according to the
+    incremental image generation variable inc_var, and remove it if not.
+    This has to be called before the package manager is set up.
+    '''
+    def _prepare_incremental(self, inc_var):
+        self.inc_image_gen = self.d.getVar(inc_var, True) == "1"
+
+        old_config = None
+        if os.path.exists(self.inc_config_file):
+            with open(self.inc_config_file, 'r') as config:
+                old_config = config.read()
+            # Only written back once this build has completed
+            bb.utils.remove(self.inc_config_file)
+
+        self.inc_reuse_rootfs = self.inc_image_gen and \
+                                os.path.isdir(self.image_rootfs) and \
+                                old_config == self._incremental_config()
+        if not self.inc_reuse_rootfs:
+            if self.inc_image_gen and old_config is not None:
+                bb.note('Configuration changed, creating the rootfs from scratch')
+            bb.utils.remove(self.image_rootfs, True)
+
+    '''
+    Return the packages making up the previous install solution.
+    '''
+    def _installed_solution(self):
+        return self.manifest.parse_full_manifest()
+
+    '''
+    Return the packages the package manager would install for the packages
+    in the initial manifest, or None if it can't tell.
+    '''
+    def _install_solution(self, pkgs_to_install):
+        return None
+
+    def _incremental_remove(self, pkgs):
+        self.pm.remove(pkgs)
+
+    '''
+    Bring a reused rootfs in line with the new install solution, before the
+    packages in the initial manifest are installed. Must be called once the
+    package manager indexes are up to date.
+    '''
+    def _update_incremental(self, pkgs_to_install):
+        old_solution = self._installed_solution()
+        # Computed even for a new rootfs as some backends record it
+        new_solution = self._install_solution(pkgs_to_install)
+        if not self.inc_reuse_rootfs:
+            return
+
+        if new_solution is not None:
+            new_solution = set(new_solution)
+            pkgs_to_remove = [pkg for pkg in old_solution
+                              if pkg and pkg not in new_solution]
+            if pkgs_to_remove:
+                bb.note('incremental removed: %s' % ' '.join(pkgs_to_remove))
+                self._incremental_remove(pkgs_to_remove)
+
+        bb.note('incremental update -- upgrade packages in place')
+        self.pm.upgrade()
+
+    '''
+    Record what was installed and save the packaging data for the next
+    incremental build.
+    '''
+    def _save_incremental(self):
+        with open(self.manifest.full_manifest, 'w+') as manifest:
+            for pkg in sorted(self.pm.list_installed()):
+                manifest.write(pkg + '\n')
+
+        self.pm.backup_packaging_data()
+
     def _setup_dbg_rootfs(self, dirs):
         gen_debugfs = self.d.getVar('IMAGE_GEN_DEBUGFS', True) or '0'
         if gen_debugfs != '1':
@@ -194,9 +268,15 @@ class Rootfs(object):
 
         execute_pre_post_process(self.d, pre_process_cmds)
 
+        # let the package manager stop as soon as its output shows errors
+        self.pm.log_checker = lambda: self._log_checker(False)
+
         # call the package manager dependent create method
         self._create()
 
+        if self.inc_image_gen:
+            self._save_incremental()
+
         sysconfdir = self.image_rootfs + self.d.getVar('sysconfdir', True)
         bb.utils.mkdirhier(sysconfdir)
         with open(sysconfdir + "/version", "w+") as ver:
@@ -229,6 +309,11 @@ class Rootfs(object):
         self._cleanup()
         self._log_check()
 
+        if self.inc_image_gen:
+            bb.utils.mkdirhier(os.path.dirname(self.inc_config_file))
+            with open(self.inc_config_file, 'w') as config:
+                config.write(self._incremental_config())
+
     def _uninstall_unneeded(self):
         # Remove unneeded init script symlinks
         delayed_postinsts = self._get_delayed_postinsts()
@@ -284,35 +369,46 @@ class Rootfs(object):
         bb.note("Running intercept scripts:")
         os.environ['D'] = self.image_rootfs
         os.environ['STAGING_DIR_NATIVE'] = self.d.getVar('STAGING_DIR_NATIVE', True)
+
+        intercepts = []
         for script in os.listdir(intercepts_dir):
             script_full = os.path.join(intercepts_dir, script)
 
             if script == "postinst_intercept" or not os.access(script_full, os.X_OK):
                 continue
 
-            bb.note("> Executing %s intercept ..." % script)
+            intercepts.append(oe.intercept.Intercept(script_full))
 
-            try:
-                subprocess.check_call(script_full)
-            except subprocess.CalledProcessError as e:
-                bb.warn("The postinstall intercept hook '%s' failed (exit code: %d)! See log for details!" %
-                        (script, e.returncode))
+        def execute(intercept):
+            bb.note("> Executing %s intercept ..." % intercept.name)
+            proc = subprocess.Popen([intercept.path], stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            output = proc.communicate()[0]
+            return proc.returncode, output
 
-                with open(script_full) as intercept:
-                    registered_pkgs = None
-                    for line in intercept.read().split("\n"):
-                        m = re.match("^##PKGS:(.*)", line)
-                        if m is not None:
-                            registered_pkgs = m.group(1).strip()
-                            break
+        threads = int(self.d.getVar('IMAGE_INTERCEPT_THREADS', True) or "1")
+        try:
+            results = oe.intercept.run(intercepts, execute, threads)
+        except oe.intercept.InterceptError as e:
+            bb.fatal(str(e))
+
+        # Failures are handled in order, once everything has run
+        for intercept, (returncode, output) in results:
+            if output:
+                bb.note("%s intercept output:\n%s" % (intercept.name, output))
+            if returncode == 0:
+                continue
 
-                    if registered_pkgs is not None:
-                        bb.warn("The postinstalls for the following packages "
-                                "will be postponed for first boot: %s" %
-                                registered_pkgs)
+            bb.warn("The postinstall intercept hook '%s' failed (exit code: %d)! See log for details!" %
+                    (intercept.name, returncode))
 
-                        # call the backend dependent handler
-                        self._handle_intercept_failure(registered_pkgs)
+            if intercept.pkgs is not None:
+                bb.warn("The postinstalls for the following packages "
+                        "will be postponed for first boot: %s" %
+                        intercept.pkgs)
+
+                # call the backend dependent handler
+                self._handle_intercept_failure(intercept.pkgs)
 
     def _run_ldconfig(self):
         if self.d.getVar('LDCONFIGDEPEND', True):
@@ -375,52 +471,36 @@ class Rootfs(object):
 class RpmRootfs(Rootfs):
     def __init__(self, d, manifest_dir):
         super(RpmRootfs, self).__init__(d)
-        self.log_check_regex = '(unpacking of archive failed|Cannot find package'\
-                               '|exit 1|ERROR: |Error: |Error |ERROR '\
-                               '|Failed |Failed: |Failed$|Failed\(\d+\):)'
+        self.log_check_regex = '(unpacking of archive failed|Cannot find package|exit 1|ERR|Fail)'
+        self.log_check_expected_errors_regexes = \
+        [
+            # sh -x may emit code which isn't actually executed
+            "^\+"
+        ]
         self.manifest = RpmManifest(d, manifest_dir)
 
+        self._prepare_incremental('INC_RPM_IMAGE_GEN')
+
         self.pm = RpmPM(d,
                         d.getVar('IMAGE_ROOTFS', True),
                         self.d.getVar('TARGET_VENDOR', True)
                         )
 
-        self.inc_rpm_image_gen = self.d.getVar('INC_RPM_IMAGE_GEN', True)
-        if self.inc_rpm_image_gen != "1":
-            bb.utils.remove(self.image_rootfs, True)
-        else:
-            self.pm.recovery_packaging_data()
+        if self.inc_reuse_rootfs:
+            self.pm.recover_packaging_data()
         bb.utils.remove(self.d.getVar('MULTILIB_TEMP_ROOTFS', True), True)
 
         self.pm.create_configs()
 
-    '''
-    While rpm incremental image generation is enabled, it will remove the
-    unneeded pkgs by comparing the new install solution manifest and the
-    old installed manifest.
-    '''
-    def _create_incremental(self, pkgs_initial_install):
-        if self.inc_rpm_image_gen == "1":
+    def _installed_solution(self):
+        return self.pm.load_old_install_solution()
 
-            pkgs_to_install = list()
-            for pkg_type in pkgs_initial_install:
-                pkgs_to_install += pkgs_initial_install[pkg_type]
-
-            installed_manifest = self.pm.load_old_install_solution()
-            solution_manifest = self.pm.dump_install_solution(pkgs_to_install)
-
-            pkg_to_remove = list()
-            for pkg in installed_manifest:
-                if pkg not in solution_manifest:
-                    pkg_to_remove.append(pkg)
-
-            self.pm.update()
+    def _install_solution(self, pkgs_to_install):
+        pkgs = list()
+        for pkg_type in pkgs_to_install:
+            pkgs += pkgs_to_install[pkg_type]
 
-            bb.note('incremental update -- upgrade packages in place ')
-            self.pm.upgrade()
-            if pkg_to_remove != []:
-                bb.note('incremental removed: %s' % ' '.join(pkg_to_remove))
-                self.pm.remove(pkg_to_remove)
+        return self.pm.dump_install_solution(pkgs)
 
     def _create(self):
         pkgs_to_install = self.manifest.parse_initial_manifest()
@@ -434,11 +514,11 @@ class RpmRootfs(Rootfs):
 
         self.pm.dump_all_available_pkgs()
 
-        if self.inc_rpm_image_gen == "1":
-            self._create_incremental(pkgs_to_install)
-
         self.pm.update()
 
+        if self.inc_image_gen:
+            self._update_incremental(pkgs_to_install)
+
         pkgs = []
         pkgs_attempt = []
         for pkg_type in pkgs_to_install:
@@ -459,9 +539,6 @@ class RpmRootfs(Rootfs):
 
         self._log_check()
 
-        if self.inc_rpm_image_gen == "1":
-            self.pm.backup_packaging_data()
-
         self.pm.rpm_setup_smart_target_config()
 
     @staticmethod
@@ -484,35 +561,8 @@ class RpmRootfs(Rootfs):
         # already saved in /etc/rpm-postinsts
         pass
 
-    def _log_check_error(self):
-        r = re.compile('(unpacking of archive failed|Cannot find package|exit 1|ERR|Fail)')
-        log_path = self.d.expand("${T}/log.do_rootfs")
-        with open(log_path, 'r') as log:
-            found_error = 0
-            message = "\n"
-            for line in log.read().split('\n'):
-                if 'log_check' in line:
-                    continue
-                # sh -x may emit code which isn't actually executed
-                if line.startswith('+'):
-		    continue
-
-                m = r.search(line)
-                if m:
-                    found_error = 1
-                    bb.warn('log_check: There were error messages in the logfile')
-                    bb.warn('log_check: Matched keyword: [%s]\n\n' % m.group())
-
-                if found_error >= 1 and found_error <= 5:
-                    message += line + '\n'
-                    found_error += 1
-
-                if found_error == 6:
-                    bb.fatal(message)
-
     def _log_check(self):
-        self._log_check_warn()
-        self._log_check_error()
+        self._log_check_common()
 
     def _handle_intercept_failure(self, registered_pkgs):
         rpm_postinsts_dir = self.image_rootfs + self.d.expand('${sysconfdir}/rpm-postinsts/')
@@ -637,13 +687,27 @@ class DpkgRootfs(DpkgOpkgRootfs):
             "^E: Unmet dependencies."
         ]
 
-        bb.utils.remove(self.image_rootfs, True)
+        self._prepare_incremental('INC_DEB_IMAGE_GEN')
         bb.utils.remove(self.d.getVar('MULTILIB_TEMP_ROOTFS', True), True)
         self.manifest = DpkgManifest(d, manifest_dir)
         self.pm = DpkgPM(d, d.getVar('IMAGE_ROOTFS', True),
                          d.getVar('PACKAGE_ARCHS', True),
                          d.getVar('DPKG_ARCH', True))
+        if self.inc_reuse_rootfs:
+            self.pm.recover_packaging_data()
 
+    def _install_solution(self, pkgs_to_install):
+        solution = list()
+        for pkg_type in self.install_order:
+            if pkg_type in pkgs_to_install:
+                solution += self.pm.dump_install_solution(pkgs_to_install[pkg_type],
+                                                          pkg_type == Manifest.PKG_TYPE_ATTEMPT_ONLY)
+
+        return solution
+
+    def _incremental_remove(self, pkgs):
+        # apt-get purge would ask for confirmation
+        self.pm.remove(pkgs, False)
 
     def _create(self):
         pkgs_to_install = self.manifest.parse_initial_manifest()
@@ -660,6 +724,14 @@ class DpkgRootfs(DpkgOpkgRootfs):
 
         self.pm.update()
 
+        # What a reused rootfs already has, so the scriptlets of the
+        # packages which haven't changed aren't run again and the delayed
+        # postinsts among them stay pending for the first boot
+        old_states = self.pm.package_states()
+
+        if self.inc_image_gen:
+            self._update_incremental(pkgs_to_install)
+
         for pkg_type in self.install_order:
             if pkg_type in pkgs_to_install:
                 self.pm.install(pkgs_to_install[pkg_type],
@@ -671,15 +743,18 @@ class DpkgRootfs(DpkgOpkgRootfs):
 
         self.pm.fix_broken_dependencies()
 
-        self.pm.mark_packages("installed")
+        unpacked = [pkg for pkg, state in self.pm.package_states().items()
+                    if state[1] == "unpacked" and old_states.get(pkg) != state]
+
+        self.pm.mark_packages("installed", unpacked)
 
-        self.pm.run_pre_post_installs()
+        self.pm.run_pre_post_installs(packages=unpacked)
 
         execute_pre_post_process(self.d, deb_post_process_cmds)
 
     @staticmethod
     def _depends_list():
-        return ['DEPLOY_DIR_DEB', 'DEB_SDK_ARCH', 'APTCONF_TARGET', 'APT_ARGS', 'DPKG_ARCH', 'DEB_PREPROCESS_COMMANDS', 'DEB_POSTPROCESS_COMMANDS']
+        return ['DEPLOY_DIR_DEB', 'DEB_SDK_ARCH', 'APTCONF_TARGET', 'APT_ARGS', 'DPKG_ARCH', 'INC_DEB_IMAGE_GEN', 'DEB_PREPROCESS_COMMANDS', 'DEB_POSTPROCESS_COMMANDS']
 
     def _get_delayed_postinsts(self):
         status_file = self.image_rootfs + "/var/lib/dpkg/status"
@@ -694,8 +769,7 @@ class DpkgRootfs(DpkgOpkgRootfs):
         self.pm.mark_packages("unpacked", registered_pkgs.split())
 
     def _log_check(self):
-        self._log_check_warn()
-        self._log_check_error()
+        self._log_check_common()
 
     def _cleanup(self):
         pass
@@ -710,24 +784,18 @@ class OpkgRootfs(DpkgOpkgRootfs):
         self.opkg_conf = self.d.getVar("IPKGCONF_TARGET", True)
         self.pkg_archs = self.d.getVar("ALL_MULTILIB_PACKAGE_ARCHS", True)
 
-        self.inc_opkg_image_gen = self.d.getVar('INC_IPK_IMAGE_GEN', True) or ""
-        if self._remove_old_rootfs():
-            bb.utils.remove(self.image_rootfs, True)
-            self.pm = OpkgPM(d,
-                             self.image_rootfs,
-                             self.opkg_conf,
-                             self.pkg_archs)
-        else:
-            self.pm = OpkgPM(d,
-                             self.image_rootfs,
-                             self.opkg_conf,
-                             self.pkg_archs)
+        self._prepare_incremental('INC_IPK_IMAGE_GEN')
+        self.pm = OpkgPM(d,
+                         self.image_rootfs,
+                         self.opkg_conf,
+                         self.pkg_archs)
+        if self.inc_reuse_rootfs:
             self.pm.recover_packaging_data()
 
         bb.utils.remove(self.d.getVar('MULTILIB_TEMP_ROOTFS', True), True)
 
-    def _prelink_file(self, root_dir, filename):
-        bb.note('prelink %s in %s' % (filename, root_dir))
+    def _prelink_rootfs(self, root_dir):
+        bb.note('prelink %s' % root_dir)
         prelink_cfg = oe.path.join(root_dir,
                                    self.d.expand('${sysconfdir}/prelink.conf'))
         if not os.path.exists(prelink_cfg):
@@ -743,39 +811,15 @@ class OpkgRootfs(DpkgOpkgRootfs):
                               '-c',
                               self.d.expand('${sysconfdir}/prelink.conf')])
 
-    '''
-    Compare two files with the same key twice to see if they are equal.
-    If they are not equal, it means they are duplicated and come from
-    different packages.
-    1st: Comapre them directly;
-    2nd: While incremental image creation is enabled, one of the
-         files could be probaly prelinked in the previous image
-         creation and the file has been changed, so we need to
-         prelink the other one and compare them.
-    '''
-    def _file_equal(self, key, f1, f2):
-
-        # Both of them are not prelinked
-        if filecmp.cmp(f1, f2):
-            return True
-
-        if self.image_rootfs not in f1:
-            self._prelink_file(f1.replace(key, ''), f1)
-
-        if self.image_rootfs not in f2:
-            self._prelink_file(f2.replace(key, ''), f2)
-
-        # Both of them are prelinked
-        if filecmp.cmp(f1, f2):
-            return True
-
-        # Not equal
-        return False
-
     """
     This function was reused from the old implementation.
     See commit: "image.bbclass: Added variables for multilib support." by
     Lianhao Lu.
+
+    Files which differ are compared again once the multilib rootfs
+    containing them has been prelinked, as with incremental image creation
+    the files in the image rootfs may have been prelinked by the previous
+    image creation.
     """
     def _multilib_sanity_test(self, dirs):
 
@@ -786,29 +830,13 @@ class OpkgRootfs(DpkgOpkgRootfs):
         allow_rep = re.compile(re.sub("\|$", "", allow_replace))
         error_prompt = "Multilib check error:"
 
-        files = {}
-        for dir in dirs:
-            for root, subfolders, subfiles in os.walk(dir):
-                for file in subfiles:
-                    item = os.path.join(root, file)
-                    key = str(os.path.join("/", os.path.relpath(item, dir)))
-
-                    valid = True
-                    if key in files:
-                        #check whether the file is allow to replace
-                        if allow_rep.match(key):
-                            valid = True
-                        else:
-                            if os.path.exists(files[key]) and \
-                               os.path.exists(item) and \
-                               not self._file_equal(key, files[key], item):
-                                valid = False
-                                bb.fatal("%s duplicate files %s %s is not the same\n" %
-                                         (error_prompt, item, files[key]))
-
-                    #pass the check, add to list
-                    if valid:
-                        files[key] = item
+        conflicts = oe.multilib_check.find_conflicts(dirs, allow_rep,
+                                                     self._prelink_rootfs,
+                                                     oe.utils.cpu_count())
+        if conflicts:
+            key, first, second = conflicts[0]
+            bb.fatal("%s duplicate files %s %s is not the same\n" %
+                     (error_prompt, second, first))
 
     def _multilib_test_install(self, pkgs):
         ml_temp = self.d.getVar("MULTILIB_TEMP_ROOTFS", True)
@@ -834,57 +862,14 @@ class OpkgRootfs(DpkgOpkgRootfs):
         self._multilib_sanity_test(dirs)
 
     '''
-    While ipk incremental image generation is enabled, it will remove the
-    unneeded pkgs by comparing the old full manifest in previous existing
-    image and the new full manifest in the current image.
+    The new solution comes from a dummy install of the initial manifest,
+    written over the full manifest of the previous build (which has already
+    been read by then).
     '''
-    def _remove_extra_packages(self, pkgs_initial_install):
-        if self.inc_opkg_image_gen == "1":
-            # Parse full manifest in previous existing image creation session
-            old_full_manifest = self.manifest.parse_full_manifest()
-
-            # Create full manifest for the current image session, the old one
-            # will be replaced by the new one.
-            self.manifest.create_full(self.pm)
-
-            # Parse full manifest in current image creation session
-            new_full_manifest = self.manifest.parse_full_manifest()
-
-            pkg_to_remove = list()
-            for pkg in old_full_manifest:
-                if pkg not in new_full_manifest:
-                    pkg_to_remove.append(pkg)
+    def _install_solution(self, pkgs_to_install):
+        self.manifest.create_full(self.pm)
 
-            if pkg_to_remove != []:
-                bb.note('decremental removed: %s' % ' '.join(pkg_to_remove))
-                self.pm.remove(pkg_to_remove)
-
-    '''
-    Compare with previous existing image creation, if some conditions
-    triggered, the previous old image should be removed.
-    The conditions include any of 'PACKAGE_EXCLUDE, NO_RECOMMENDATIONS
-    and BAD_RECOMMENDATIONS' has been changed.
-    '''
-    def _remove_old_rootfs(self):
-        if self.inc_opkg_image_gen != "1":
-            return True
-
-        vars_list_file = self.d.expand('${T}/vars_list')
-
-        old_vars_list = ""
-        if os.path.exists(vars_list_file):
-            old_vars_list = open(vars_list_file, 'r+').read()
-
-        new_vars_list = '%s:%s:%s\n' % \
-                ((self.d.getVar('BAD_RECOMMENDATIONS', True) or '').strip(),
-                 (self.d.getVar('NO_RECOMMENDATIONS', True) or '').strip(),
-                 (self.d.getVar('PACKAGE_EXCLUDE', True) or '').strip())
-        open(vars_list_file, 'w+').write(new_vars_list)
-
-        if old_vars_list != new_vars_list:
-            return True
-
-        return False
+        return self.manifest.parse_full_manifest()
 
     def _create(self):
         pkgs_to_install = self.manifest.parse_initial_manifest()
@@ -902,8 +887,8 @@ class OpkgRootfs(DpkgOpkgRootfs):
 
         self.pm.handle_bad_recommendations()
 
-        if self.inc_opkg_image_gen == "1":
-            self._remove_extra_packages(pkgs_to_install)
+        if self.inc_image_gen:
+            self._update_incremental(pkgs_to_install)
 
         for pkg_type in self.install_order:
             if pkg_type in pkgs_to_install:
@@ -923,9 +908,6 @@ class OpkgRootfs(DpkgOpkgRootfs):
         execute_pre_post_process(self.d, opkg_post_process_cmds)
         execute_pre_post_process(self.d, rootfs_post_install_cmds)
 
-        if self.inc_opkg_image_gen == "1":
-            self.pm.backup_packaging_data()
-
     @staticmethod
     def _depends_list():
         return ['IPKGCONF_SDK', 'IPK_FEED_URIS', 'DEPLOY_DIR_IPK', 'IPKGCONF_TARGET', 'INC_IPK_IMAGE_GEN', 'OPKG_ARGS', 'OPKGLIBDIR', 'OPKG_PREPROCESS_COMMANDS', 'OPKG_POSTPROCESS_COMMANDS', 'OPKGLIBDIR']
@@ -945,8 +927,7 @@ class OpkgRootfs(DpkgOpkgRootfs):
         self.pm.mark_packages("unpacked", registered_pkgs.split())
 
     def _log_check(self):
-        self._log_check_warn()
-        self._log_check_error()
+        self._log_check_common()
 
     def _cleanup(self):
         self.pm.remove_lists()
@@ -0,0 +1,236 @@
+#
+# Copying of sparse files and generation of block maps for them
+#
+# Only the data extents of the source, as reported by SEEK_DATA/SEEK_HOLE,
+# are copied so holes stay holes in the destination. Extents are copied
+# with copy_file_range(), which lets filesystems supporting it share the
+# blocks instead of copying them, and otherwise through a large buffer,
+# leaving out blocks which are entirely zero. Without SEEK_DATA support
+# the whole file is treated as data. The destination area is expected to
+# read as zeros already, as in a newly created disk image.
+#
+# The block map files written by write_bmap() are in the format of
+# bmaptool (version 2.0), which uses them to flash only the mapped blocks
+# of an image. export() streams a whole image, for instance into a
+# compressor, writing its block map in the same pass; only the mapped
+# blocks are read, the holes being passed on as zeros.
+#
+
+import os
+import errno
+import ctypes
+import hashlib
+
+SEEK_DATA = getattr(os, "SEEK_DATA", 3)
+SEEK_HOLE = getattr(os, "SEEK_HOLE", 4)
+
+BUFFER_SIZE = 4 * 1024 * 1024
+
+BMAP_BLOCK_SIZE = 4096
+
+def data_ranges(fd, start=0, end=None):
+    """
+    Yield the (start, end) offsets of the data extents of the open file fd
+    between start and end (by default its size)
+    """
+    if end is None:
+        end = os.fstat(fd).st_size
+    pos = start
+    while pos < end:
+        try:
+            data = os.lseek(fd, pos, SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # No data after pos
+                return
+            if e.errno != errno.EINVAL:
+                raise
+            # Holes not supported, the rest is data
+            data = pos
+            hole = end
+        else:
+            if data >= end:
+                return
+            hole = os.lseek(fd, data, SEEK_HOLE)
+        yield (data, min(hole, end))
+        pos = hole
+
+_copy_file_range = getattr(os, "copy_file_range", None)
+if _copy_file_range is None:
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc_copy_file_range = _libc.copy_file_range
+    except (OSError, AttributeError):
+        pass
+    else:
+        _libc_copy_file_range.restype = ctypes.c_ssize_t
+        _libc_copy_file_range.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_int64),
+                                          ctypes.c_int, ctypes.POINTER(ctypes.c_int64),
+                                          ctypes.c_size_t, ctypes.c_uint]
+
+        def _copy_file_range(src, dst, count, offset_src, offset_dst):
+            off_src = ctypes.c_int64(offset_src)
+            off_dst = ctypes.c_int64(offset_dst)
+            ret = _libc_copy_file_range(src, ctypes.byref(off_src), dst,
+                                        ctypes.byref(off_dst), count, 0)
+            if ret < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            return ret
+
+# Errors of copy_file_range() meaning it can't be used for the files given
+_FALLBACK_ERRNOS = set([errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF,
+                        getattr(errno, "EOPNOTSUPP", errno.ENOSYS)])
+
+class SparseCopier(object):
+    """
+    Copy the data extents of source files into a destination file, falling
+    back to plain reads and writes once copy_file_range() is found not to
+    work for it
+    """
+    def __init__(self):
+        self.use_copy_file_range = _copy_file_range is not None
+
+    def _copy_buffered(self, src, dst, start, end, dst_offset):
+        pos = start
+        while pos < end:
+            os.lseek(src, pos, os.SEEK_SET)
+            buf = os.read(src, min(BUFFER_SIZE, end - pos))
+            if not buf:
+                break
+            if buf.count(b"\0") != len(buf):
+                os.lseek(dst, pos + dst_offset, os.SEEK_SET)
+                written = 0
+                while written < len(buf):
+                    written += os.write(dst, buf[written:])
+            pos += len(buf)
+
+    def _copy_range(self, src, dst, start, end, dst_offset):
+        pos = start
+        while pos < end and self.use_copy_file_range:
+            try:
+                count = _copy_file_range(src, dst, end - pos, pos, pos + dst_offset)
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+                self.use_copy_file_range = False
+                break
+            if not count:
+                break
+            pos += count
+        if pos < end:
+            self._copy_buffered(src, dst, pos, end, dst_offset)
+
+    def copy(self, source, dest, dest_offset=0, length=None):
+        """
+        Copy the first length bytes (by default all) of the file source
+        into the existing file dest at dest_offset. Returns the number of
+        bytes of data copied.
+        """
+        copied = 0
+        src = os.open(source, os.O_RDONLY)
+        try:
+            dst = os.open(dest, os.O_WRONLY)
+            try:
+                size = os.fstat(src).st_size
+                if length is not None:
+                    size = min(size, length)
+                for start, end in data_ranges(src, 0, size):
+                    self._copy_range(src, dst, start, end, dest_offset)
+                    copied += end - start
+                # Like dd, make sure dest covers the whole copied area
+                # even if it ends in a hole
+                if os.fstat(dst).st_size < dest_offset + size:
+                    os.ftruncate(dst, dest_offset + size)
+            finally:
+                os.close(dst)
+        finally:
+            os.close(src)
+        return copied
+
+def copy_sparse(source, dest, dest_offset=0, length=None):
+    """Copy source into dest at dest_offset, see SparseCopier.copy()"""
+    return SparseCopier().copy(source, dest, dest_offset, length)
+
+def mapped_blocks(path, block_size=BMAP_BLOCK_SIZE):
+    """Return the list of (first, last) ranges of the blocks of path holding data"""
+    blocks = []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for start, end in data_ranges(fd):
+            first, last = start // block_size, (end - 1) // block_size
+            if blocks and first <= blocks[-1][1] + 1:
+                blocks[-1] = (blocks[-1][0], max(last, blocks[-1][1]))
+            else:
+                blocks.append((first, last))
+    finally:
+        os.close(fd)
+    return blocks
+
+def _write_zeros(write, length):
+    zeros = b"\0" * min(BUFFER_SIZE, length)
+    while length > 0:
+        write(zeros[:min(len(zeros), length)])
+        length -= len(zeros)
+
+def export(image, write=None, bmap=None, block_size=BMAP_BLOCK_SIZE):
+    """
+    Pass the whole contents of the file image, in order, to write() if
+    given and write its block map to the file bmap if given
+    """
+    size = os.stat(image).st_size
+    ranges = []
+    pos = 0
+    with open(image, "rb") as f:
+        for first, last in mapped_blocks(image, block_size):
+            start, end = first * block_size, min((last + 1) * block_size, size)
+            if write:
+                _write_zeros(write, start - pos)
+            h = hashlib.sha256()
+            f.seek(start)
+            pos = start
+            while pos < end:
+                buf = f.read(min(BUFFER_SIZE, end - pos))
+                if not buf:
+                    break
+                h.update(buf)
+                if write:
+                    write(buf)
+                pos += len(buf)
+            ranges.append((first, last, h.hexdigest()))
+    if write:
+        _write_zeros(write, size - pos)
+    if bmap:
+        _write_bmap_file(bmap, size, block_size, ranges)
+
+def _write_bmap_file(bmap, size, block_size, ranges):
+    lines = []
+    for first, last, chksum in ranges:
+        if first == last:
+            lines.append('        <Range chksum="%s"> %d </Range>\n' % (chksum, first))
+        else:
+            lines.append('        <Range chksum="%s"> %d-%d </Range>\n' % (chksum, first, last))
+
+    # The checksum of the file is computed with its own value zeroed
+    zero = "0" * 64
+    content = ('<?xml version="1.0" ?>\n'
+               '<bmap version="2.0">\n'
+               '    <ImageSize> %d </ImageSize>\n'
+               '    <BlockSize> %d </BlockSize>\n'
+               '    <BlocksCount> %d </BlocksCount>\n'
+               '    <MappedBlocksCount> %d </MappedBlocksCount>\n'
+               '    <ChecksumType> sha256 </ChecksumType>\n'
+               '    <BmapFileChecksum> %s </BmapFileChecksum>\n'
+               '    <BlockMap>\n'
+               '%s'
+               '    </BlockMap>\n'
+               '</bmap>\n') % (size, block_size, (size + block_size - 1) // block_size,
+                               sum(last - first + 1 for first, last, chksum in ranges),
+                               zero, "".join(lines))
+    content = content.replace(zero, hashlib.sha256(content.encode()).hexdigest())
+    with open(bmap, "w") as f:
+        f.write(content)
+
+def write_bmap(image, bmap, block_size=BMAP_BLOCK_SIZE):
+    """Write the block map of the file image to the file bmap"""
+    export(image, None, bmap, block_size)
@@ -0,0 +1,257 @@
+#
+# Helpers for checking, creating and unpacking sstate objects
+#
+
+import os
+import time
+import hashlib
+import tarfile
+
+class SstateDirIndex(object):
+    """
+    Cached view of the contents of SSTATE_DIR. Each directory holding
+    sstate objects (the two character hash prefix directories) is listed
+    once and held as a set, so checking thousands of objects costs one
+    listdir() per prefix directory instead of one stat() per object.
+    """
+    def __init__(self, sstatedir):
+        self.sstatedir = sstatedir
+        self.listings = {}
+
+    def listing(self, dirname):
+        if dirname not in self.listings:
+            try:
+                self.listings[dirname] = frozenset(os.listdir(dirname))
+            except OSError:
+                self.listings[dirname] = frozenset()
+        return self.listings[dirname]
+
+    def exists(self, sstatefile):
+        path = os.path.join(self.sstatedir, sstatefile)
+        dirname, fn = os.path.split(path)
+        return fn in self.listing(dirname)
+
+class MirrorStatusCache(object):
+    """
+    On-disk cache of SSTATE_MIRRORS availability results, keyed by sstate
+    filename. Hits and misses expire independently after hitttl and
+    missttl seconds; a ttl of zero disables caching for that result. The
+    cache is discarded wholesale when the mirror configuration changes.
+
+    The file format is a header line holding a signature of the mirror
+    configuration followed by one "<status> <timestamp> <filename>" line
+    per entry, where status is 1 for a hit and 0 for a miss.
+    """
+    def __init__(self, cachefile, mirrors, hitttl, missttl):
+        self.cachefile = cachefile
+        self.signature = hashlib.md5(mirrors or "").hexdigest()
+        self.hitttl = hitttl
+        self.missttl = missttl
+        self.updates = {}
+        self.entries = self._read()
+
+    def _read(self):
+        entries = {}
+        try:
+            with open(self.cachefile, "r") as f:
+                if f.readline().strip() != self.signature:
+                    return entries
+                for line in f:
+                    fields = line.split(None, 2)
+                    if len(fields) != 3:
+                        continue
+                    try:
+                        entries[fields[2].rstrip("\n")] = (fields[0] == "1", float(fields[1]))
+                    except ValueError:
+                        continue
+        except IOError:
+            pass
+        return entries
+
+    def _valid(self, entry, now):
+        status, stamp = entry
+        ttl = self.hitttl if status else self.missttl
+        return now - stamp < ttl
+
+    def lookup(self, sstatefile, now=None):
+        """
+        Return True or False for a cached hit or miss, None when the
+        mirrors need to be checked.
+        """
+        if now is None:
+            now = time.time()
+        entry = self.updates.get(sstatefile) or self.entries.get(sstatefile)
+        if entry and self._valid(entry, now):
+            return entry[0]
+        return None
+
+    def record(self, sstatefile, status, now=None):
+        if now is None:
+            now = time.time()
+        self.updates[sstatefile] = (status, now)
+
+    def save(self, now=None):
+        """
+        Merge the recorded results into the cache file. Entries written by
+        concurrent builds since we read the file are kept; expired entries
+        are dropped. Callers sharing a cache file between processes should
+        hold a lock around this call.
+        """
+        if not self.updates:
+            return
+        if now is None:
+            now = time.time()
+        entries = self._read()
+        entries.update(self.updates)
+
+        dirname = os.path.dirname(self.cachefile)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmpfile = "%s.%s" % (self.cachefile, os.getpid())
+        with open(tmpfile, "w") as f:
+            f.write(self.signature + "\n")
+            for fn in sorted(entries):
+                if self._valid(entries[fn], now):
+                    status, stamp = entries[fn]
+                    f.write("%d %d %s\n" % (status, stamp, fn))
+        os.rename(tmpfile, self.cachefile)
+        self.entries = entries
+        self.updates = {}
+
+def relative_tmpdir_link(link, outputpath, tmpdir):
+    """
+    Return link with an absolute target inside tmpdir rewritten relative to
+    outputpath, the location the symlink is installed at.
+    """
+    if not os.path.isabs(link) or not link.startswith(tmpdir):
+        return link
+
+    depth = outputpath.rpartition(tmpdir)[2].count('/')
+    base = link.partition(tmpdir)[2].strip()
+    while depth > 1:
+        base = "/.." + base
+        depth -= 1
+    return "." + base
+
+def _add_member(tar, path, arcname, destpath, tmpdir, fixmefiles, replacements):
+    import io
+
+    tarinfo = tar.gettarinfo(path, arcname)
+    if tarinfo is None:
+        # Sockets and the like can't be archived
+        return
+    if tarinfo.issym() and destpath and tmpdir:
+        tarinfo.linkname = relative_tmpdir_link(tarinfo.linkname, destpath, tmpdir)
+    if not tarinfo.isreg():
+        tar.addfile(tarinfo)
+    elif arcname in fixmefiles:
+        with open(path, "rb") as f:
+            data = f.read()
+        for old, new in replacements:
+            data = data.replace(old, new)
+        tarinfo.size = len(data)
+        tar.addfile(tarinfo, io.BytesIO(data))
+    else:
+        with open(path, "rb") as f:
+            tar.addfile(tarinfo, f)
+
+def create_archive(fileobj, members, tmpdir=None, fixmefiles=(), replacements=()):
+    """
+    Write an uncompressed tar stream to fileobj straight from the trees in
+    members, a list of (path, arcname, destpath) tuples. Absolute symlinks
+    into tmpdir are made relative to their installed location under destpath
+    (when set) and the files whose archive names are in fixmefiles get each
+    (old, new) pair in replacements substituted, without touching the trees
+    themselves.
+    """
+    fixmefiles = set(fixmefiles)
+    tar = tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.GNU_FORMAT)
+    try:
+        for path, arcname, destpath in members:
+            _add_member(tar, path, arcname, destpath, tmpdir, fixmefiles, replacements)
+            if os.path.islink(path) or not os.path.isdir(path):
+                continue
+            for walkroot, dirs, files in os.walk(path):
+                dirs.sort()
+                relroot = os.path.relpath(walkroot, path)
+                for name in dirs + sorted(files):
+                    rel = os.path.normpath(os.path.join(relroot, name))
+                    _add_member(tar, os.path.join(walkroot, name),
+                                os.path.join(arcname, rel),
+                                destpath and os.path.join(destpath, rel),
+                                tmpdir, fixmefiles, replacements)
+    finally:
+        tar.close()
+
+def extract_archive(fileobj, destdir):
+    """
+    Unpack the tar stream read from fileobj into destdir, in a single pass.
+    """
+    tar = tarfile.open(fileobj=fileobj, mode="r|")
+    try:
+        tar.extractall(destdir)
+    finally:
+        tar.close()
+
+class ManifestIndex(object):
+    """
+    Index of the files installed into the shared areas, mapping each path
+    to the manifest which installed it, so file conflicts and their owners
+    can be found without searching every manifest. The index is an SQLite
+    database kept alongside the manifests; when first created it is
+    populated from the manifests already present. It is shared between
+    concurrently running tasks so callers should hold a lock on it.
+    """
+    def __init__(self, dbfile, manifestdir):
+        import sqlite3
+
+        self.conn = sqlite3.connect(dbfile, timeout=60)
+        self.conn.text_factory = str
+        c = self.conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, manifest TEXT)")
+        c.execute("CREATE INDEX IF NOT EXISTS files_manifest ON files (manifest)")
+        c.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
+        c.execute("SELECT value FROM config WHERE key = 'populated'")
+        if not c.fetchone():
+            self._populate(manifestdir)
+            c.execute("INSERT INTO config VALUES ('populated', '1')")
+        self.conn.commit()
+
+    def _populate(self, manifestdir):
+        if not os.path.isdir(manifestdir):
+            return
+        for fn in os.listdir(manifestdir):
+            if not fn.startswith("manifest-"):
+                continue
+            manifest = os.path.join(manifestdir, fn)
+            with open(manifest, "r") as f:
+                self._add(manifest, f.read().split("\n"))
+
+    def _add(self, manifest, paths):
+        self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?)",
+                              ((os.path.normpath(p), manifest) for p in paths if p and not p.endswith("/")))
+
+    def add(self, manifest, paths):
+        """Record paths (directories, ending in '/', are skipped) as installed by manifest"""
+        self._add(manifest, paths)
+        self.conn.commit()
+
+    def remove(self, manifest):
+        """Forget all the files installed by manifest"""
+        self.conn.execute("DELETE FROM files WHERE manifest = ?", (manifest,))
+        self.conn.commit()
+
+    def owners(self, paths):
+        """Return a dict mapping those of paths which are installed to their manifest"""
+        paths = [os.path.normpath(p) for p in paths]
+        owners = {}
+        chunk = 500
+        for i in range(0, len(paths), chunk):
+            batch = paths[i:i + chunk]
+            query = "SELECT path, manifest FROM files WHERE path IN (%s)" % ",".join("?" * len(batch))
+            for path, manifest in self.conn.execute(query, batch):
+                owners[path] = manifest
+        return owners
+
+    def close(self):
+        self.conn.close()
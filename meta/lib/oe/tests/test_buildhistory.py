@@ -0,0 +1,186 @@
+import unittest
+import os
+import shutil
+import tempfile
+import oe.buildhistory
+
+class TestInstalled(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_buildhistory")
+        self.pkgs = {
+            "busybox": {"filename": "/deploy/ipk/busybox_1.24.1-r0_i586.ipk", "arch": "i586",
+                        "deps": ["libc6", "update-alternatives-opkg [REC]"]},
+            "libc6": {"filename": "/deploy/ipk/libc6_2.23-r0_i586.ipk", "arch": "i586", "deps": []},
+            "kernel-module-foo": {"filename": "/deploy/ipk/kernel-module-foo_4.4-r0_qemux86.ipk",
+                                  "arch": "qemux86", "deps": ["kernel-3.14.3"]},
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, fn):
+        with open(os.path.join(self.tmpdir, fn)) as f:
+            return f.read()
+
+    def test_write_installed(self):
+        oe.buildhistory.write_installed(self.tmpdir, self.pkgs, {"busybox": 524800, "libc6": 1024000, "bash": 1})
+        self.assertEqual(self.read("installed-package-names.txt"), "busybox\nkernel-module-foo\nlibc6\n")
+        self.assertEqual(self.read("installed-packages.txt").split()[0], "busybox_1.24.1-r0_i586.ipk")
+        self.assertEqual(self.read("installed-package-sizes.txt"), "1000\tKiB libc6\n513\tKiB busybox\n")
+        self.assertEqual(self.read("depends.dot"),
+                         'digraph depends {\n    node [shape=plaintext]\n'
+                         '"busybox" -> "libc6";\n'
+                         '"busybox" -> "update-alternatives-opkg" [style=dotted];\n'
+                         '"kernel-module-foo" -> "kernel-3.14.3";\n}\n')
+        self.assertNotIn("kernel-3.14.3", self.read("depends-nokernel.dot"))
+        self.assertNotIn("libc6", self.read("depends-nokernel-nolibc.dot"))
+        self.assertEqual(self.read("depends-nokernel-nolibc-noupdate-nomodules.dot"),
+                         'digraph depends {\n    node [shape=plaintext]\n}\n')
+
+    def test_empty(self):
+        oe.buildhistory.write_installed(self.tmpdir, {}, {}, variants=False)
+        self.assertEqual(self.read("installed-packages.txt"), "")
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "depends-nokernel.dot")))
+
+class TestCommit(unittest.TestCase):
+    def setUp(self):
+        import subprocess
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_buildhistory")
+        self.repo = os.path.join(self.tmpdir, "buildhistory")
+        self.journal = os.path.join(self.repo, ".changes")
+        self.write("packages/i586/foo/latest", "PV = 1\n")
+        self.write("packages/i586/bar/latest", "PV = 1\n")
+        self.write("images/qemux86/core-image/files-in-image.txt", "a\n")
+        self.write("metadata-revs", "meta = master:1234\n")
+        subprocess.check_call(["git", "init", "-q", self.repo])
+        self.git("config", "user.name", "test")
+        self.git("config", "user.email", "test@example.com")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.repo, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def git(self, *args):
+        import subprocess
+        return subprocess.check_output(["git"] + list(args), cwd=self.repo)
+
+    def commit(self):
+        return oe.buildhistory.commit_changes(self.repo, self.journal, lambda item: "%s: Build\n\ncmd: test\n" % item,
+                                              "buildhistory <buildhistory@test>")
+
+    def test_commit(self):
+        # With no history everything is committed, one commit per top level directory
+        self.assertEqual(self.commit(), 2)
+        self.assertEqual(self.git("log", "--format=%s").split("\n")[:2], ["packages: Build", "images: Build"])
+        self.assertEqual(self.git("show", "--format=", "--name-only", "HEAD~1").split(),
+                         ["images/qemux86/core-image/files-in-image.txt", "metadata-revs"])
+        self.assertEqual(self.git("log", "-1", "--format=%an").strip(), "buildhistory")
+        self.assertEqual(self.git("status", "--porcelain"), "")
+
+        # Only journalled paths are looked at
+        self.write("packages/i586/foo/latest", "PV = 2\n")
+        self.write("packages/i586/bar/latest", "PV = 2\n")
+        shutil.rmtree(os.path.join(self.repo, "images"))
+        oe.buildhistory.record_change(self.journal, os.path.join(self.repo, "packages/i586/foo"))
+        oe.buildhistory.record_change(self.journal, os.path.join(self.repo, "images/qemux86"))
+        self.assertEqual(self.commit(), 2)
+        self.assertEqual(self.git("show", "--format=", "--name-status", "HEAD~1").split(),
+                         ["D", "images/qemux86/core-image/files-in-image.txt"])
+        self.assertEqual(self.git("show", "HEAD:packages/i586/foo/latest"), "PV = 2\n")
+        self.assertEqual(self.git("show", "HEAD:packages/i586/bar/latest"), "PV = 1\n")
+        self.assertEqual(self.git("status", "--porcelain"), " M packages/i586/bar/latest\n")
+
+        # Nothing journalled gives an empty commit
+        self.write("metadata-revs", "meta = master:5678\n")
+        self.assertEqual(self.commit(), 1)
+        self.assertEqual(self.git("show", "--format=%s", "--name-only", "HEAD").split(), ["No", "changes:", "Build", "metadata-revs"])
+
+class TestAnalysis(unittest.TestCase):
+    def setUp(self):
+        try:
+            import oe.buildhistory_analysis
+        except ImportError:
+            self.skipTest("Cannot import GitPython or bb")
+        self.analysis = oe.buildhistory_analysis
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_buildhistory")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def blob(self, content):
+        import StringIO
+        class Blob(object):
+            data_stream = StringIO.StringIO(content)
+        return Blob()
+
+    def test_blob_lines(self):
+        content = "PV = 1\nPR = r0\nRDEPENDS = libc6\n"
+        for blocksize in (1, 3, 7, 8, 65536):
+            self.assertEqual(list(self.analysis.blob_lines(self.blob(content), blocksize)),
+                             ["PV = 1", "PR = r0", "RDEPENDS = libc6"])
+            # The last line has no newline, split across blocks
+            self.assertEqual(list(self.analysis.blob_lines(self.blob(content + "PKGSIZE = 10"), blocksize)),
+                             ["PV = 1", "PR = r0", "RDEPENDS = libc6", "PKGSIZE = 10"])
+        self.assertEqual(list(self.analysis.blob_lines(self.blob("a\n\nb"), 2)), ["a", "", "b"])
+        self.assertEqual(list(self.analysis.blob_lines(self.blob(""))), [])
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def commit(self):
+        import subprocess
+        subprocess.check_call(["git", "add", "-A"], cwd=self.tmpdir)
+        subprocess.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.com",
+                               "commit", "-q", "-m", "Build"], cwd=self.tmpdir)
+
+    def test_related(self):
+        import subprocess
+        subprocess.check_call(["git", "init", "-q", self.tmpdir])
+        self.write("packages/i586/foo/latest", "PV = 1\nDEPENDS = zlib\n")
+        self.write("packages/i586/foo/foo/latest", "PV = 1\nRDEPENDS = libz1\nPKGSIZE = 100\nFILELIST = /usr/bin/foo\n")
+        self.write("packages/i586/bar/latest", "PV = 1\nDEPENDS = zlib\n")
+        self.write("packages/i586/bar/bar/latest", "PV = 1\nRDEPENDS = libz1\n")
+        self.commit()
+        self.write("packages/i586/foo/latest", "PV = 2\nDEPENDS = zlib bzip2\n")
+        self.write("packages/i586/foo/foo/latest", "PV = 2\nRDEPENDS = libz1 libbz2\nPKGSIZE = 200\nFILELIST = /usr/bin/foo /usr/bin/bar\n")
+        self.write("packages/i586/bar/bar/latest", "PV = 1\nRDEPENDS = libz1 libbz2\n")
+        self.commit()
+
+        changes = self.analysis.process_changes(self.tmpdir, "HEAD~1")
+        related = dict(((chg.path, chg.fieldname), sorted((r.path, r.fieldname) for r in chg.related))
+                       for chg in changes)
+        # The DEPENDS of the recipe is found in the dirname of the package
+        self.assertEqual(related[("packages/i586/foo/foo", "RDEPENDS")],
+                         [("packages/i586/foo", "DEPENDS"), ("packages/i586/foo/foo", "PV")])
+        self.assertEqual(related[("packages/i586/foo/foo", "PKGSIZE")],
+                         [("packages/i586/foo/foo", "FILELIST"), ("packages/i586/foo/foo", "PV")])
+        # but not in another recipe
+        self.assertEqual(related[("packages/i586/bar/bar", "RDEPENDS")], [])
+        # Unmonitored fields are only reported as related changes
+        self.assertNotIn(("packages/i586/foo", "DEPENDS"), related)
+
+    def test_to_dict(self):
+        import json
+        chg = self.analysis.ChangeRecord("images/qemux86/core-image", "files-in-image.txt", None, None, "yes")
+        chg.filechanges = [self.analysis.FileChange("/usr/bin/foo", self.analysis.FileChange.changetype_add)]
+        chg.related.append(self.analysis.ChangeRecord("images/qemux86/core-image", "IMAGE_INSTALL", "foo", "foo bar", False))
+        expected = {"path": "images/qemux86/core-image",
+                    "field": "files-in-image.txt",
+                    "oldvalue": None,
+                    "newvalue": None,
+                    "monitored": True,
+                    "filechanges": [{"path": "/usr/bin/foo", "changetype": "A", "oldvalue": None, "newvalue": None}],
+                    "related": [{"path": "images/qemux86/core-image", "field": "IMAGE_INSTALL",
+                                 "oldvalue": "foo", "newvalue": "foo bar", "monitored": False}]}
+        self.assertEqual(chg.to_dict(), expected)
+        self.assertEqual(json.loads(json.dumps(chg.to_dict())), expected)
@@ -0,0 +1,64 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import oe.cachedpath
+
+class TestCachedPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_cachedpath")
+        os.makedirs(os.path.join(self.tmpdir, "pkg", "usr", "bin"))
+        with open(os.path.join(self.tmpdir, "pkg", "usr", "bin", "foo"), "w") as f:
+            f.write("foo")
+        os.symlink("bin", os.path.join(self.tmpdir, "pkg", "usr", "sbin"))
+        # Listings of directories changed within the last second aren't kept
+        past = time.time() - 10
+        for dirpath, dirs, files in os.walk(self.tmpdir):
+            os.utime(dirpath, (past, past))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def walk(self, cpath):
+        return sorted((os.path.relpath(root, self.tmpdir), sorted(dirs), sorted(files))
+                      for root, dirs, files in cpath.walk(os.path.join(self.tmpdir, "pkg")))
+
+    def test_walk(self):
+        cpath = oe.cachedpath.CachedPath()
+        self.assertEqual(self.walk(cpath), [("pkg", ["usr"], []),
+                                            ("pkg/usr", ["bin", "sbin"], []),
+                                            ("pkg/usr/bin", [], ["foo"])])
+        sbin = os.path.join(self.tmpdir, "pkg", "usr", "sbin")
+        self.assertTrue(cpath.islink(sbin))
+        self.assertTrue(cpath.isdir(sbin))
+
+        # A new file changes the mtime of its directory, which is listed again
+        with open(os.path.join(self.tmpdir, "pkg", "usr", "bin", "bar"), "w") as f:
+            f.write("bar")
+        self.assertEqual(self.walk(cpath)[-1], ("pkg/usr/bin", [], ["bar", "foo"]))
+
+    def test_seed(self):
+        cache = os.path.join(self.tmpdir, "cache")
+        cpath = oe.cachedpath.CachedPath()
+        expected = self.walk(cpath)
+        cpath.save(cache, [os.path.join(self.tmpdir, "pkg")])
+
+        os.remove(os.path.join(self.tmpdir, "pkg", "usr", "bin", "foo"))
+        cpath = oe.cachedpath.CachedPath()
+        self.assertEqual(cpath.seed(cache), 2)
+        self.assertEqual(self.walk(cpath), expected[:2] + [("pkg/usr/bin", [], [])])
+
+        self.assertEqual(oe.cachedpath.CachedPath().seed(os.path.join(self.tmpdir, "missing")), 0)
+
+    def test_save_recent(self):
+        cache = os.path.join(self.tmpdir, "cache")
+        os.mkdir(os.path.join(self.tmpdir, "pkg", "etc"))
+        cpath = oe.cachedpath.CachedPath()
+        expected = self.walk(cpath)
+        # pkg and pkg/etc were just changed, but are saved all the same
+        cpath.save(cache, [os.path.join(self.tmpdir, "pkg")])
+
+        cpath = oe.cachedpath.CachedPath()
+        self.assertEqual(cpath.seed(cache), 4)
+        self.assertEqual(self.walk(cpath), expected)
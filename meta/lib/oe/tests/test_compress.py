@@ -0,0 +1,102 @@
+import unittest
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import oe.compress
+
+class TestParallelGzip(unittest.TestCase):
+    def compress(self, chunks, **kwargs):
+        out = io.BytesIO()
+        with oe.compress.compress_writer("gzip", out, **kwargs) as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return out.getvalue()
+
+    def decompress(self, data):
+        return oe.compress.decompress_reader("gzip", io.BytesIO(data)).read()
+
+    def test_roundtrip(self):
+        chunks = [(b"%d" % i) * 1000 for i in range(300)]
+        for threads in (1, 4):
+            data = self.compress(chunks, threads=threads)
+            self.assertEqual(self.decompress(data), b"".join(chunks))
+
+    def test_blocks(self):
+        out = io.BytesIO()
+        f = oe.compress.ParallelGzipFile(out, threads=2, blocksize=16)
+        f.write(b"x" * 40)
+        f.close()
+        self.assertEqual(f.members, 3)
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(out.getvalue())).read(), b"x" * 40)
+
+    def test_empty(self):
+        self.assertEqual(self.decompress(self.compress([])), b"")
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, oe.compress.compress_writer, "nonexistent", io.BytesIO())
+
+class TestCompressors(unittest.TestCase):
+    def roundtrip(self, name, **kwargs):
+        chunks = [(b"%d" % i) * 1000 for i in range(3000)]
+        with tempfile.TemporaryFile() as f:
+            hashing = oe.compress.HashingFile(f, ["sha256"])
+            with oe.compress.compress_writer(name, hashing, **kwargs) as writer:
+                for chunk in chunks:
+                    writer.write(chunk)
+            f.seek(0)
+            compressed = f.read()
+            self.assertEqual(hashing.hashes[0].hexdigest(), hashlib.sha256(compressed).hexdigest())
+            f.seek(0)
+            self.assertEqual(oe.compress.decompress_reader(name, f).read(), b"".join(chunks))
+
+    def test_bzip2(self):
+        self.roundtrip("bzip2", threads=4, level=1)
+
+    def test_bzip2_reader(self):
+        import bz2
+        data = bz2.compress(b"a" * 10) + bz2.compress(b"b" * 10)
+        reader = oe.compress.decompress_reader("bzip2", io.BytesIO(data))
+        self.assertEqual(reader.read(5), b"aaaaa")
+        self.assertEqual(reader.read(), b"aaaaa" + b"b" * 10)
+
+    def test_xz(self):
+        self.roundtrip("xz", threads=2)
+
+    def test_detect(self):
+        for name in ("gzip", "bzip2", "xz"):
+            f = io.BytesIO()
+            with oe.compress.compress_writer(name, f) as writer:
+                writer.write(b"data")
+            f.seek(0)
+            self.assertEqual(oe.compress.detect_compressor(f), name)
+            self.assertEqual(f.tell(), 0)
+        self.assertEqual(oe.compress.detect_compressor(io.BytesIO(b"plain")), None)
+
+class TestFanout(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_compress")
+        self.image = os.path.join(self.tmpdir, "test.rootfs.ext4")
+        self.data = b"".join((b"%d" % i) * 100 for i in range(10000))
+        with open(self.image, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_fanout(self):
+        outputs = [(self.image + ".gz", "gzip -c"), (self.image + ".copy", "cat")]
+        oe.compress.fanout(self.image, outputs, ["md5"], hashsource=True, blocksize=4096)
+        self.assertEqual(gzip.GzipFile(self.image + ".gz").read(), self.data)
+        with open(self.image + ".copy", "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        with open(self.image + ".copy.md5sum") as f:
+            self.assertEqual(f.read(), "%s  test.rootfs.ext4.copy\n" % hashlib.md5(self.data).hexdigest())
+        self.assertTrue(os.path.exists(self.image + ".md5sum"))
+        self.assertTrue(os.path.exists(self.image + ".gz.md5sum"))
+
+    def test_failure(self):
+        outputs = [(self.image + ".gz", "gzip -c"), (self.image + ".bad", "exit 1")]
+        self.assertRaises(RuntimeError, oe.compress.fanout, self.image, outputs, blocksize=4096)
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+import oe.qa
+import oe.package
+
+def make_elf(path, etype, sections):
+    # Write a minimal little endian ELF64 file with the given
+    # (name, sh_type) sections plus the null and .shstrtab sections
+    names = [name for (name, shtype) in sections] + [".shstrtab"]
+    strtab = "\0"
+    offsets = []
+    for name in names:
+        offsets.append(len(strtab))
+        strtab += name + "\0"
+    shoff = 64 + len(strtab)
+    header = "\x7fELF" + struct.pack("<BBBBB7x", 2, 1, 1, 0, 0)
+    header += struct.pack("<HHIQQQIHHHHHH", etype, 62, 1, 0, 0, shoff, 0, 64, 0, 0, 64, len(names) + 1, len(names))
+    shdrs = struct.pack("<IIQQQQIIQQ", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    for i, (name, shtype) in enumerate(sections + [(".shstrtab", 3)]):
+        offset, size = (64, len(strtab)) if name == ".shstrtab" else (0, 0)
+        shdrs += struct.pack("<IIQQQQIIQQ", offsets[i], shtype, 0, 0, offset, size, 0, 0, 1, 0)
+    with open(path, "wb") as f:
+        f.write(header + strtab + shdrs)
+
+class TestELFClassification(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_elf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def classify(self, etype, sections):
+        path = os.path.join(self.tmpdir, "file")
+        make_elf(path, etype, sections)
+        return oe.package.is_elf(path)[1]
+
+    def test_sections(self):
+        path = os.path.join(self.tmpdir, "file")
+        make_elf(path, oe.qa.ELFFile.ET_DYN, [(".text", 1), (".symtab", 2)])
+        elf = oe.qa.ELFFile(path)
+        elf.open()
+        self.assertEqual([s[0] for s in elf.readSections()], ["", ".text", ".symtab", ".shstrtab"])
+        self.assertFalse(elf.isStripped())
+        elf.close()
+
+    def test_types(self):
+        self.assertEqual(self.classify(oe.qa.ELFFile.ET_EXEC, [(".text", 1), (".symtab", 2)]), 1 | 4)
+        self.assertEqual(self.classify(oe.qa.ELFFile.ET_EXEC, [(".text", 1)]), 1 | 2 | 4)
+        self.assertEqual(self.classify(oe.qa.ELFFile.ET_DYN, [(".symtab", 2)]), 1 | 8)
+        self.assertEqual(self.classify(oe.qa.ELFFile.ET_REL, [(".modinfo", 1), (".symtab", 2)]), 1 | 16)
+
+    def test_not_elf(self):
+        path = os.path.join(self.tmpdir, "script")
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\necho hello world\n")
+        self.assertEqual(oe.package.is_elf(path), (path, 0))
+
+def make_dynamic_elf(path, entries, strtab):
+    # Write a minimal little endian ELF64 file with a PT_LOAD segment
+    # covering the whole file and a PT_DYNAMIC segment holding entries
+    # followed by the string table strtab
+    phoff = 64
+    dynoff = phoff + 2 * 56
+    stroff = dynoff + (len(entries) + 3) * 16
+    size = stroff + len(strtab)
+    dynamic = [(oe.qa.ELFFile.DT_STRTAB, stroff), (oe.qa.ELFFile.DT_STRSZ, len(strtab))] + entries + [(0, 0)]
+    header = "\x7fELF" + struct.pack("<BBBBB7x", 2, 1, 1, 0, 0)
+    header += struct.pack("<HHIQQQIHHHHHH", oe.qa.ELFFile.ET_DYN, 62, 1, 0, phoff, 0, 0, 64, 56, 2, 64, 0, 0)
+    phdrs = struct.pack("<IIQQQQQQ", oe.qa.ELFFile.PT_LOAD, 5, 0, 0, 0, size, size, 4096)
+    phdrs += struct.pack("<IIQQQQQQ", oe.qa.ELFFile.PT_DYNAMIC, 6, dynoff, dynoff, dynoff, stroff - dynoff, stroff - dynoff, 8)
+    with open(path, "wb") as f:
+        f.write(header + phdrs + "".join(struct.pack("<qQ", tag, val) for (tag, val) in dynamic) + strtab)
+
+class TestELFDynamic(unittest.TestCase):
+    def test_bad_string_offset(self):
+        tmpdir = tempfile.mkdtemp(prefix="oe-test_elf")
+        try:
+            path = os.path.join(tmpdir, "lib.so")
+            make_dynamic_elf(path, [(oe.qa.ELFFile.DT_NEEDED, 1), (oe.qa.ELFFile.DT_NEEDED, 1000),
+                                    (oe.qa.ELFFile.DT_TEXTREL, 0)], "\0libc.so.6\0")
+            elf = oe.qa.ELFFile(path)
+            elf.open()
+            with open(path, "rb") as f:
+                entries = elf._readDynamic(f.read())
+            elf.close()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertIn((oe.qa.ELFFile.DT_NEEDED, "libc.so.6"), entries)
+        self.assertIn((oe.qa.ELFFile.DT_TEXTREL, 0), entries)
+        self.assertEqual(len([tag for (tag, val) in entries if tag == oe.qa.ELFFile.DT_NEEDED]), 1)
+        self.assertEqual(len(elf.dynamic_errors), 1)
+
+    def test_system_binary(self):
+        # Any dynamically linked host binary will do
+        for path in ("/bin/sh", "/bin/ls", "/usr/bin/env"):
+            if os.path.exists(path):
+                break
+        else:
+            self.skipTest("No host binary found")
+        elf = oe.qa.ELFFile(os.path.realpath(path))
+        elf.open()
+        needed = elf.dynamicValues(elf.DT_NEEDED)
+        elf.close()
+        self.assertTrue(any(lib.startswith("libc.so") for lib in needed))
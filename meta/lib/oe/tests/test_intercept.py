@@ -0,0 +1,70 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import oe.intercept
+
+class TestIntercept(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_intercept")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def intercept(self, name, *lines):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n" + "".join(line + "\n" for line in lines))
+        return oe.intercept.Intercept(path)
+
+    def test_parse(self):
+        i = self.intercept("update_pixbuf_cache", "libdir=/usr/lib64", "set -e",
+                           "##WRITES: ${libdir}/gdk-pixbuf-2.0/", "##READS: /etc $unknown",
+                           "##AFTER: update_font_cache", "##PKGS: foo bar ")
+        self.assertEqual(i.writes, ["/usr/lib64/gdk-pixbuf-2.0"])
+        self.assertEqual(i.reads, ["/etc", "/"])
+        self.assertEqual(i.after, ["update_font_cache"])
+        self.assertEqual(i.pkgs, "foo bar")
+
+    def test_schedule(self):
+        icons = self.intercept("update_icon_cache", "##WRITES: /usr/share/icons")
+        icons_ml = self.intercept("update_icon_cache-lib32", "##WRITES: /usr/share/icons/hicolor")
+        fonts = self.intercept("update_font_cache", "##WRITES: /var/cache/fontconfig")
+        pixbuf = self.intercept("update_pixbuf_cache", "##READS: /usr/share/icons", "##AFTER: update_font_cache")
+        other = self.intercept("other")
+        order = oe.intercept.schedule([other, pixbuf, icons_ml, icons, fonts])
+        self.assertEqual([(i.name, sorted(waits)) for i, waits in order],
+                         [("other", []),
+                          ("update_font_cache", ["other"]),
+                          ("update_icon_cache", ["other"]),
+                          ("update_icon_cache-lib32", ["other", "update_icon_cache"]),
+                          ("update_pixbuf_cache", ["other", "update_font_cache", "update_icon_cache", "update_icon_cache-lib32"])])
+
+        a = self.intercept("a", "##WRITES: /a", "##AFTER: b")
+        b = self.intercept("b", "##WRITES: /b", "##AFTER: a")
+        self.assertRaises(oe.intercept.InterceptError, oe.intercept.schedule, [a, b])
+
+    def test_run(self):
+        intercepts = [self.intercept("i%d" % n, "##WRITES: /dir%d" % n) for n in range(4)]
+        intercepts.append(self.intercept("last", "##AFTER: i"))
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0, "done": []}
+        barrier = threading.Event()
+
+        def execute(intercept):
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+                if state["running"] == 2:
+                    barrier.set()
+            barrier.wait(5)
+            with lock:
+                state["running"] -= 1
+                state["done"].append(intercept.name)
+            return intercept.name.upper()
+
+        results = oe.intercept.run(intercepts, execute, 2)
+        self.assertEqual([r for i, r in results], ["I0", "I1", "I2", "I3", "LAST"])
+        self.assertEqual(state["peak"], 2)
+        self.assertEqual(state["done"][-1], "last")
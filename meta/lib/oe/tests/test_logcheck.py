@@ -0,0 +1,62 @@
+import unittest
+import os
+import shutil
+import tempfile
+import oe.logcheck
+
+LOG = """NOTE: Executing install
+WARNING: something odd
+NOTE: warning inside a note
+warn: log_check mentions are ignored
+Collecting packages
+E: Unmet dependencies.
+E: Unable to locate package foo
+line 1
+line 2
+log_check: not counted
+line 3
+line 4
+line 5
+E: after the first failure
+"""
+
+class TestLogChecker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_logcheck")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def checker(self, **kwargs):
+        return oe.logcheck.LogChecker("^E:", ["^E: Unmet dependencies."], **kwargs)
+
+    def test_file(self):
+        path = os.path.join(self.tmpdir, "log.do_rootfs")
+        with open(path, "w") as f:
+            f.write(LOG)
+        checker = self.checker()
+        with self.assertRaises(oe.logcheck.LogCheckError) as cm:
+            checker.check_file(path)
+        self.assertEqual(str(cm.exception), "\nE: Unable to locate package foo\nline 1\nline 2\nline 3\nline 4")
+        self.assertEqual(checker.warnings, [("WARNING:", "WARNING: something odd")])
+        self.assertEqual(checker.errors, [("E:", "E: Unable to locate package foo")])
+
+    def test_feed(self):
+        checker = self.checker(warn_regex=None)
+        checker.feed("Collecting packages\nE: Unmet dependencies.\nE: Unable to")
+        self.assertEqual(checker.errors, [])
+        checker.feed(" locate package foo\nline 1\nline 2\n")
+        self.assertEqual(len(checker.errors), 1)
+        self.assertRaises(oe.logcheck.LogCheckError, checker.feed, "line 3\nline 4\n")
+        self.assertEqual(checker.warnings, [])
+
+    def test_finish(self):
+        checker = self.checker()
+        checker.feed("fine\nE: broken\nline 1")
+        # The error is reported when the output ends, even without context
+        self.assertRaises(oe.logcheck.LogCheckError, checker.finish)
+
+        checker = self.checker()
+        checker.feed("fine\nWARNING: last line")
+        checker.finish()
+        self.assertEqual(checker.warnings, [("WARNING:", "WARNING: last line")])
@@ -0,0 +1,53 @@
+import unittest
+import os
+import re
+import shutil
+import tempfile
+import oe.multilib_check
+
+class TestMultilibCheck(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_multilib_check")
+        self.dirs = [os.path.join(self.tmpdir, d) for d in ("rootfs", "lib32", "lib64")]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, root, path, content):
+        path = os.path.join(root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_conflicts(self):
+        rootfs, lib32, lib64 = self.dirs
+        for root in self.dirs:
+            self.write(root, "usr/share/same", "same")
+            self.write(root, "etc/allowed", root)
+        self.write(rootfs, "usr/share/size", "a")
+        self.write(lib64, "usr/share/size", "ab")
+        self.write(lib32, "usr/share/content", "ab")
+        self.write(lib64, "usr/share/content", "ac")
+        os.makedirs(os.path.join(lib32, "usr/lib"))
+        os.symlink("missing", os.path.join(lib32, "usr/lib/broken"))
+        self.write(lib64, "usr/lib/broken", "x")
+
+        for threads in (1, 4):
+            conflicts = oe.multilib_check.find_conflicts(self.dirs, re.compile("/etc"), threads=threads)
+            self.assertEqual(conflicts, [("/usr/share/content", os.path.join(lib32, "usr/share/content"), os.path.join(lib64, "usr/share/content")),
+                                         ("/usr/share/size", os.path.join(rootfs, "usr/share/size"), os.path.join(lib64, "usr/share/size"))])
+
+    def test_normalise(self):
+        rootfs, lib32, lib64 = self.dirs
+        self.write(rootfs, "usr/bin/prog", "prelinked")
+        self.write(lib32, "usr/bin/prog", "original")
+        self.write(lib64, "usr/bin/other", "x")
+        normalised = []
+
+        def normalise(root):
+            normalised.append(root)
+            self.write(root, "usr/bin/prog", "prelinked")
+
+        self.assertEqual(oe.multilib_check.find_conflicts(self.dirs, normalise=normalise), [])
+        self.assertEqual(normalised, [lib32])
@@ -0,0 +1,101 @@
+import unittest
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import oe.package_index
+
+def make_package(path, control):
+    # Write an ar format package holding a control.tar.gz
+    data = io.BytesIO()
+    tar = tarfile.open(fileobj=data, mode="w:gz")
+    info = tarfile.TarInfo("./control")
+    info.size = len(control)
+    tar.addfile(info, io.BytesIO(control))
+    tar.close()
+    members = [("debian-binary", "2.0\n"), ("control.tar.gz", data.getvalue()), ("data.tar.gz", "")]
+    with open(path, "wb") as f:
+        f.write("!<arch>\n")
+        for name, content in members:
+            f.write("%-16s%-12d%-6d%-6d%-8s%-10d`\n" % (name, 0, 0, 0, "100644", len(content)))
+            f.write(content)
+            if len(content) % 2:
+                f.write("\n")
+
+class TestVersionCompare(unittest.TestCase):
+    def test_compare(self):
+        vc = oe.package_index.version_compare
+        self.assertEqual(vc("1.0-r0", "1.0-r0"), 0)
+        self.assertTrue(vc("1.10-r0", "1.9-r0") > 0)
+        self.assertTrue(vc("1.0-r1", "1.0-r0") > 0)
+        self.assertTrue(vc("1:0.1-r0", "2.0-r0") > 0)
+        self.assertTrue(vc("1.0~rc1-r0", "1.0-r0") < 0)
+        self.assertTrue(vc("1.0a-r0", "1.0-r0") > 0)
+        self.assertTrue(vc("1.0+git1-r0", "1.0a-r0") > 0)
+
+class TestFeedIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_package_index")
+        self.stampsdir = tempfile.mkdtemp(prefix="oe-test_package_index-stamps")
+        self.control = "Package: %s\nVersion: %s\nArchitecture: core2\nDescription: test\n more text\n"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        shutil.rmtree(self.stampsdir)
+
+    def add(self, name, version):
+        fn = "%s_%s_core2.ipk" % (name, version)
+        make_package(os.path.join(self.tmpdir, fn), self.control % (name, version))
+        return fn
+
+    def read(self, fn):
+        with open(os.path.join(self.tmpdir, fn)) as f:
+            return f.read()
+
+    def test_ipk(self):
+        self.add("foo", "1.0-r0")
+        self.add("bar", "2.0-r0")
+        index = oe.package_index.FeedIndex(self.tmpdir, "ipk", self.stampsdir)
+        self.assertEqual(index.update(), 2)
+        packages = self.read("Packages")
+        self.assertIn("Package: bar\nVersion: 2.0-r0\nArchitecture: core2\nFilename: bar_2.0-r0_core2.ipk\n", packages)
+        self.assertIn("MD5Sum: ", packages)
+        self.assertIn("Description: test\n more text\n", packages)
+
+        # Nothing changed, nothing is read and the output is the same
+        index = oe.package_index.FeedIndex(self.tmpdir, "ipk", self.stampsdir)
+        self.assertEqual(index.update(), 0)
+        self.assertEqual(self.read("Packages"), packages)
+
+        # Only the newest version of a package is indexed
+        newfn = self.add("foo", "1.0-r1")
+        index = oe.package_index.FeedIndex(self.tmpdir, "ipk", self.stampsdir)
+        self.assertEqual(index.update(), 1)
+        packages = self.read("Packages")
+        self.assertIn("Version: 1.0-r1", packages)
+        self.assertNotIn("Version: 1.0-r0", packages)
+
+        # Removing it brings the old version back
+        os.remove(os.path.join(self.tmpdir, newfn))
+        index = oe.package_index.FeedIndex(self.tmpdir, "ipk", self.stampsdir)
+        self.assertEqual(index.update(), 1)
+        self.assertIn("Version: 1.0-r0", self.read("Packages"))
+        # The stamps aren't published with the feed
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "Packages.stamps")))
+        with open(oe.package_index.stamps_file(self.stampsdir, self.tmpdir, "Packages.stamps")) as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+
+    def test_deb(self):
+        make_package(os.path.join(self.tmpdir, "foo_1.0-r0_core2.deb"), self.control % ("foo", "1.0-r0"))
+        make_package(os.path.join(self.tmpdir, "foo_1.1-r0_core2.deb"), self.control % ("foo", "1.1-r0"))
+        index = oe.package_index.FeedIndex(self.tmpdir, "deb", self.stampsdir)
+        self.assertEqual(index.update(), 2)
+        index.write_release("core2")
+        packages = self.read("Packages")
+        self.assertIn("Filename: ./foo_1.0-r0_core2.deb\n", packages)
+        self.assertIn("Filename: ./foo_1.1-r0_core2.deb\n", packages)
+        self.assertIn("SHA256: ", packages)
+        release = self.read("Release")
+        self.assertTrue(release.startswith("Label: core2\nDate: "))
+        self.assertIn(" Packages.gz\n", release)
@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import tempfile
+import oe.packagedata
+
+class TestPkgdataIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_packagedata")
+        os.makedirs(os.path.join(self.tmpdir, "runtime"))
+        self.write("zlib", "PACKAGES: zlib-dbg zlib-dev zlib\n")
+        self.write("runtime/zlib", 'PN: zlib\nPKG_zlib: libz1\nFILES_INFO: {"/usr/lib/libz.so.1": 10}\nPKGSIZE_zlib: 86016\n')
+        self.write("runtime/zlib.packaged", "")
+        self.write("runtime/zlib-dev", 'PN: zlib\nPKG_zlib-dev: libz-dev\nFILES_INFO: {"/usr/include/zlib.h": 10, "/usr/lib/libz.so": 0}\n')
+        self.write("runtime/zlib-dev.packaged", "")
+        self.write("runtime/zlib-dbg", 'PN: zlib\nPKG_zlib-dbg: libz-dbg\nFILES_INFO: {}\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmpdir, name), "w") as f:
+            f.write(content)
+
+    def test_queries(self):
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.pkgmap(), {"zlib": "zlib", "zlib-dev": "zlib", "zlib-dbg": "zlib"})
+        self.assertEqual(index.package("zlib"), ("zlib", "libz1", True))
+        self.assertEqual(index.package("zlib-dbg"), ("zlib", "libz-dbg", False))
+        self.assertEqual(index.package("zlib-doc"), None)
+        self.assertEqual(index.reverse("libz-dev"), "zlib-dev")
+        # Not packaged, so there's no runtime package by that name
+        self.assertEqual(index.reverse("libz-dbg"), None)
+        self.assertEqual(index.runtime_packages(), ["libz-dev", "libz1"])
+        self.assertEqual(index.runtime_sizes(), {"libz1": 86016})
+        self.assertEqual(index.files("zlib-dev"), ["/usr/include/zlib.h", "/usr/lib/libz.so"])
+        self.assertEqual(index.files("zlib-dbg"), [])
+        self.assertEqual(index.find_path("/usr/lib/libz.so*"), [("zlib", "/usr/lib/libz.so.1"), ("zlib-dev", "/usr/lib/libz.so")])
+        self.assertEqual(index.find_path("*.h"), [("zlib-dev", "/usr/include/zlib.h")])
+        self.assertEqual(index.find_path("/usr/lib/libz.so"), [("zlib-dev", "/usr/lib/libz.so")])
+        index.close()
+
+    def test_refresh(self):
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.close()
+
+        # Recipe pkgdata replaced by sstate
+        os.remove(os.path.join(self.tmpdir, "zlib"))
+        self.write("zlib", "PACKAGES: zlib-dbg zlib\n")
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.package("zlib-dev"), None)
+        self.assertEqual(index.find_path("/usr/include/*"), [])
+        index.close()
+
+        os.remove(os.path.join(self.tmpdir, "zlib"))
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.pkgmap(), {})
+        self.assertEqual(index.find_path("*"), [])
+        index.close()
+
+    def test_refresh_runtime(self):
+        # Recipe pkgdata seen while sstate was still installing it
+        os.remove(os.path.join(self.tmpdir, "runtime", "zlib-dev"))
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.package("zlib-dev"), None)
+        index.close()
+
+        self.write("runtime/zlib-dev", 'PN: zlib\nPKG_zlib-dev: libz-dev\n')
+        os.remove(os.path.join(self.tmpdir, "runtime", "zlib.packaged"))
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.package("zlib-dev"), ("zlib", "libz-dev", True))
+        self.assertEqual(index.package("zlib"), ("zlib", "libz1", False))
+        index.close()
+
+    def test_complementary(self):
+        self.write("runtime/zlib-dbg.packaged", "")
+        self.write("bash", "PACKAGES: bash-dev bash\n")
+        self.write("runtime/bash", "PN: bash\nPKG_bash: bash\n")
+        self.write("runtime/bash.packaged", "")
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(oe.packagedata.complementary_packages(index, ["libz1", "bash", "foo"], ["*-dev", "*-dbg"]),
+                         set(["libz-dev", "libz-dbg"]))
+        # Packages already matching the globs aren't mapped again
+        self.assertEqual(oe.packagedata.complementary_packages(index, ["libz1", "libz-dev"], ["*-dev"]), set())
+        self.assertEqual(oe.packagedata.complementary_packages(index, ["libz1"], ["*-dev"], exclude="^libz"), set())
+        index.close()
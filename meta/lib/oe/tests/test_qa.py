@@ -0,0 +1,46 @@
+import unittest
+import os
+import shutil
+import tempfile
+import oe.qa
+
+class TestContentScanner(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_qa")
+        self.scanner = oe.qa.ContentScanner({"tmpdir": "/build/tmp",
+                                             "usr": "/usr/[^ :\n]+/[^ :\n]+"})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_search(self):
+        self.assertEqual(self.scanner.search("nothing here"), set())
+        self.assertEqual(self.scanner.search("x /build/tmp/y"), set(["tmpdir"]))
+        self.assertEqual(self.scanner.search("/usr/lib/foo\n/build/tmp"), set(["tmpdir", "usr"]))
+        # Overlapping matches are all found
+        self.assertEqual(self.scanner.search("/usr/lib/build/tmp"), set(["tmpdir", "usr"]))
+        scanner = oe.qa.ContentScanner({"a": "/usr/lib/x", "b": "/usr/lib"})
+        self.assertEqual(scanner.search("/usr/lib/x"), set(["a", "b"]))
+        # Patterns only match within a line
+        self.assertEqual(self.scanner.search("/usr/lib\n/foo"), set())
+
+    def test_scan(self):
+        path = self.write("script", "#!/bin/sh\nexec /usr/bin/foo/bar\n")
+        self.assertEqual(self.scanner.scan(path), set(["usr"]))
+        self.assertEqual(self.scanner.scan(self.write("empty", "")), set())
+        link = os.path.join(self.tmpdir, "link")
+        os.symlink(path, link)
+        self.assertEqual(self.scanner.scan(link), set())
+
+    def test_filters(self):
+        scanner = oe.qa.ContentScanner({"tmpdir": "/build/tmp", "usr": "/usr/[^ :\n]+/[^ :\n]+"},
+                                       {"usr": lambda path: path.endswith(".sh")})
+        content = "/build/tmp\n/usr/bin/foo/bar\n"
+        self.assertEqual(scanner.scan(self.write("data", content)), set(["tmpdir"]))
+        self.assertEqual(scanner.scan(self.write("script.sh", content)), set(["tmpdir", "usr"]))
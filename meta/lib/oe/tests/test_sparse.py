@@ -0,0 +1,86 @@
+import unittest
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import oe.sparse
+
+class TestSparse(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sparse")
+        self.source = os.path.join(self.tmpdir, "part.ext4")
+        with open(self.source, "wb") as f:
+            f.write(b"a" * 5000)
+            f.seek(1024 * 1024)
+            f.write(b"b" * 4096)
+            f.truncate(2 * 1024 * 1024)
+        self.image = os.path.join(self.tmpdir, "disk.direct")
+        with open(self.image, "wb") as f:
+            f.write(b"mbr")
+            f.truncate(4 * 1024 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def check_copy(self, copier):
+        copier.copy(self.source, self.image, 8192)
+        image = self.read(self.image)
+        self.assertEqual(len(image), 4 * 1024 * 1024)
+        self.assertEqual(image[:3], b"mbr")
+        self.assertEqual(image[8192:8192 + 2 * 1024 * 1024], self.read(self.source))
+        self.assertEqual(image[8192 + 2 * 1024 * 1024:].count(b"\0"), 2 * 1024 * 1024 - 8192)
+
+    def test_copy(self):
+        self.check_copy(oe.sparse.SparseCopier())
+
+    def test_copy_buffered(self):
+        copier = oe.sparse.SparseCopier()
+        copier.use_copy_file_range = False
+        self.check_copy(copier)
+
+    def test_length(self):
+        image = os.path.join(self.tmpdir, "small")
+        open(image, "wb").close()
+        oe.sparse.copy_sparse(self.source, image, 512, 4096)
+        self.assertEqual(self.read(image), b"\0" * 512 + b"a" * 4096)
+
+    def test_bmap(self):
+        bmap = os.path.join(self.tmpdir, "disk.bmap")
+        oe.sparse.copy_sparse(self.source, self.image, 8192)
+        oe.sparse.write_bmap(self.image, bmap)
+        content = self.read(bmap).decode()
+        self.assertIn("<ImageSize> 4194304 </ImageSize>", content)
+        self.assertIn("<BlocksCount> 1024 </BlocksCount>", content)
+
+        ranges = re.findall(r'<Range chksum="(\w+)"> ([\d-]+) </Range>', content)
+        image = self.read(self.image)
+        mapped = 0
+        for chksum, blocks in ranges:
+            first, last = [int(b) for b in (blocks + "-" + blocks).split("-")[:2]]
+            data = image[first * 4096:(last + 1) * 4096]
+            self.assertEqual(hashlib.sha256(data).hexdigest(), chksum)
+            mapped += last - first + 1
+        self.assertIn("<MappedBlocksCount> %d </MappedBlocksCount>" % mapped, content)
+        # Every block holding data is mapped
+        for block in range(1024):
+            if image[block * 4096:(block + 1) * 4096].strip(b"\0"):
+                self.assertTrue(any(int((b + "-" + b).split("-")[0]) <= block <= int((b + "-" + b).split("-")[1])
+                                    for c, b in ranges), block)
+
+        chksum = re.search(r"<BmapFileChecksum> (\w+) </BmapFileChecksum>", content).group(1)
+        self.assertEqual(hashlib.sha256(content.replace(chksum, "0" * 64).encode()).hexdigest(), chksum)
+
+    def test_export(self):
+        oe.sparse.copy_sparse(self.source, self.image, 8192)
+        chunks = []
+        bmap = os.path.join(self.tmpdir, "disk.bmap")
+        oe.sparse.export(self.image, chunks.append, bmap)
+        self.assertEqual(b"".join(chunks), self.read(self.image))
+        written = os.path.join(self.tmpdir, "disk.bmap2")
+        oe.sparse.write_bmap(self.image, written)
+        self.assertEqual(self.read(bmap), self.read(written))
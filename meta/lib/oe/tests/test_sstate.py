@@ -0,0 +1,117 @@
+import unittest
+import os
+import shutil
+import tempfile
+import oe.sstate
+
+class TestSstateDirIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstate")
+        os.makedirs(os.path.join(self.tmpdir, "ab"))
+        open(os.path.join(self.tmpdir, "ab", "sstate:foo:abcd_populate_sysroot.tgz"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_exists(self):
+        index = oe.sstate.SstateDirIndex(self.tmpdir)
+        self.assertTrue(index.exists("ab/sstate:foo:abcd_populate_sysroot.tgz"))
+        self.assertTrue(index.exists(os.path.join(self.tmpdir, "ab/sstate:foo:abcd_populate_sysroot.tgz")))
+        self.assertFalse(index.exists("ab/sstate:foo:abcd_package.tgz"))
+        self.assertFalse(index.exists("cd/sstate:foo:cdef_package.tgz"))
+
+class TestMirrorStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstate")
+        self.cachefile = os.path.join(self.tmpdir, "cache", "sstate-mirror-status")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        cache = oe.sstate.MirrorStatusCache(self.cachefile, "file://.* http://mirror/PATH", 100, 10)
+        self.assertEqual(cache.lookup("ab/hit.tgz", now=1000), None)
+        cache.record("ab/hit.tgz", True, now=1000)
+        cache.record("ab/miss.tgz", False, now=1000)
+        cache.save(now=1000)
+
+        cache = oe.sstate.MirrorStatusCache(self.cachefile, "file://.* http://mirror/PATH", 100, 10)
+        self.assertEqual(cache.lookup("ab/hit.tgz", now=1005), True)
+        self.assertEqual(cache.lookup("ab/miss.tgz", now=1005), False)
+        # Misses expire before hits
+        self.assertEqual(cache.lookup("ab/miss.tgz", now=1050), None)
+        self.assertEqual(cache.lookup("ab/hit.tgz", now=1050), True)
+        self.assertEqual(cache.lookup("ab/hit.tgz", now=1200), None)
+
+    def test_mirror_change(self):
+        cache = oe.sstate.MirrorStatusCache(self.cachefile, "file://.* http://mirror/PATH", 100, 10)
+        cache.record("ab/hit.tgz", True, now=1000)
+        cache.save(now=1000)
+
+        cache = oe.sstate.MirrorStatusCache(self.cachefile, "file://.* http://other/PATH", 100, 10)
+        self.assertEqual(cache.lookup("ab/hit.tgz", now=1000), None)
+
+    def test_disabled_ttl(self):
+        cache = oe.sstate.MirrorStatusCache(self.cachefile, "", 100, 0)
+        cache.record("ab/miss.tgz", False, now=1000)
+        self.assertEqual(cache.lookup("ab/miss.tgz", now=1000), None)
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstate")
+        self.src = os.path.join(self.tmpdir, "work", "sysroot-destdir")
+        os.makedirs(os.path.join(self.src, "usr", "bin"))
+        with open(os.path.join(self.src, "usr", "bin", "foo-config"), "w") as f:
+            f.write("prefix=/tmp/sysroots/qemux86/usr\n")
+        os.link(os.path.join(self.src, "usr", "bin", "foo-config"), os.path.join(self.src, "usr", "bin", "bar-config"))
+        os.symlink("/tmp/sysroots/qemux86/usr/lib", os.path.join(self.src, "usr", "lib"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        import io
+        members = [(self.src, "sysroot-destdir", "/tmp/sysroots/qemux86")]
+        data = io.BytesIO()
+        fixme = ["sysroot-destdir/usr/bin/bar-config", "sysroot-destdir/usr/bin/foo-config"]
+        oe.sstate.create_archive(data, members, "/tmp", fixme,
+                                 [("/tmp/sysroots/qemux86", "FIXMESTAGINGDIRHOST")])
+        # The source tree isn't modified
+        self.assertEqual(os.readlink(os.path.join(self.src, "usr", "lib")), "/tmp/sysroots/qemux86/usr/lib")
+
+        dest = os.path.join(self.tmpdir, "install")
+        data.seek(0)
+        oe.sstate.extract_archive(data, dest)
+        with open(os.path.join(dest, "sysroot-destdir", "usr", "bin", "foo-config")) as f:
+            self.assertEqual(f.read(), "prefix=FIXMESTAGINGDIRHOST/usr\n")
+        self.assertEqual(os.readlink(os.path.join(dest, "sysroot-destdir", "usr", "lib")), "./../../../sysroots/qemux86/usr/lib")
+        self.assertTrue(os.path.samefile(os.path.join(dest, "sysroot-destdir", "usr", "bin", "foo-config"),
+                                         os.path.join(dest, "sysroot-destdir", "usr", "bin", "bar-config")))
+
+class TestManifestIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstate")
+        self.dbfile = os.path.join(self.tmpdir, "files-index.sqlite3")
+        with open(os.path.join(self.tmpdir, "manifest-x86_64-zlib.populate_sysroot"), "w") as f:
+            f.write("/sysroot/usr/lib/libz.so\n/sysroot/usr/include/zlib.h\n/sysroot/usr/include/\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_populate(self):
+        index = oe.sstate.ManifestIndex(self.dbfile, self.tmpdir)
+        owners = index.owners(["/sysroot/usr/lib/libz.so", "/sysroot//usr/lib/libfoo.so", "/sysroot/usr/include/"])
+        self.assertEqual(owners, {"/sysroot/usr/lib/libz.so": os.path.join(self.tmpdir, "manifest-x86_64-zlib.populate_sysroot")})
+        index.close()
+
+    def test_add_remove(self):
+        index = oe.sstate.ManifestIndex(self.dbfile, self.tmpdir)
+        index.add("manifest-foo", ["/sysroot/usr/lib/libfoo.so", "/sysroot/usr/lib/"])
+        index.close()
+
+        index = oe.sstate.ManifestIndex(self.dbfile, self.tmpdir)
+        self.assertEqual(index.owners(["/sysroot/usr/lib/libfoo.so"]), {"/sysroot/usr/lib/libfoo.so": "manifest-foo"})
+        index.remove("manifest-foo")
+        self.assertEqual(index.owners(["/sysroot/usr/lib/libfoo.so"]), {})
+        self.assertEqual(len(index.owners(["/sysroot/usr/lib/libz.so"])), 1)
+        index.close()
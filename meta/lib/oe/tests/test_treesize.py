@@ -0,0 +1,40 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+import oe.treesize
+
+class TestTreeSize(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_treesize")
+        self.root = os.path.join(self.tmpdir, "rootfs")
+        os.makedirs(os.path.join(self.root, "usr", "bin"))
+        with open(os.path.join(self.root, "usr", "bin", "foo"), "w") as f:
+            f.write("x" * 10000)
+        os.link(os.path.join(self.root, "usr", "bin", "foo"), os.path.join(self.root, "usr", "bin", "bar"))
+        os.symlink("foo", os.path.join(self.root, "usr", "bin", "baz"))
+        with open(os.path.join(self.root, "usr", "bin", "sparse"), "w") as f:
+            f.truncate(1024 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def du(self, *args):
+        return int(subprocess.check_output(["du"] + list(args) + [self.root]).split()[0])
+
+    def test_matches_du(self):
+        size = oe.treesize.tree_size(self.root)
+        self.assertEqual(oe.treesize.usage_kb(size), self.du("-ks"))
+        self.assertEqual(oe.treesize.apparent_kb(size), self.du("-bks"))
+        # root, usr, bin, foo/bar, baz, sparse
+        self.assertEqual(size.inodes, 6)
+        self.assertTrue(size.blocks > size.usage)
+
+    def test_saved(self):
+        fn = os.path.join(self.tmpdir, "size")
+        self.assertEqual(oe.treesize.load_size(fn, self.root), None)
+        size = oe.treesize.tree_size(self.root)
+        oe.treesize.save_size(fn, self.root, size)
+        self.assertEqual(oe.treesize.load_size(fn, self.root), size)
+        self.assertEqual(oe.treesize.load_size(fn, self.tmpdir), None)
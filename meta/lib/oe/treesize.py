@@ -0,0 +1,89 @@
+#
+# Disk usage accounting for root filesystem trees
+#
+# A single walk of a tree gathers what the various "du" invocations used
+# to be run for: the apparent size (du -b), the allocated blocks with hard
+# links counted once (du -k) and the number of inodes. Nothing here checks
+# whether a tree changed since it was sized, as files edited in place
+# wouldn't be noticed by anything cheaper than another walk: save_size()
+# and load_size() let a build record the size of a tree once it is
+# complete and share it between the tasks using it, the recording being
+# removed whenever the tree is regenerated.
+#
+
+import os
+import stat
+import json
+from collections import namedtuple
+
+# Sizes in bytes of a tree: apparent is the sum of the file sizes, blocks
+# the allocated space counting every hard link and usage the allocated
+# space counting each inode once. inodes is the number of distinct inodes.
+TreeSize = namedtuple("TreeSize", ["apparent", "blocks", "usage", "inodes"])
+
+def _kb(size):
+    return (size + 1023) // 1024
+
+def apparent_kb(size):
+    """Round a TreeSize.apparent up to kilobytes, as "du -bk" reports it"""
+    return _kb(size.apparent)
+
+def usage_kb(size):
+    """Round a TreeSize.usage up to kilobytes, as "du -k" reports it"""
+    return _kb(size.usage)
+
+if hasattr(os, "scandir"):
+    def _entries(path):
+        for entry in os.scandir(path):
+            yield entry.name, entry.stat(follow_symlinks=False)
+else:
+    def _entries(path):
+        for name in os.listdir(path):
+            yield name, os.lstat(os.path.join(path, name))
+
+def scan(root):
+    """Walk root without following symlinks and return its TreeSize"""
+    st = os.lstat(root)
+    seen = set([(st.st_dev, st.st_ino)])
+    apparent = st.st_size
+    blocks = usage = st.st_blocks * 512
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        for name, st in _entries(path):
+            allocated = st.st_blocks * 512
+            blocks += allocated
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in seen:
+                    continue
+                seen.add(key)
+            else:
+                seen.add((st.st_dev, st.st_ino))
+            apparent += st.st_size
+            usage += allocated
+            if stat.S_ISDIR(st.st_mode):
+                pending.append(os.path.join(path, name))
+    return TreeSize(apparent, blocks, usage, len(seen))
+
+def tree_size(root):
+    """Return the TreeSize of root"""
+    return scan(os.path.abspath(root))
+
+def save_size(fn, root, size):
+    """Record size as the TreeSize of root in the file fn"""
+    tmpfn = "%s.%s" % (fn, os.getpid())
+    with open(tmpfn, "w") as f:
+        json.dump({"root": os.path.abspath(root), "size": list(size)}, f)
+    os.rename(tmpfn, fn)
+
+def load_size(fn, root):
+    """Return the TreeSize of root recorded in the file fn, or None"""
+    try:
+        with open(fn, "r") as f:
+            data = json.load(f)
+        if data["root"] == os.path.abspath(root):
+            return TreeSize(*data["size"])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
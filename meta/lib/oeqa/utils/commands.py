@@ -18,6 +18,8 @@ from oeqa.utils import CommandError
 from oeqa.utils import ftools
 import re
 import contextlib
+import hashlib
+import collections
 import bb
 
 class Command(object):
@@ -93,6 +95,15 @@ class Result(object):
 def runCmd(command, ignore_status=False, timeout=None, assert_error=True, **options):
     result = Result()
 
+    # Commands other than bitbake ones (devtool, recipetool, ...) may
+    # change the metadata, so environments recorded earlier are dropped
+    if isinstance(command, basestring):
+        program = command.split(None, 1)[0] if command.strip() else ""
+    else:
+        program = command[0] if command else ""
+    if program != "bitbake":
+        clear_bb_env_cache()
+
     cmd = Command(command, timeout=timeout, **options)
     cmd.run()
 
@@ -131,28 +142,129 @@ def bitbake(command, ignore_status=False, timeout=None, postconfig=None, **optio
             os.remove(postconfig_file)
 
 
-def get_bb_env(target=None, postconfig=None):
-    if target:
-        return bitbake("-e %s" % target, postconfig=postconfig).output
-    else:
-        return bitbake("-e", postconfig=postconfig).output
-
-def get_bb_var(var, target=None, postconfig=None):
-    val = None
-    bbenv = get_bb_env(target, postconfig=postconfig)
-    lastline = None
+# Parsed "bitbake -e" output, see get_bb_vars(), by (target, postconfig,
+# configuration signature)
+_bb_env_cache = collections.OrderedDict()
+_BB_ENV_CACHE_SIZE = 16
+
+class _BBEnvSnapshot(object):
+    """
+    The output of one "bitbake -e" run along with its variables and the
+    state of the files listed in its include history, which the snapshot
+    is only valid for
+    """
+    def __init__(self, output):
+        self.output = output
+        self.variables = _parse_bb_env(output)
+        self.files = dict((f, _file_state(f)) for f in _include_history(output))
+
+    def valid(self):
+        for f, state in self.files.items():
+            if _file_state(f) != state:
+                return False
+        return True
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def _include_history(bbenv):
+    """
+    Return the files and directories the include history at the start of
+    bitbake -e output lists, directories catching files appearing in them
+    (bbappends for instance)
+    """
+    paths = set()
+    started = False
     for line in bbenv.splitlines():
-        if re.search("^(export )?%s=" % var, line):
-            val = line.split('=', 1)[1]
-            val = val.strip('\"')
+        if not started:
+            started = line.startswith("# INCLUDE HISTORY:")
+            continue
+        if not line.startswith("#"):
             break
-        elif re.match("unset %s$" % var, line):
+        m = re.match(r"#\s+(/\S+?)(:)?(\s+includes:)?$", line)
+        if m:
+            paths.add(m.group(1))
+            paths.add(os.path.dirname(m.group(1)))
+    return paths
+
+def _parse_bb_env(bbenv):
+    """Return a dict of the variable values set in bitbake -e output"""
+    variables = {}
+    lastline = ""
+    assign = re.compile(r"^(?:export )?([^\s=#]+)=(.*)$")
+    for line in bbenv.splitlines():
+        m = assign.match(line)
+        if m:
+            variables.setdefault(m.group(1), m.group(2).strip('\"'))
+        elif line.startswith("unset "):
             # Handle [unexport] variables
-            if lastline.startswith('#   "'):
-                val = lastline.split('\"')[1]
-                break
+            var = line[6:]
+            if lastline.startswith('#   "') and var not in variables:
+                variables[var] = lastline.split('\"')[1]
         lastline = line
-    return val
+    return variables
+
+def _config_signature():
+    """
+    Return a checksum of the build configuration: the files in the conf
+    directory of the build (selftest.inc written by write_config() included)
+    """
+    h = hashlib.sha256()
+    confdir = os.path.join(os.environ.get('BUILDDIR', ''), 'conf')
+    try:
+        names = sorted(os.listdir(confdir))
+    except OSError:
+        names = []
+    for name in names:
+        path = os.path.join(confdir, name)
+        if not os.path.isfile(path):
+            continue
+        h.update(name.encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            h.update(f.read())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def clear_bb_env_cache():
+    """Forget the bitbake -e output recorded by get_bb_env() and get_bb_vars()"""
+    _bb_env_cache.clear()
+
+def _get_bb_env_snapshot(target=None, postconfig=None):
+    key = (target, postconfig, _config_signature())
+    snapshot = _bb_env_cache.get(key)
+    if snapshot is not None and snapshot.valid():
+        return snapshot
+    if target:
+        output = bitbake("-e %s" % target, postconfig=postconfig).output
+    else:
+        output = bitbake("-e", postconfig=postconfig).output
+    snapshot = _BBEnvSnapshot(output)
+    _bb_env_cache.pop(key, None)
+    _bb_env_cache[key] = snapshot
+    while len(_bb_env_cache) > _BB_ENV_CACHE_SIZE:
+        _bb_env_cache.popitem(last=False)
+    return snapshot
+
+def get_bb_env(target=None, postconfig=None):
+    return _get_bb_env_snapshot(target, postconfig).output
+
+def get_bb_vars(variables=None, target=None, postconfig=None):
+    """
+    Return a dict of the values of variables (all of them if None) for
+    target, None for those not set. bitbake -e is only run again once the
+    configuration or the files it was parsed from change.
+    """
+    values = _get_bb_env_snapshot(target, postconfig).variables
+    if variables is None:
+        return dict(values)
+    return dict((var, values.get(var)) for var in variables)
+
+def get_bb_var(var, target=None, postconfig=None):
+    return get_bb_vars([var], target, postconfig)[var]
 
 def get_test_layer():
     layers = get_bb_var("BBLAYERS").split()
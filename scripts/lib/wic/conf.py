@@ -40,7 +40,9 @@ class ConfigMgr(object):
             "release": None,
             "logfile": None,
             "name_prefix": None,
-            "name_suffix": None}
+            "name_suffix": None,
+            "jobs": None,
+            "bmap": False}
         }
 
     # make the manager class as singleton
@@ -32,6 +32,7 @@ import os
 import sys
 
 from wic import msger, creator
+from wic.conf import configmgr
 from wic.utils import misc
 from wic.plugin import pluginmgr
 from wic.utils.oe import misc
@@ -145,7 +146,7 @@ def list_source_plugins():
 
 def wic_create(wks_file, rootfs_dir, bootimg_dir, kernel_dir,
                native_sysroot, scripts_path, image_output_dir,
-               compressor, debug):
+               compressor, debug, jobs=None, bmap=False):
     """Create image
 
     wks_file - user-defined OE kickstart file
@@ -156,6 +157,8 @@ def wic_create(wks_file, rootfs_dir, bootimg_dir, kernel_dir,
     scripts_path - absolute path to /scripts dir
     image_output_dir - dirname to create for image
     compressor - compressor utility to compress the image
+    jobs - number of partitions to prepare at the same time
+    bmap - whether to generate a bmap file for each image
 
     Normally, the values for the build artifacts values are determined
     by 'wic -e' from the output of the 'bitbake -e' command given an
@@ -184,6 +187,10 @@ def wic_create(wks_file, rootfs_dir, bootimg_dir, kernel_dir,
     if debug:
         msger.set_loglevel('debug')
 
+    if jobs:
+        configmgr.create['jobs'] = jobs
+    configmgr.create['bmap'] = bmap
+
     crobj = creator.Creator()
 
     crobj.main(["direct", native_sysroot, kernel_dir, bootimg_dir, rootfs_dir,
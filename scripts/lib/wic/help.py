@@ -152,7 +152,7 @@ SYNOPSIS
         [-e | --image-name] [-s, --skip-build-check] [-D, --debug]
         [-r, --rootfs-dir] [-b, --bootimg-dir]
         [-k, --kernel-dir] [-n, --native-sysroot] [-f, --build-rootfs]
-        [-c, --compress-with]
+        [-c, --compress-with] [-j, --jobs] [-m, --bmap]
 
 DESCRIPTION
     This command creates an OpenEmbedded image based on the 'OE
@@ -202,6 +202,15 @@ DESCRIPTION
     displays the command sequence used, and should be included in any
     bug report describing unexpected results.
 
+    The -j option is used to specify the number of partitions whose
+    filesystems are created at the same time, and the number of threads
+    compressing the image when -c is used.  It defaults to the number
+    of CPUs.
+
+    The -m option is used to generate a .bmap file next to each image,
+    which bmaptool can use to write only the blocks of the image
+    holding data to the target media.
+
     When 'wic -e' is used, the locations for the build artifacts
     values are determined by 'wic -e' from the output of the 'bitbake
     -e' command given an image name e.g. 'core-image-minimal' and a
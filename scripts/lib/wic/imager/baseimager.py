@@ -62,6 +62,13 @@ class BaseImageCreator(object):
         # setup tmpfs tmpdir when enabletmpfs is True
         self.enabletmpfs = False
 
+        # number of partitions prepared at the same time, None for one
+        # per CPU
+        self.jobs = None
+
+        # whether to write a bmap file next to every disk image
+        self.bmap = False
+
         if createopts:
             # Mapping table for variables that have different names.
             optmap = {"outdir" : "destdir",
@@ -29,17 +29,25 @@ import shutil
 
 from wic import msger
 from wic.utils import fs_related
-from wic.utils.oe.misc import get_bitbake_var
+from wic.utils.oe.misc import get_bitbake_var, BB_VARS
 from wic.utils.partitionedfs import Image
 from wic.utils.errors import CreatorError, ImageError
 from wic.imager.baseimager import BaseImageCreator
 from wic.plugin import pluginmgr
-from wic.utils.oe.misc import exec_cmd
+from wic.utils.jobs import run_jobs
+import oe.sparse
+import oe.compress
 
 disk_methods = {
     "do_install_disk":None,
 }
 
+COMPRESSOR_SUFFIXES = {
+    "gzip": ".gz",
+    "bzip2": ".bz2",
+    "xz": ".xz",
+}
+
 class DirectImageCreator(BaseImageCreator):
     """
     Installs a system into a file containing a partitioned disk image.
@@ -232,6 +240,19 @@ class DirectImageCreator(BaseImageCreator):
         shutil.rmtree(self.workdir)
         os.mkdir(self.workdir)
 
+        # get the variables of all the images used at once: ROOTFS_SIZE
+        # of the --rootfs-dir named in the .wks file (see below) and
+        # IMAGE_ROOTFS of the image it is mapped to (see the rootfs plugin)
+        images = set()
+        for part in parts:
+            names = [part.rootfs_dir]
+            names.append(self.rootfs_dir.get(part.rootfs_dir or 'ROOTFS_DIR',
+                                             part.rootfs_dir))
+            for image_name in names:
+                if image_name and not os.path.isdir(image_name):
+                    images.add(image_name)
+        BB_VARS.prefetch(sorted(images), ["IMAGE_ROOTFS", "ROOTFS_SIZE"])
+
         for part in parts:
             # get rootfs size from bitbake variable if it's not set in .ks file
             if not part.size:
@@ -245,17 +266,39 @@ class DirectImageCreator(BaseImageCreator):
                     rsize_bb = get_bitbake_var('ROOTFS_SIZE', image_name)
                     if rsize_bb:
                         part.size = int(round(float(rsize_bb)))
-            # need to create the filesystems in order to get their
-            # sizes before we can add them and do the layout.
-            # Image.create() actually calls __format_disks() to create
-            # the disk images and carve out the partitions, then
-            # self.assemble() calls Image.assemble() which calls
-            # __write_partitition() for each partition to dd the fs
-            # into the partitions.
-            part.prepare(self, self.workdir, self.oe_builddir, self.rootfs_dir,
+
+        # need to create the filesystems in order to get their
+        # sizes before we can add them and do the layout.
+        # Image.create() actually calls __format_disks() to create
+        # the disk images and carve out the partitions, then
+        # self.assemble() calls Image.assemble() which calls
+        # __write_partitition() for each partition to dd the fs
+        # into the partitions.
+        # The filesystems are independent of each other, so they are
+        # created at the same time.  The source plugins stage their
+        # files at fixed paths under the work dir they are given (and
+        # some of them clean it up first), so every partition gets a
+        # work dir of its own.
+        def prepare(part):
+            part_workdir = os.path.join(self.workdir, "part%d" % part.lineno)
+            os.mkdir(part_workdir)
+            part.prepare(self, part_workdir, self.oe_builddir, self.rootfs_dir,
                          self.bootimg_dir, self.kernel_dir, self.native_sysroot)
 
+        failed = []
+        for part, result, err in run_jobs(prepare, parts, self.jobs):
+            if err is not None:
+                name = part.mountpoint or part.label or part.disk
+                if isinstance(err, SystemExit):
+                    # msger.error() already printed the reason
+                    failed.append("%s (line %d)" % (name, part.lineno))
+                else:
+                    failed.append("%s (line %d): %s" % (name, part.lineno, err))
+        if failed:
+            msger.error("Failed to prepare the partitions:\n  %s" % \
+                        "\n  ".join(failed))
 
+        for part in parts:
             self.__image.add_partition(int(part.size),
                                        part.disk,
                                        part.mountpoint,
@@ -313,13 +356,29 @@ class DirectImageCreator(BaseImageCreator):
                                                         self.bootimg_dir,
                                                         self.kernel_dir,
                                                         self.native_sysroot)
-        # Compress the image
-        if self.compressor:
-            for disk_name, disk in self.__image.disks.items():
-                full_path = self._full_path(self.__imgdir, disk_name, "direct")
-                msger.debug("Compressing disk %s with %s" % \
-                            (disk_name, self.compressor))
-                exec_cmd("%s %s" % (self.compressor, full_path))
+        # Compress the images, writing their block maps and the
+        # checksums of the compressed files in the same pass
+        for disk_name, disk in self.__image.disks.items():
+            full_path = self._full_path(self.__imgdir, disk_name, "direct")
+            bmap_path = None
+            if self.bmap:
+                msger.debug("Generating bmap file for %s" % disk_name)
+                bmap_path = full_path + ".bmap"
+            if not self.compressor:
+                if bmap_path:
+                    oe.sparse.write_bmap(full_path, bmap_path)
+                continue
+
+            msger.debug("Compressing disk %s with %s" % \
+                        (disk_name, self.compressor))
+            dest = full_path + COMPRESSOR_SUFFIXES[self.compressor]
+            with open(dest, "wb") as out:
+                hashing = oe.compress.HashingFile(out, ["sha256"])
+                with oe.compress.compress_writer(self.compressor, hashing,
+                                                 threads=self.jobs) as writer:
+                    oe.sparse.export(full_path, writer.write, bmap_path)
+            oe.compress.write_checksums(dest, ["sha256"], hashing.hashes)
+            os.remove(full_path)
 
     def print_outimage_info(self):
         """
@@ -330,12 +389,12 @@ class DirectImageCreator(BaseImageCreator):
         parts = self._get_parts()
 
         for disk_name in self.__image.disks:
-            extension = "direct" + {"gzip": ".gz",
-                                    "bzip2": ".bz2",
-                                    "xz": ".xz",
-                                    "": ""}.get(self.compressor)
+            extension = "direct" + COMPRESSOR_SUFFIXES.get(self.compressor, "")
             full_path = self._full_path(self.__imgdir, disk_name, extension)
             msg += '  %s\n\n' % full_path
+            if self.bmap:
+                bmap_path = self._full_path(self.__imgdir, disk_name, "direct.bmap")
+                msg += '  %s\n\n' % bmap_path
 
         msg += 'The following build artifacts were used to create the image(s):\n'
         for part in parts:
@@ -0,0 +1,56 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# DESCRIPTION
+# Bounded pool of worker threads running independent pieces of image
+# creation work (mkfs runs and the like) at the same time.
+#
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+def default_jobs():
+    """Number of jobs run at a time when not set explicitly"""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def run_jobs(func, items, jobs=None):
+    """
+    Call func(item) for every item, running up to jobs of them at a time.
+
+    Returns a list of (item, result, error) tuples in the order of items,
+    error being the exception func raised for that item, including the
+    SystemExit raised by msger.error(), or None.
+    """
+    def job(item):
+        try:
+            return (item, func(item), None)
+        except (Exception, SystemExit) as err:
+            return (item, None, err)
+
+    items = list(items)
+    jobs = min(jobs or default_jobs(), len(items))
+    if jobs <= 1:
+        return [job(item) for item in items]
+
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(job, items, 1)
+    finally:
+        pool.close()
+        pool.join()
@@ -27,6 +27,11 @@
 """Miscellaneous functions."""
 
 import os
+import re
+import stat
+import json
+import hashlib
+import threading
 from collections import defaultdict
 
 from wic import msger
@@ -141,6 +146,48 @@ def exec_native_cmd(cmd_and_args, native_sysroot, catch=3, pseudo=""):
 
 BOOTDD_EXTRA_SPACE = 16384
 
+def _closed(value):
+    """Whether value ends with a closing quote, not an escaped one"""
+    if not value.endswith('"'):
+        return False
+    return (len(value) - len(value[:-1].rstrip("\\")) - 1) % 2 == 0
+
+def parse_env(lines):
+    """
+    Parse the variable assignments in 'bitbake -e' output or in an .env
+    file and return them as a dict. Values may contain '=', escaped
+    quotes and dollar signs and, in 'bitbake -e' output, newlines
+    continued on the following lines.
+    """
+    result = {}
+    lines = iter(lines)
+    for line in lines:
+        line = line.rstrip("\n")
+        match = re.match(r'^(?:export )?(\w+)=(.*)$', line)
+        if not match:
+            continue
+        key, value = match.group(1), match.group(2).strip()
+        if not value.startswith('"'):
+            result[key] = value
+            continue
+
+        value = value[1:]
+        parts = []
+        while value is not None and not _closed(value):
+            # Newlines in values are output as " \" at the end of the line
+            if value.endswith(" \\"):
+                value = value[:-2]
+            parts.append(value)
+            value = next(lines, None)
+            if value is not None:
+                value = value.rstrip("\n")
+        if value is None:
+            break
+        parts.append(value[:-1])
+        value = "\n".join(parts)
+        result[key] = value.replace('\\"', '"').replace('\\$', '$')
+    return result
+
 class BitbakeVars(defaultdict):
     """
     Container for Bitbake variables.
@@ -152,21 +199,165 @@ class BitbakeVars(defaultdict):
         self.default_image = None
         self.vars_dir = None
 
-    def _parse_line(self, line, image):
+        # partitions are prepared in parallel and bitbake can't be run
+        # more than once at a time
+        self.lock = threading.RLock()
+
+        # image -> names of the variables known for it, for images whose
+        # variables were exported by prefetch() rather than all read
+        self.exported = {}
+
+    def _add(self, image, values, exported=None):
+        """Store the variables of image"""
+        self[image] = values
+        if exported is None:
+            self.exported.pop(image, None)
+        else:
+            self.exported[image] = set(exported)
+
+        # Make first image a default set of variables
+        images = [key for key in self if key]
+        if len(images) == 1 and image:
+            self[None] = self[image]
+            if image in self.exported:
+                self.exported[None] = self.exported[image]
+            else:
+                self.exported.pop(None, None)
+
+    @staticmethod
+    def _cache_file(image, names):
         """
-        Parse one line from bitbake -e output or from .env file.
-        Put result key-value pair into the storage.
+        Path of the on-disk cache of the variables of image, keyed by the
+        build configuration: the conf files of the build directory and
+        the environment passed to bitbake.
+        """
+        builddir = os.environ.get("BUILDDIR")
+        if not builddir:
+            return None
+        key = hashlib.sha256()
+        key.update(str(image))
+        key.update(" ".join(sorted(names)))
+        confdir = os.path.join(builddir, "conf")
+        if os.path.isdir(confdir):
+            for fname in sorted(os.listdir(confdir)):
+                if fname.endswith(".conf"):
+                    with open(os.path.join(confdir, fname)) as conf:
+                        key.update(fname + "\0" + conf.read())
+        for var in sorted(set(os.environ.get("BB_ENV_EXTRAWHITE", "").split())):
+            key.update("%s=%s\0" % (var, os.environ.get(var, "")))
+        return os.path.join(builddir, "cache", "wic", "%s-%s.json" % \
+                            (image or "default", key.hexdigest()))
+
+    @staticmethod
+    def _load_cache(fname):
+        """
+        Return the variables saved in cache file fname if none of the
+        files they were parsed from changed since, else None
         """
-        if "=" not in line:
-            return
         try:
-            key, val = line.split("=")
-        except ValueError:
+            with open(fname) as cache:
+                data = json.load(cache)
+            for depfile, mtime in data["depends"]:
+                try:
+                    if os.stat(depfile)[stat.ST_MTIME] != mtime:
+                        return None
+                except OSError:
+                    # A file which didn't exist must still not exist
+                    if mtime:
+                        return None
+            # json returns unicode, the values from bitbake -e are
+            # UTF-8 encoded strings
+            return dict((key.encode("utf-8"), val.encode("utf-8"))
+                        for key, val in data["vars"].items())
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def prefetch(self, images, names=()):
+        """
+        Get the variables listed in WICVARS, and in names, for all of the
+        given images in one go instead of running 'bitbake -e' for each
+        of them. The values come from the on-disk cache when none of the
+        files they were parsed from changed, and otherwise from a single
+        bitbake (tinfoil) instance parsing all of the image recipes.
+        Images already known or read from .env files are skipped.
+        Variables which can't be fetched are left to get_var().
+        """
+        with self.lock:
+            wanted = []
+            for image in images:
+                if image in self or image in wanted or (image and self.vars_dir):
+                    continue
+                wanted.append(image)
+            if not wanted:
+                return
+
+            names = set(names)
+            wicvars = self._load_cache(self._cache_file("WICVARS", names) or "")
+            if wicvars is not None:
+                names.update(wicvars["WICVARS"].split())
+                remaining = []
+                for image in wanted:
+                    values = self._load_cache(self._cache_file(image, names) or "")
+                    if values is None:
+                        remaining.append(image)
+                    else:
+                        self._add(image, values, names)
+                wanted = remaining
+                if not wanted:
+                    return
+
+            try:
+                self._export(wanted, names)
+            except Exception as err:
+                msger.debug("Couldn't export bitbake variables for %s: %s" % \
+                            (", ".join(str(image) for image in wanted), err))
+
+    def _export(self, images, names):
+        import scriptpath
+        if not scriptpath.add_bitbake_lib_path():
             return
-        key = key.strip()
-        val = val.strip()
-        if key.replace('_', '').isalnum():
-            self[image][key] = val.strip('"')
+        import bb.tinfoil
+        import oe.recipeutils
+
+        def save(image, keynames, values, datastore):
+            fname = self._cache_file(image, keynames)
+            if not fname:
+                return
+            depends = (datastore.getVar("__base_depends", False) or []) + \
+                      (datastore.getVar("__depends", False) or [])
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            with open(fname, "w") as cache:
+                json.dump({"vars": values, "depends": depends}, cache)
+
+        tinfoil = bb.tinfoil.Tinfoil()
+        try:
+            tinfoil.prepare(False)
+            config = tinfoil.config_data
+
+            wicvars = config.getVar("WICVARS", True) or ""
+            save("WICVARS", names, {"WICVARS": wicvars}, config)
+            names = names | set(wicvars.split())
+
+            for image in images:
+                if image:
+                    try:
+                        datastore = oe.recipeutils.parse_recipe_simple(tinfoil.cooker,
+                                                                       image, config)
+                    except Exception as err:
+                        msger.debug("Couldn't parse %s: %s" % (image, err))
+                        continue
+                else:
+                    datastore = config
+                values = {}
+                for name in names:
+                    value = datastore.getVar(name, True)
+                    if value is not None:
+                        values[name] = value
+                save(image, names, values, datastore)
+                self._add(image, values, names)
+        finally:
+            tinfoil.shutdown()
 
     def get_var(self, var, image=None):
         """
@@ -174,17 +365,20 @@ class BitbakeVars(defaultdict):
         This is a lazy method, i.e. it runs bitbake or parses file only when
         only when variable is requested. It also caches results.
         """
+        with self.lock:
+            return self._get_var(var, image)
+
+    def _get_var(self, var, image):
         if not image:
             image = self.default_image
 
-        if image not in self:
+        if image not in self or var not in self.exported.get(image, (var,)):
             if image and self.vars_dir:
                 fname = os.path.join(self.vars_dir, image + '.env')
                 if os.path.isfile(fname):
                     # parse .env file
                     with open(fname) as varsfile:
-                        for line in varsfile:
-                            self._parse_line(line, image)
+                        self._add(image, parse_env(varsfile))
                 else:
                     print "Couldn't get bitbake variable from %s." % fname
                     print "File %s doesn't exist." % fname
@@ -206,13 +400,7 @@ class BitbakeVars(defaultdict):
                     return
 
                 # Parse bitbake -e output
-                for line in lines.split('\n'):
-                    self._parse_line(line, image)
-
-            # Make first image a default set of variables
-            images = [key for key in self if key]
-            if len(images) == 1:
-                self[None] = self[image]
+                self._add(image, parse_env(lines.split('\n')))
 
         return self[image].get(var)
 
@@ -18,10 +18,14 @@
 # with this program; if not, write to the Free Software Foundation, Inc., 59
 # Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+# oe is meta/lib/oe here, not wic.utils.oe
+from __future__ import absolute_import
+
 import os
 from wic import msger
 from wic.utils.errors import ImageError
-from wic.utils.oe.misc import exec_cmd, exec_native_cmd
+from wic.utils.oe.misc import exec_native_cmd
+import oe.sparse
 
 # Overhead of the MBR partitioning scheme (just one sector)
 MBR_OVERHEAD = 1
@@ -336,14 +340,16 @@ class Image(object):
     def assemble(self, image_file):
         msger.debug("Installing partitions")
 
+        # The disk image is sparse, so only the data of the partitions
+        # needs copying
+        copier = oe.sparse.SparseCopier()
         for part in self.partitions:
             source = part['source_file']
             if source:
                 # install source_file contents into a partition
-                cmd = "dd if=%s of=%s bs=%d seek=%d count=%d conv=notrunc" % \
-                      (source, image_file, self.sector_size,
-                       part['start'], part['size'])
-                exec_cmd(cmd)
+                copier.copy(source, image_file,
+                            part['start'] * self.sector_size,
+                            part['size'] * self.sector_size)
 
                 msger.debug("Installed %s in partition %d, sectors %d-%d, "
                             "size %d sectors" % \